@@ -0,0 +1,186 @@
+"""Compare the plans of the NOT IN and NOT EXISTS "not yet handled" queries.
+
+Runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on the files-to-process and
+files-not-in-events queries, in their former NOT IN form and in the
+NOT EXISTS anti-join form built by `database_queries`, and reports the
+planning and execution times (median of --repeat runs) together with
+the top plan node of each query. With --output, the arguments and the
+timings of both forms are also written to a JSON file, so runs before
+and after a change can be compared.
+
+The database connection is configured with the same DB_BALAM_TEST_*
+environment variables used by the test suite, so the numbers are
+reproducible against the seeded test database.
+
+Usage:
+    python benchmarks/balam/bench_anti_join_plans.py --project SiPeCaM \\
+        --site 13 --pipeline-name megadetector --pipeline-version v5 --repeat 5 \\
+        --output anti_join_plans.json
+"""
+import argparse
+import json
+import statistics
+
+from ds_db_access.balam.balam_models import database
+from ds_db_access.balam.balam_models import Ecosystems
+from ds_db_access.balam.balam_models import Events
+from ds_db_access.balam.balam_models import EventsFiles
+from ds_db_access.balam.balam_models import Files
+from ds_db_access.balam.balam_models import PipelineInfo
+from ds_db_access.balam.balam_models import ProcessedFiles
+from ds_db_access.balam.balam_models import ProjectDevices
+from ds_db_access.balam.balam_models import Projects
+from ds_db_access.balam.balam_models import SamplingAreas
+from ds_db_access.balam.balam_models import SamplingPoints
+from ds_db_access.balam.balam_models import Sites
+from ds_db_access.balam.database_queries import _files_data_to_process_query
+from ds_db_access.balam.database_queries import _files_id_not_in_events_query
+from ds_db_access.balam.database_queries import _datetime_expression
+
+
+def legacy_files_data_to_process_query(mime_type, pipeline_name, pipeline_version, site, project_title):
+    """`_files_data_to_process_query` with its former NOT IN filter."""
+    datetime_expression = _datetime_expression([project_title])
+    return (
+        Files
+        .select(
+            Files.id.alias('file_id'),
+            Files.url,
+            Sites.identifier.alias('site_identifier'),
+            datetime_expression.alias('datetime'),
+            Files.file_metadata['Longitude'].alias('longitude'),
+            Files.file_metadata['Latitude'].alias('latitude'),
+            Sites.identifier.alias('site'),
+            SamplingAreas.identifier.alias('sampling_area'),
+            ProjectDevices.project_serial_number.alias('device'),
+            Ecosystems.name.alias('ecosystem'),
+            Events.identifier.alias('seq_id'),
+            Projects.title.alias('project_title')
+        )
+        .join(Projects, on=(Projects.id == Files.project))
+        .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point))
+        .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area))
+        .join(Sites, on=(Sites.id == SamplingPoints.site))
+        .join(ProjectDevices, on=(SamplingPoints.device == ProjectDevices.id))
+        .left_outer_join(EventsFiles, on=(EventsFiles.file == Files.id))
+        .left_outer_join(Events, on=(Events.id == EventsFiles.event))
+        .left_outer_join(Ecosystems, on=(Ecosystems.id == Sites.ecosystem))
+        .where(
+            (Files.id.not_in(
+                ProcessedFiles
+                .select(ProcessedFiles.file)
+                .where(
+                    ProcessedFiles.pipeline <<
+                    PipelineInfo.select(PipelineInfo.id).where(
+                        PipelineInfo.name == pipeline_name,
+                        PipelineInfo.version == pipeline_version))
+            )) &
+            (Projects.title.in_([project_title])) &
+            (Files.mime_type % mime_type) &
+            (Sites.identifier.in_([site]))
+        )
+    )
+
+
+def legacy_files_id_not_in_events_query(project_title, mime_type, site_identifier):
+    """`_files_id_not_in_events_query` with its former NOT IN filter."""
+    datetime_expression = _datetime_expression([project_title])
+    return (
+        Files
+        .select(
+            Files.id.alias('file_id'),
+            Files.url.alias('url'),
+            datetime_expression.alias('datetime'),
+            Files.file_metadata['Longitude'].alias('longitude'),
+            Files.file_metadata['Latitude'].alias('latitude'),
+            Sites.identifier.alias('site_identifier'),
+            SamplingAreas.identifier.alias('sampling_area'),
+            ProjectDevices.project_serial_number.alias('device'),
+            Projects.title.alias('project_title'),
+        )
+        .join(Projects, on=(Projects.id == Files.project_id))
+        .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
+        .join(Sites, on=(Sites.id == SamplingPoints.site_id))
+        .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area_id))
+        .join(ProjectDevices, on=(SamplingPoints.device_id == ProjectDevices.id))
+        .where(
+            (Files.id.not_in(
+                EventsFiles
+                .select(EventsFiles.file_id)
+                .join(Files, on=(Files.id == EventsFiles.file_id))
+                .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
+                .join(Sites, on=(Sites.id == SamplingPoints.site_id))
+                .where(
+                    (Files.project_id.in_(
+                        Projects.select(Projects.id).where(Projects.title == project_title)))
+                    & (Files.mime_type % mime_type)
+                    & (Sites.identifier == site_identifier)
+                )
+            ))
+            & (Projects.title.in_([project_title]))
+            & (Files.mime_type % mime_type)
+            & (Sites.identifier.in_([site_identifier]))
+        )
+    )
+
+
+def explain_analyze(query) -> dict:
+    sql, params = query.sql()
+    cursor = database.execute_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def measure(query, repeat: int) -> dict:
+    explains = [explain_analyze(query) for _ in range(repeat)]
+    top_node = explains[-1]['Plan']
+    return {'planning_ms': statistics.median(e['Planning Time'] for e in explains),
+            'execution_ms': statistics.median(e['Execution Time'] for e in explains),
+            'rows': top_node.get('Actual Rows'),
+            'node': top_node['Node Type']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--project', default='SiPeCaM')
+    parser.add_argument('--site', required=True)
+    parser.add_argument('--pipeline-name', required=True)
+    parser.add_argument('--pipeline-version', required=True)
+    parser.add_argument('--mime-type', default='image/%')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="Path of a JSON file to write the timings to")
+    args = parser.parse_args()
+
+    to_process_args = {'mime_type': args.mime_type,
+                       'pipeline_name': args.pipeline_name,
+                       'pipeline_version': args.pipeline_version,
+                       'site': args.site,
+                       'project_title': args.project}
+    not_in_events_args = {'project_title': args.project,
+                          'mime_type': args.mime_type,
+                          'site_identifier': args.site}
+    queries = [
+        ('to_process', 'NOT IN', legacy_files_data_to_process_query(**to_process_args)),
+        ('to_process', 'NOT EXISTS', _files_data_to_process_query(**to_process_args)),
+        ('no_events', 'NOT IN', legacy_files_id_not_in_events_query(**not_in_events_args)),
+        ('no_events', 'NOT EXISTS', _files_id_not_in_events_query(**not_in_events_args)),
+    ]
+
+    results = []
+    print(f"{'query':<12} {'form':<11} {'planning ms':>12} {'execution ms':>13} {'rows':>8}  top node")
+    for name, form, query in queries:
+        result = measure(query, args.repeat)
+        results.append({'query': name, 'form': form, **result})
+        print(f"{name:<12} {form:<11} {result['planning_ms']:>12.2f} {result['execution_ms']:>13.2f} "
+              f"{result['rows']:>8}  {result['node']}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump({'arguments': vars(args), 'results': results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Compare the observation ingest engines against the Balam test database.
+
+Inserts the same synthetic observations with the per-row writer
+(`insert_observations_and_observations_geom`), with multi-row INSERTs
+(`insert_observations_bulk`) and with COPY (`copy_observations`), reports
+rows per second for each engine and removes the inserted rows afterwards.
+
+The database connection is configured with the same DB_BALAM_TEST_*
+environment variables used by the test suite.
+
+Usage:
+    python benchmarks/balam/bench_observation_ingest.py --rows 20000
+"""
+import argparse
+import time
+import uuid
+
+import pandas as pd
+
+from ds_db_access.balam.balam_models import ObservationGeom
+from ds_db_access.balam.balam_models import Observations
+from ds_db_access.balam.database_queries import copy_observations
+from ds_db_access.balam.database_queries import insert_observations_and_observations_geom
+from ds_db_access.balam.database_queries import insert_observations_bulk
+
+# Fixtures shared with test/balam/test_database_queries.py
+FILE_ID = '95c80f34-14c4-43c0-b1e4-a427742578a2'
+PROJECT_ID = 'a500a996-35dd-4fce-a43f-424c41e398a9'
+PIPELINE_ID = '9837d91b-9ae3-4cea-b4f4-50c6b239c2cd'
+USER_ID = '699c9a06-8f1c-485f-9a57-3a28c905b9da'
+OBSERVATION_METHOD_ID = 'a92d1b4c-e226-47d8-8d12-f5aaac4cd811'
+
+
+def synthetic_observations(rows: int, file_id: str) -> pd.DataFrame:
+    return pd.DataFrame({
+        'id': [str(uuid.uuid4()) for _ in range(rows)],
+        'file_id': file_id,
+        'observation_type': 'animal',
+        'observation_tag': [{"predicted_label": "small bird"} for _ in range(rows)],
+        'bbox': '0,0,100,100',
+        'score': 0.9,
+        'confidence': 0.95,
+        'video_frame_num': list(range(rows)),
+        'taxon_id': 'taxon_id_1'
+    })
+
+
+def ingest_row_by_row(observations_df: pd.DataFrame, **ids):
+    for row in observations_df.to_dict('records'):
+        insert_observations_and_observations_geom(file_id=row['file_id'],
+                                                  observation_id=row['id'],
+                                                  observation_type=row['observation_type'],
+                                                  observation_tag=row['observation_tag'],
+                                                  bbox=row['bbox'],
+                                                  score=row['score'],
+                                                  confidence=row['confidence'],
+                                                  video_frame_num=row['video_frame_num'],
+                                                  taxon_id=row['taxon_id'],
+                                                  **ids)
+
+
+def ingest_bulk(observations_df: pd.DataFrame, **ids):
+    insert_observations_bulk(observations_df, **ids)
+
+
+def ingest_copy(observations_df: pd.DataFrame, **ids):
+    copy_observations(observations_df, **ids)
+
+
+def cleanup(observation_ids: list):
+    geom_ids = [obs.geom_id for obs in
+                Observations.select(Observations.geom).where(Observations.id.in_(observation_ids))]
+    Observations.delete().where(Observations.id.in_(observation_ids)).execute()
+    ObservationGeom.delete().where(ObservationGeom.id.in_(geom_ids)).execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--row-by-row-rows', type=int, default=2000,
+                        help="Rows used for the per-row engine, which is extrapolated.")
+    parser.add_argument('--file-id', default=FILE_ID)
+    args = parser.parse_args()
+
+    ids = {'project_id': PROJECT_ID,
+           'pipeline_id': PIPELINE_ID,
+           'user_id': USER_ID,
+           'observation_method_id': OBSERVATION_METHOD_ID}
+    engines = [('row-by-row', ingest_row_by_row, args.row_by_row_rows),
+               ('insert_many', ingest_bulk, args.rows),
+               ('copy', ingest_copy, args.rows)]
+
+    print(f"{'engine':<12} {'rows':>8} {'seconds':>10} {'rows/s':>10}")
+    for name, ingest_function, rows in engines:
+        observations_df = synthetic_observations(rows, args.file_id)
+        start = time.perf_counter()
+        try:
+            ingest_function(observations_df, **ids)
+            elapsed = time.perf_counter() - start
+        finally:
+            cleanup(observations_df['id'].tolist())
+        print(f"{name:<12} {rows:>8} {elapsed:>10.2f} {rows / elapsed:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
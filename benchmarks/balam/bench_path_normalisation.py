@@ -0,0 +1,84 @@
+"""Compare the row-wise and vectorized url <-> file path conversions.
+
+Builds synthetic urls under the prefixes of `params_db.S3_PATH` (plus a
+share of urls under an unknown bucket, which take the regex fallback)
+and reports the median time (of --repeat runs) of
+
+    url -> path: data['file_path'].apply(lambda_handler)
+                 urls_to_file_paths(data['file_path'])
+    path -> url: observations_df.apply(find_file_url, axis=1)
+                 file_paths_to_urls(observations_df['file_path'], s3_path)
+
+checking that both forms give the same result. No database is needed.
+
+Usage:
+    python benchmarks/balam/bench_path_normalisation.py --rows 1000000 --repeat 3
+"""
+import argparse
+import statistics
+import time
+
+import pandas as pd
+
+from ds_db_access.balam.params_db import S3_PATH
+from ds_db_access.balam.path_utils import file_paths_to_urls
+from ds_db_access.balam.path_utils import find_file_url
+from ds_db_access.balam.path_utils import lambda_handler
+from ds_db_access.balam.path_utils import urls_to_file_paths
+
+UNKNOWN_PREFIX = 's3://other-bucket/uploads/data/'
+
+
+def make_urls(rows: int, unknown_share: float) -> pd.Series:
+    prefixes = list(S3_PATH.values())
+    unknown_every = int(1 / unknown_share) if unknown_share > 0 else 0
+    urls = []
+    for row in range(rows):
+        if unknown_every and row % unknown_every == 0:
+            prefix = UNKNOWN_PREFIX
+        else:
+            prefix = prefixes[row % len(prefixes)]
+        urls.append(f"{prefix}{row % 97}/{row % 13}/DSCF{row:07d}.JPG")
+    return pd.Series(urls)
+
+
+def median_time(function, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--unknown-share', type=float, default=0.01,
+                        help='share of urls outside of the S3_PATH prefixes')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    urls = make_urls(args.rows, args.unknown_share)
+    s3_path = S3_PATH['SiPeCaM']
+    observations_df = pd.DataFrame({'file_path': urls.str.slice(len(s3_path))})
+
+    row_wise_s, row_wise_paths = median_time(lambda: urls.apply(lambda_handler), args.repeat)
+    vectorized_s, vectorized_paths = median_time(lambda: urls_to_file_paths(urls), args.repeat)
+    assert row_wise_paths.equals(vectorized_paths)
+    row_wise_url_s, row_wise_urls = median_time(
+        lambda: observations_df.apply(lambda row: find_file_url(row['file_path'], s3_path=s3_path), axis=1),
+        args.repeat)
+    vectorized_url_s, vectorized_urls = median_time(
+        lambda: file_paths_to_urls(observations_df['file_path'], s3_path=s3_path), args.repeat)
+    assert list(row_wise_urls) == list(vectorized_urls)
+
+    print(f"{'conversion':<12} {'row-wise s':>11} {'vectorized s':>13} {'speedup':>8}")
+    for name, row_wise, vectorized in (('url -> path', row_wise_s, vectorized_s),
+                                       ('path -> url', row_wise_url_s, vectorized_url_s)):
+        print(f"{name:<12} {row_wise:>11.3f} {vectorized:>13.3f} {row_wise / vectorized:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
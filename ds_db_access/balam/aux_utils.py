@@ -1,5 +1,11 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from typing import Dict
+from typing import Optional
 
 import pandas as pd
+from tqdm import tqdm
 
 from ds_db_access.balam.utils_models import delete_observations_and_geoms
 from ds_db_access.balam.utils_models import get_data_to_process
@@ -8,6 +14,17 @@ from ds_db_access.balam.utils_models import get_pipeline_id, get_data_processed
 
 from ds_db_access.balam.be_datasets import ObservationsVideoPredictionDataset
 from ds_db_access.balam.be_datasets import ObservationsImagePredictionDataset
+from ds_db_access.balam.ingest_utils import IngestJournal
+from ds_db_access.balam.ingest_utils import align_chunks_to_files
+from ds_db_access.balam.ingest_utils import close_for_workers
+from ds_db_access.balam.ingest_utils import init_site_worker
+from ds_db_access.balam.ingest_utils import store_site_observations
+from conabio_ml.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+INGEST_CHUNK_SIZE = 100000
 
 
 def get_new_dataset(project_title: str, filetype: str, site: str):
@@ -27,33 +44,269 @@ def get_new_dataset(project_title: str, filetype: str, site: str):
     return ds
 
 
+def _merge_video_info(obs_df: pd.DataFrame, video_lookup: pd.DataFrame) -> pd.DataFrame:
+    """Join observations with the videos dataset indexed by 'video_id'."""
+    merged_df = obs_df.merge(
+        video_lookup, left_on='video_id', right_index=True, how='left').reset_index()
+    merged_df.rename(columns={'item_y': 'item'}, inplace=True)
+    merged_df.rename(columns={'id_x': 'id'}, inplace=True)
+    return merged_df
+
+
+def _video_lookup(videos_ds_path: str) -> pd.DataFrame:
+    """Load the videos dataset once, indexed by 'video_id'."""
+    video_ds = ObservationsVideoPredictionDataset.from_csv(videos_ds_path)
+    return video_ds.as_dataframe().set_index('video_id')
+
+
+def _iter_dataset_chunks(obs_ds, chunk_size: int):
+    """Yield consecutive slices of a dataset that is already loaded, grouped by file."""
+    obs_df = obs_ds.as_dataframe().sort_values(obs_ds.ANNOTATIONS_FIELDS.ITEM, kind='stable')
+    for offset in range(0, len(obs_df), chunk_size):
+        yield obs_df.iloc[offset:offset + chunk_size]
+
+
+def _iter_results_csv_chunks(results_path: str,
+                             chunk_size: int,
+                             video_lookup: Optional[pd.DataFrame] = None):
+    """Yield consecutive chunks of a results CSV without loading it whole.
+
+    Video results are joined chunk by chunk against `video_lookup`, so
+    memory is bounded by the chunk size and the videos dataset.
+    """
+    for chunk_df in pd.read_csv(results_path, chunksize=chunk_size):
+        if video_lookup is not None:
+            chunk_df = ObservationsVideoPredictionDataset.from_dataframes([chunk_df]).as_dataframe()
+            chunk_df = _merge_video_info(chunk_df, video_lookup)
+        yield chunk_df
+
+
+def _store_observations_in_chunks(chunks,
+                                  dataset_class,
+                                  project_title: str,
+                                  pipeline_name: str,
+                                  pipeline_version: str,
+                                  journal: Optional[IngestJournal] = None,
+                                  **kwargs) -> int:
+    """Store chunks of observations, skipping the chunks in the journal.
+
+    Chunks are cut at a change of file, so the upsert of a chunk sees
+    every observation of its files.
+    """
+    committed = journal.committed_chunks() if journal is not None else set()
+
+    total = 0
+    chunks = align_chunks_to_files(chunks, file_field=dataset_class.ANNOTATIONS_FIELDS.ITEM)
+    for chunk, chunk_df in enumerate(tqdm(chunks, desc="Storing chunks", unit="chunk")):
+        if chunk in committed:
+            continue
+        chunk_ds = dataset_class.from_dataframes([chunk_df])
+        count = chunk_ds.store_observations(project_title=project_title,
+                                            pipeline_name=pipeline_name,
+                                            pipeline_version=pipeline_version,
+                                            **kwargs)
+        if count is None:
+            raise RuntimeError(f"Chunk {chunk} of the results could not be stored.")
+        if journal is not None:
+            journal.commit(chunk, rows=len(chunk_df))
+        total += count
+
+    if len(committed) > 0:
+        logger.info(f"Resumed ingest of {journal.results_path}: "
+                    f"{len(committed)} chunks were already stored.")
+    return total
+
+
 def store_observations_from_csv(project_title: str,
                                 pipeline_name: str,
                                 pipeline_version: str,
                                 **kwargs):
+    """Store the observations of a pipeline results CSV.
+
+    Parameters
+    ----------
+    project_title : str
+        The title of the project the observations belong to.
+    pipeline_name : str
+        The name of the pipeline that produced the results.
+    pipeline_version : str
+        The version of the pipeline that produced the results.
+    **kwargs
+        results_path : str
+            Path of the results CSV.
+        videos_ds_path : str, optional
+            Path of the videos CSV, for video results.
+        stream : bool, optional
+            Read the results CSV in chunks of `ingest_chunk_size` rows and
+            store each chunk before reading the next one, instead of
+            loading the whole file (default is False). Video results are
+            joined per chunk against the videos dataset, loaded once.
+        checkpoint_path : str, optional
+            Path of an ingest journal. When given, the observations are
+            stored in numbered chunks of `ingest_chunk_size` rows and a
+            rerun resumes from the first chunk that was not committed.
+            Chunks are written with mode 'upsert' unless `mode` is given,
+            so a partially stored chunk can be written again. Chunks end
+            at a change of file; streamed results must list the rows of
+            each file contiguously, since an upsert deletes the
+            observations of its files that it does not write.
+        ingest_chunk_size : int, optional
+            Rows per streamed or checkpointed chunk (default is 100000).
+        mode : str, optional
+            Ingest engine passed to `insert_observations`.
+        chunk_size : int, optional
+            Rows per transaction passed to `insert_observations`.
+
+    Returns
+    -------
+    int
+        The number of observations stored by this call.
+    """
     videos_ds_path = kwargs.get('videos_ds_path', None)
     results_path = kwargs.get('results_path', None)
+    checkpoint_path = kwargs.get('checkpoint_path', None)
+    stream = kwargs.get('stream', False)
+    ingest_chunk_size = kwargs.get('ingest_chunk_size', INGEST_CHUNK_SIZE)
+    store_kwargs = {key: kwargs[key] for key in ('mode', 'chunk_size') if key in kwargs}
 
     if videos_ds_path is not None:
-        obs_ds = ObservationsVideoPredictionDataset.from_csv(results_path)
-        video_ds = ObservationsVideoPredictionDataset.from_csv(videos_ds_path)
-
-        video_ds_df = video_ds.as_dataframe()
-        obs_ds_df = obs_ds.as_dataframe()
-
-        merged_df = obs_ds_df.merge(
-            video_ds_df, on='video_id', how='left').reset_index()
-        merged_df.rename(columns={'item_y': 'item'}, inplace=True)
-        merged_df.rename(columns={'id_x': 'id'}, inplace=True)
-        obs_ds = ObservationsVideoPredictionDataset.from_dataframes([merged_df])
+        dataset_class = ObservationsVideoPredictionDataset
+        video_lookup = _video_lookup(videos_ds_path)
     else:
-        obs_ds = ObservationsImagePredictionDataset.from_csv(results_path)
+        dataset_class = ObservationsImagePredictionDataset
+        video_lookup = None
+
+    journal = None
+    if checkpoint_path is not None:
+        store_kwargs.setdefault('mode', 'upsert')
+        journal = IngestJournal(checkpoint_path,
+                                results_path=results_path,
+                                chunk_size=ingest_chunk_size,
+                                project_title=project_title,
+                                pipeline_name=pipeline_name,
+                                pipeline_version=pipeline_version)
+
+    if stream:
+        chunks = _iter_results_csv_chunks(results_path,
+                                          chunk_size=ingest_chunk_size,
+                                          video_lookup=video_lookup)
+        return _store_observations_in_chunks(chunks,
+                                             dataset_class=dataset_class,
+                                             project_title=project_title,
+                                             pipeline_name=pipeline_name,
+                                             pipeline_version=pipeline_version,
+                                             journal=journal,
+                                             **store_kwargs)
+
+    obs_ds = dataset_class.from_csv(results_path)
+    if video_lookup is not None:
+        merged_df = _merge_video_info(obs_ds.as_dataframe(), video_lookup)
+        obs_ds = ObservationsVideoPredictionDataset.from_dataframes([merged_df])
+
+    if journal is not None:
+        return _store_observations_in_chunks(_iter_dataset_chunks(obs_ds, ingest_chunk_size),
+                                             dataset_class=dataset_class,
+                                             project_title=project_title,
+                                             pipeline_name=pipeline_name,
+                                             pipeline_version=pipeline_version,
+                                             journal=journal,
+                                             **store_kwargs)
 
-    obs_ds.store_observations(
+    return obs_ds.store_observations(
         project_title=project_title,
         pipeline_name=pipeline_name,
         pipeline_version=pipeline_version,
-        **kwargs)
+        **store_kwargs)
+
+
+def store_observations_by_site(project_title: str,
+                               pipeline_name: str,
+                               pipeline_version: str,
+                               filetype: str,
+                               observations_df: Optional[pd.DataFrame] = None,
+                               results_paths: Optional[Dict[str, str]] = None,
+                               site_field: str = 'site',
+                               max_workers: int = 4,
+                               **kwargs) -> pd.DataFrame:
+    """Store the observations of several sites concurrently.
+
+    The observations are partitioned by site and each partition is stored
+    by a worker of a process pool. Every worker opens its own database
+    connection, so ingest throughput scales with the number of workers
+    instead of being bound to a single connection.
+
+    Parameters
+    ----------
+    project_title : str
+        The title of the project the observations belong to.
+    pipeline_name : str
+        The name of the pipeline that produced the observations.
+    pipeline_version : str
+        The version of the pipeline that produced the observations.
+    filetype : str
+        The type of files in the dataset ('image' or 'video').
+    observations_df : pd.DataFrame, optional
+        Observations of all the sites, partitioned by `site_field`.
+    results_paths : Dict[str, str], optional
+        Mapping from site to the path of its results CSV, used instead of
+        `observations_df`.
+    site_field : str, optional
+        Column of `observations_df` holding the site (default is 'site').
+    max_workers : int, optional
+        Number of worker processes (default is 4).
+    **kwargs
+        `mode` and `chunk_size` passed to `insert_observations`.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per site with columns 'site', 'rows', 'stored' and 'error'.
+
+    Raises
+    ------
+    ValueError
+        If called inside a transaction, since the connection is closed
+        before the workers start.
+    """
+    if (observations_df is None) == (results_paths is None):
+        raise ValueError("You must send either observations_df or results_paths")
+    store_kwargs = {key: kwargs[key] for key in ('mode', 'chunk_size') if key in kwargs}
+    tasks = []
+    if observations_df is not None:
+        for site, site_df in observations_df.groupby(site_field):
+            tasks.append({'site': site, 'observations_df': site_df})
+    else:
+        for site, results_path in results_paths.items():
+            tasks.append({'site': site, 'results_path': results_path})
+
+    if filetype == 'video':
+        dataset_class = ObservationsVideoPredictionDataset
+    else:
+        dataset_class = ObservationsImagePredictionDataset
+
+    close_for_workers()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_site_worker) as executor:
+        futures = [executor.submit(store_site_observations,
+                                   dataset_class=dataset_class,
+                                   project_title=project_title,
+                                   pipeline_name=pipeline_name,
+                                   pipeline_version=pipeline_version,
+                                   store_kwargs=store_kwargs,
+                                   **task)
+                   for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Storing sites", unit="site"):
+            summary = future.result()
+            if summary['error'] is not None:
+                logger.error(f"Site {summary['site']} failed: {summary['error']}")
+            summaries.append(summary)
+
+    summary_df = pd.DataFrame(summaries, columns=['site', 'rows', 'stored', 'error'])
+    logger.info(f"{summary_df['stored'].fillna(0).sum()} observations stored for "
+                f"{len(summary_df)} sites, {summary_df['error'].notna().sum()} sites failed.")
+    return summary_df
 
 
 def store_events(project_title: str, filetype: str, site: str):
@@ -637,3 +637,23 @@ class SpatialRefSys(BaseModel):
 
     class Meta:
         table_name = 'spatial_ref_sys'
+
+
+class FileContext(BaseModel):
+    # Materialized view managed by database_queries.create_file_context_view
+    created_at = DateTimeField()
+    datetime = DateTimeField(null=True)
+    device = CharField()
+    ecosystem = CharField(null=True)
+    file_id = UUIDField(primary_key=True)
+    latitude = BareField(null=True)
+    longitude = BareField(null=True)
+    mime_type = CharField()
+    project_id = UUIDField()
+    project_title = CharField()
+    sampling_area = CharField()
+    site_identifier = CharField()
+    url = CharField()
+
+    class Meta:
+        table_name = 'FileContext'
@@ -3,6 +3,7 @@ import numpy as np
 import os
 import pandas as pd
 import uuid
+from typing import Optional
 
 from be_ml_vision.datasets.media import BeMediaDataset
 from be_ml_vision.datasets.images import BeImageDataset, BeImagePredictionDataset
@@ -57,12 +58,14 @@ class ObservationMediaDataset(BeMediaDataset):
         filetype = kwargs.get('filetype')
         if filetype is None:
             raise Exception("You must send the parameter filetype")
+        use_cache = kwargs.pop('use_cache', False)
 
         data = get_data_processed(filetype=filetype,
                                   project_title=project_title,
                                   site=site,
                                   pipeline_name=pipeline_name,
-                                  pipeline_version=pipeline_version)
+                                  pipeline_version=pipeline_version,
+                                  use_cache=use_cache)
 
         if data is not None and len(data) > 0:
             data = cls.map_fields_from_db_schema(data, filetype)
@@ -116,7 +119,9 @@ class ObservationMediaDataset(BeMediaDataset):
     def store_observations(self,
                            project_title: str,
                            pipeline_name: str,
-                           pipeline_version: str):
+                           pipeline_version: str,
+                           mode: str = 'insert',
+                           chunk_size: Optional[int] = None):
         observations_df = self.as_dataframe()
         media_dir = self.get_media_dir()
         if media_dir is not None and media_dir != '':
@@ -144,12 +149,14 @@ class ObservationMediaDataset(BeMediaDataset):
                 return
             observation_method = 'machine'
 
-        insert_observations(observations_df=observations_df,
-                            project_id=project_id,
-                            pipeline_id=pipeline_id,
-                            username='rebe',
-                            observation_method=observation_method,
-                            s3_path=S3_PATH[project_title])
+        return insert_observations(observations_df=observations_df,
+                                   project_id=project_id,
+                                   pipeline_id=pipeline_id,
+                                   username='rebe',
+                                   observation_method=observation_method,
+                                   s3_path=S3_PATH[project_title],
+                                   chunk_size=chunk_size,
+                                   mode=mode)
 
     def store_events(self, filetype):
         new_data_df = self.as_dataframe()
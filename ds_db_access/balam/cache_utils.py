@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Hashable
+from typing import List
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RESULT_CACHE_DIR_ENV = 'BALAM_RESULT_CACHE_DIR'
+RESULT_CACHE_SIZE = 32
+# Parquet schema metadata listing the columns stored as JSON text.
+JSON_COLUMNS_METADATA = b'balam_json_columns'
+
+
+class LRUCache:
+    """Bounded, thread-safe mapping that evicts the least recently used key.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries kept in the cache.
+    ttl : float, optional
+        Seconds an entry stays valid after it is set (default is None,
+        entries never expire).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._expires_at = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value stored for `key`, or `default` if it is missing
+        or expired."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            if self._is_expired(key):
+                self.invalidate(key)
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        """Store `value` for `key`, evicting the oldest entries if needed."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl is not None:
+                self._expires_at[key] = time.monotonic() + self.ttl
+            while len(self._data) > self.maxsize:
+                oldest_key, _ = self._data.popitem(last=False)
+                self._expires_at.pop(oldest_key, None)
+
+    def invalidate(self, key: Hashable):
+        """Remove `key` from the cache if it is present."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._expires_at.pop(key, None)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._data.clear()
+            self._expires_at.clear()
+
+    def keys(self) -> List[Hashable]:
+        """Return the cached keys, from the least to the most recently used."""
+        with self._lock:
+            return list(self._data.keys())
+
+    def _is_expired(self, key: Hashable) -> bool:
+        expires_at = self._expires_at.get(key)
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data and not self._is_expired(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class ResultCache:
+    """Two tier cache of query results stored as DataFrames.
+
+    Results are kept in an in-memory LRU tier and, if `cache_dir` is
+    given, in an on-disk tier shared by every process using the same
+    directory: a Parquet file of the DataFrame next to a JSON sidecar
+    with the key, so entries can be found and invalidated without
+    reading them. With a disk tier, a memory hit is only served while
+    its Parquet file is unchanged, so an invalidation or a newer result
+    written by another process is seen. Columns of dicts or lists, such
+    as 'observation_tag',
+    are stored as JSON text and decoded on read. Keys are dictionaries
+    of the query arguments; list arguments are normalized to sorted
+    tuples.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of results kept in memory.
+    cache_dir : str, optional
+        Directory of the on-disk tier (default is None, memory only).
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, cache_dir: Optional[str] = None):
+        self._memory = LRUCache(maxsize=maxsize)
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, **key) -> Optional[pd.DataFrame]:
+        """Return a copy of the result stored for `key`, or None."""
+        cache_key = self._cache_key(key)
+        entry = self._memory.get(cache_key)
+        if self.cache_dir is not None:
+            data_path = self._path(cache_key, '.parquet')
+            try:
+                stamp = _file_stamp(data_path)
+            except OSError:
+                # Removed by an invalidation, possibly from another process.
+                self._memory.invalidate(cache_key)
+                return None
+            if entry is None or entry[0] != stamp:
+                try:
+                    entry = (stamp, _read_parquet(data_path))
+                except (OSError, pa.ArrowException):
+                    return None
+                self._memory.set(cache_key, entry)
+        return None if entry is None else entry[1].copy()
+
+    def set(self, data: pd.DataFrame, **key):
+        """Store a copy of `data` as the result of `key`."""
+        cache_key = self._cache_key(key)
+        data = data.copy()
+        if self.cache_dir is None:
+            self._memory.set(cache_key, (None, data))
+            return
+        data_path = self._path(cache_key, '.parquet')
+        try:
+            _write_parquet(data, f"{data_path}.tmp")
+        except pa.ArrowException:
+            # Columns Arrow cannot type (e.g. mixed objects) are not cached.
+            return
+        os.replace(f"{data_path}.tmp", data_path)
+        with open(self._path(cache_key, '.json'), 'w') as key_file:
+            json.dump(dict(cache_key), key_file)
+        self._memory.set(cache_key, (_file_stamp(data_path), data))
+
+    def invalidate(self, **criteria) -> int:
+        """Remove every result whose key matches all the `criteria`.
+
+        A criterion matches a key argument equal to it, or a list argument
+        containing it. Returns the number of removed entries.
+        """
+        removed = set()
+        for cache_key in self._memory.keys():
+            if self._matches(dict(cache_key), criteria):
+                self._memory.invalidate(cache_key)
+                removed.add(cache_key)
+        if self.cache_dir is not None:
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith('.json'):
+                    continue
+                key_path = os.path.join(self.cache_dir, file_name)
+                try:
+                    with open(key_path) as key_file:
+                        key = json.load(key_file)
+                except (OSError, ValueError):
+                    continue
+                key = self._cache_key(key)
+                if self._matches(dict(key), criteria):
+                    for path in (key_path, key_path[:-len('.json')] + '.parquet'):
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                    removed.add(key)
+        return len(removed)
+
+    def clear(self):
+        """Remove every result from both tiers."""
+        self._memory.clear()
+        if self.cache_dir is not None:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(('.json', '.parquet')):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def is_empty(self) -> bool:
+        """Return True if neither tier holds any result."""
+        if len(self._memory) > 0:
+            return False
+        if self.cache_dir is None:
+            return True
+        return not any(file_name.endswith('.json') for file_name in os.listdir(self.cache_dir))
+
+    @staticmethod
+    def _cache_key(key: dict) -> tuple:
+        return tuple(sorted(
+            (name, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value)
+            for name, value in key.items()))
+
+    @staticmethod
+    def _matches(key: dict, criteria: dict) -> bool:
+        for name, value in criteria.items():
+            key_value = key.get(name)
+            if isinstance(key_value, (list, tuple)):
+                if value not in key_value:
+                    return False
+            elif key_value != value:
+                return False
+        return True
+
+    def _path(self, cache_key: tuple, suffix: str) -> str:
+        digest = hashlib.sha1(json.dumps(cache_key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}{suffix}")
+
+
+def _file_stamp(path: str) -> tuple:
+    """Identify the version of a file; `os.replace` always installs a new inode."""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _write_parquet(data: pd.DataFrame, path: str):
+    """Write a DataFrame to Parquet, encoding columns of dicts or lists as JSON."""
+    json_columns = [column for column in data.columns
+                    if data[column].dtype == object and
+                    data[column].map(lambda value: isinstance(value, (dict, list))).any()]
+    if len(json_columns) > 0:
+        data = data.copy()
+        for column in json_columns:
+            data[column] = [None if value is None else json.dumps(value) for value in data[column]]
+    table = pa.Table.from_pandas(data)
+    metadata = {**(table.schema.metadata or {}),
+                JSON_COLUMNS_METADATA: json.dumps(json_columns).encode('utf-8')}
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+def _read_parquet(path: str) -> pd.DataFrame:
+    """Read a DataFrame written by `_write_parquet`."""
+    table = pq.read_table(path)
+    data = table.to_pandas()
+    json_columns = json.loads((table.schema.metadata or {}).get(JSON_COLUMNS_METADATA, b'[]'))
+    for column in json_columns:
+        data[column] = [json.loads(value) if isinstance(value, str) else None for value in data[column]]
+    return data
+
+
+processed_data_cache = ResultCache(cache_dir=os.environ.get(RESULT_CACHE_DIR_ENV))
@@ -1,10 +1,29 @@
 from tqdm import tqdm
+import base64
+import copy
 import datetime
+import io
+import json
+import logging
+import pandas as pd
+from functools import reduce
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
 from peewee import fn
+from peewee import Case
 from peewee import SQL
 from peewee import DoesNotExist
 from peewee import IntegrityError
+from peewee import chunked
+from peewee import Value
+from peewee import EXCLUDED
+from peewee import Expression
+from peewee import Tuple as RowTuple
+from playhouse.postgres_ext import BinaryJSONField
 from typing import Union
 from uuid import UUID
 from ds_db_access.balam.balam_models import ObservationMethod
@@ -22,9 +41,59 @@ from ds_db_access.balam.balam_models import ProcessedFiles
 from ds_db_access.balam.balam_models import Users
 from ds_db_access.balam.balam_models import EventsFiles
 from ds_db_access.balam.balam_models import Events
+from ds_db_access.balam.balam_models import FileContext
+from ds_db_access.balam.balam_models import database
+from ds_db_access.balam.cache_utils import LRUCache
+from ds_db_access.balam.cache_utils import processed_data_cache
+from ds_db_access.balam import query_explain
 import uuid
 
 from ds_db_access.balam.params_db import DATETIME
+from ds_db_access.balam.params_db import DATETIME_FORMAT
+
+logger = logging.getLogger(__name__)
+
+OBSERVATIONS_CHUNK_SIZE = 1000
+COPY_CHUNK_SIZE = 50000
+COPY_NULL = r'\N'
+URLS_CHUNK_SIZE = 1000
+PROCESSED_FILES_CHUNK_SIZE = 10000
+EVENTS_CHUNK_SIZE = 10000
+READ_CHUNK_SIZE = 50000
+FILES_CURSOR_SAFETY_LAG = datetime.timedelta(minutes=10)
+FILE_ID_CACHE_SIZE = 100000
+LOOKUP_CACHE_SIZE = 10000
+LOOKUP_CACHE_TTL = 600
+
+# Column dtypes of the DataFrames built by the read functions. `str` marks
+# uuid columns, which psycopg2 returns as UUID objects.
+FILES_DATA_DTYPES = {
+    'file_id': str,
+    'datetime': 'datetime64[ns]',
+}
+PROCESSED_DATA_DTYPES = {
+    **FILES_DATA_DTYPES,
+    'observation_id': str,
+    'confidence': 'float64',
+    'score': 'float64',
+    'video_frame_num': 'Int64',
+}
+PROCESSED_DATA_RENAMES = {'obs_id': 'observation_id'}
+# Columns that can be requested from `get_processed_data`.
+PROCESSED_DATA_COLUMNS = ('file_id', 'url', 'datetime', 'longitude', 'latitude',
+                          'site_identifier', 'sampling_area', 'device', 'ecosystem',
+                          'observation_id', 'confidence', 'score', 'observation_tag',
+                          'observation_type', 'bbox', 'video_frame_num', 'seq_id',
+                          'project_title', 'classificationProbability')
+
+_file_id_cache = LRUCache(maxsize=FILE_ID_CACHE_SIZE)
+# Ids of the small, nearly static tables (projects, users, pipelines and
+# observation methods), keyed by (table, *lookup values).
+_lookup_cache = LRUCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+# Default of the cache reads whose cached value may be None.
+_MISSING = object()
+
+query_explain.enable_from_environment()
 
 # region INSERT FUNCTIONS
 
@@ -158,10 +227,65 @@ def insert_processed_files(file_id: str, pipeline_id: str) -> str:
             raise IntegrityError(f"Uniqueness Violation Detected: {e}") from e
         else:
             raise IntegrityError(f"Another type of integrity error:{e}") from e
+    invalidate_processed_data_cache(pipeline_id=pipeline_id)
 
     return primary_key
 
 
+def insert_processed_files_many(file_ids: Iterable[str],
+                                pipeline_id: str,
+                                chunk_size: int = PROCESSED_FILES_CHUNK_SIZE) -> int:
+    """Mark many files as processed by a pipeline in the ProcessedFiles table.
+
+    The ids are the same deterministic `uuid5` values computed by
+    `insert_processed_files`, and rows are written with multi-row
+    `INSERT ... ON CONFLICT DO NOTHING` statements in one transaction, so
+    files that are already marked are skipped and the call can be repeated
+    safely.
+
+    Parameters
+    ----------
+    file_ids : Iterable[str]
+        The unique identifiers of the files from the Files table.
+    pipeline_id : str
+        The unique identifier of the pipeline from the PipelineInfo table.
+    chunk_size : int, optional
+        Maximum number of rows per INSERT statement (default is 10000).
+
+    Returns
+    -------
+    int
+        The number of files newly inserted in the ProcessedFiles table.
+    """
+    if not PipelineInfo.select().where(PipelineInfo.id == pipeline_id).exists():
+        raise DoesNotExist(
+            f"Pipeline with id {pipeline_id} does not exist in the PipelineInfo table.")
+
+    now = datetime.datetime.now()
+    rows = [{ProcessedFiles.id: uuid.uuid5(uuid.NAMESPACE_DNS, f"{file_id}{pipeline_id}"),
+             ProcessedFiles.created_at: now,
+             ProcessedFiles.updated_at: now,
+             ProcessedFiles.file: file_id,
+             ProcessedFiles.pipeline: pipeline_id}
+            for file_id in dict.fromkeys(str(file_id) for file_id in file_ids)]
+
+    inserted_count = 0
+    try:
+        with database.atomic():
+            for chunk in chunked(rows, chunk_size):
+                inserted_count += (ProcessedFiles
+                                   .insert_many(chunk)
+                                   .on_conflict_ignore()
+                                   .as_rowcount()
+                                   .execute())
+    except IntegrityError as e:
+        raise IntegrityError(f"Another type of integrity error:{e}") from e
+    if inserted_count > 0:
+        invalidate_processed_data_cache(pipeline_id=pipeline_id)
+
+    return inserted_count
+
+
 def insert_observations_and_observations_geom(file_id: str,
                                               observation_id: str,
                                               observation_type: str,
@@ -210,17 +334,6 @@ def insert_observations_and_observations_geom(file_id: str,
     str
         The primary key of the observation inserted in the Observations table.
     """
-    geom_id = None
-
-    if bbox is not None:
-        data_obs_geom = {ObservationGeom.id: str(uuid.uuid4()),
-                         ObservationGeom.created_at: datetime.datetime.now(),
-                         ObservationGeom.updated_at: datetime.datetime.now(),
-                         ObservationGeom.bbox: bbox,
-                         ObservationGeom.video_frame_num: video_frame_num
-                         }
-        geom_id = ObservationGeom.insert(data_obs_geom).execute()
-
     if not Files.select().where(Files.id == file_id).exists():
         raise DoesNotExist(f"Files with id {file_id} does not exist in the Files table.")
 
@@ -238,6 +351,7 @@ def insert_observations_and_observations_geom(file_id: str,
         raise DoesNotExist(
             f"ObservationMethod with id {observation_method_id} does not exist in the ObservationMethod table.")
 
+    geom_id = str(uuid.uuid4()) if bbox is not None else None
     data_obs = {Observations.id: str(observation_id),
                 Observations.created_at: datetime.datetime.now(),
                 Observations.updated_at: datetime.datetime.now(),
@@ -254,8 +368,18 @@ def insert_observations_and_observations_geom(file_id: str,
                 Observations.taxon_id: taxon_id
                 }
 
+    # The geometry is only kept if the observation referencing it is stored.
     try:
-        primary_key = Observations.insert(data_obs).execute()
+        with database.atomic():
+            if geom_id is not None:
+                data_obs_geom = {ObservationGeom.id: geom_id,
+                                 ObservationGeom.created_at: datetime.datetime.now(),
+                                 ObservationGeom.updated_at: datetime.datetime.now(),
+                                 ObservationGeom.bbox: bbox,
+                                 ObservationGeom.video_frame_num: video_frame_num
+                                 }
+                ObservationGeom.insert(data_obs_geom).execute()
+            primary_key = Observations.insert(data_obs).execute()
     except IntegrityError as e:
         if 'duplicate' in str(e):
             raise IntegrityError(f"Uniqueness Violation Detected: {e}") from e
@@ -265,6 +389,595 @@ def insert_observations_and_observations_geom(file_id: str,
     return primary_key
 
 
+def _observation_records(observations_df: pd.DataFrame) -> List[dict]:
+    """Convert an observations DataFrame into records with missing values as None."""
+    data = observations_df.astype(object)
+    data = data.where(data.notna(), None)
+    return data.to_dict('records')
+
+
+def _observation_rows(records: List[dict],
+                      project_id: str,
+                      pipeline_id: str,
+                      user_id: str,
+                      observation_method_id: str,
+                      geom_ids: Optional[Dict[str, str]] = None):
+    """Build the ObservationGeom and Observations rows for a list of records.
+
+    Geometry ids are generated client-side so both tables can be written
+    with multi-row statements. `geom_ids` maps observation ids to the
+    geometry they already reference, which is reused instead.
+    """
+    geom_ids = geom_ids or {}
+    now = datetime.datetime.now()
+    geom_rows = []
+    obs_rows = []
+    for record in records:
+        geom_id = None
+        if record.get('bbox') is not None:
+            geom_id = geom_ids.get(str(record['id'])) or str(uuid.uuid4())
+            geom_rows.append({ObservationGeom.id: geom_id,
+                              ObservationGeom.created_at: now,
+                              ObservationGeom.updated_at: now,
+                              ObservationGeom.bbox: record['bbox'],
+                              ObservationGeom.video_frame_num: record.get('video_frame_num')
+                              })
+        obs_rows.append({Observations.id: str(record['id']),
+                         Observations.created_at: now,
+                         Observations.updated_at: now,
+                         Observations.file: record['file_id'],
+                         Observations.observation_type: record.get('observation_type'),
+                         Observations.observation_tag: record.get('observation_tag'),
+                         Observations.project: project_id,
+                         Observations.pipeline: pipeline_id,
+                         Observations.geom: geom_id,
+                         Observations.user: user_id,
+                         Observations.score: record.get('score'),
+                         Observations.confidence: record.get('confidence'),
+                         Observations.observation_method: observation_method_id,
+                         Observations.taxon_id: record.get('taxon_id')
+                         })
+    return geom_rows, obs_rows
+
+
+def validate_observation_batch(file_ids: Iterable[str],
+                               project_id: str,
+                               pipeline_id: Optional[str],
+                               user_id: str,
+                               observation_method_id: str) -> List[Dict[str, str]]:
+    """Check the foreign keys of a batch of observations with set-based queries.
+
+    The project, pipeline, user and observation method are constant for a
+    batch, so they are checked once in a single UNION query. All distinct
+    file ids are checked in a second query with `unnest`.
+
+    Parameters
+    ----------
+    file_ids : Iterable[str]
+        File ids referenced by the observations of the batch.
+    project_id : str
+        ID related to the project in the Project table.
+    pipeline_id : str, optional
+        ID related to the pipeline in the PipelineInfo table. It is not
+        checked when None (human annotations).
+    user_id : str
+        ID related to the user who inserts the observations in the Users table.
+    observation_method_id : str
+        ID related to the observation method in the ObservationMethod table.
+
+    Returns
+    -------
+    List[Dict[str, str]]
+        One item per missing reference, with keys 'table' and 'id'.
+        An empty list means the batch is valid.
+    """
+    references = [(Projects, project_id),
+                  (PipelineInfo, pipeline_id),
+                  (Users, user_id),
+                  (ObservationMethod, observation_method_id)]
+    references = [(model, str(value)) for model, value in references if value is not None]
+
+    query = reduce(lambda lhs, rhs: lhs + rhs, [
+        model.select(Value(model._meta.table_name).alias('table_name')).where(model.id == value)
+        for model, value in references])
+    found_tables = {table_name for table_name, in query.tuples()}
+
+    missing = [{'table': model._meta.table_name, 'id': value}
+               for model, value in references if model._meta.table_name not in found_tables]
+
+    distinct_file_ids = list({str(file_id) for file_id in file_ids})
+    if len(distinct_file_ids) > 0:
+        cursor = database.execute_sql(
+            'SELECT ids.id FROM unnest(%s::uuid[]) AS ids(id) '
+            f'WHERE NOT EXISTS (SELECT 1 FROM "{Files._meta.table_name}" files '
+            f'WHERE files.id = ids.id)',
+            (distinct_file_ids,))
+        missing.extend({'table': Files._meta.table_name, 'id': str(file_id)}
+                       for file_id, in cursor.fetchall())
+
+    return missing
+
+
+def _validate_observations(observations_df: pd.DataFrame,
+                           project_id: str,
+                           pipeline_id: Optional[str],
+                           user_id: str,
+                           observation_method_id: str) -> pd.DataFrame:
+    """Validate a batch of observations before writing it.
+
+    Missing batch-wide references raise DoesNotExist. Observations whose
+    file does not exist are logged and left out of the returned DataFrame.
+    """
+    missing = validate_observation_batch(observations_df['file_id'],
+                                         project_id=project_id,
+                                         pipeline_id=pipeline_id,
+                                         user_id=user_id,
+                                         observation_method_id=observation_method_id)
+    missing_file_ids = {item['id'] for item in missing if item['table'] == Files._meta.table_name}
+    for item in missing:
+        if item['table'] != Files._meta.table_name:
+            raise DoesNotExist(
+                f"{item['table']} with id {item['id']} does not exist in the {item['table']} table.")
+
+    if len(missing_file_ids) > 0:
+        logger.warning(f"{len(missing_file_ids)} files do not exist in the Files table, "
+                       f"their observations are skipped: {sorted(missing_file_ids)}")
+        observations_df = observations_df[~observations_df['file_id'].astype(str).isin(missing_file_ids)]
+    return observations_df
+
+
+def insert_observations_bulk(observations_df: pd.DataFrame,
+                             project_id: str,
+                             pipeline_id: str,
+                             user_id: str,
+                             observation_method_id: str,
+                             chunk_size: int = OBSERVATIONS_CHUNK_SIZE,
+                             validate: bool = True) -> List[int]:
+    """Insert observations and geometries in chunks of multi-row INSERTs.
+
+    Each chunk writes its ObservationGeom and Observations rows with
+    `insert_many` inside a single transaction, so a chunk is either fully
+    stored or not stored at all.
+
+    Parameters
+    ----------
+    observations_df : pd.DataFrame
+        Observations to insert. Expected columns: 'id', 'file_id',
+        'observation_type', 'observation_tag' (dict), 'bbox', 'score',
+        'confidence', 'video_frame_num' and 'taxon_id'.
+    project_id : str
+        ID related to the project in the Project table.
+    pipeline_id : str
+        ID related to the pipeline in the PipelineInfo table.
+    user_id : str
+        ID related to the user who inserts the observations in the Users table.
+    observation_method_id : str
+        ID related to the observation method in the ObservationMethod table.
+    chunk_size : int, optional
+        Number of observations written per transaction (default is 1000).
+    validate : bool, optional
+        Whether to check the foreign keys of the batch before writing it
+        with `validate_observation_batch` (default is True). Observations
+        of missing files are skipped.
+
+    Returns
+    -------
+    List[int]
+        Number of observations inserted by each chunk.
+    """
+    if validate:
+        observations_df = _validate_observations(observations_df,
+                                                 project_id=project_id,
+                                                 pipeline_id=pipeline_id,
+                                                 user_id=user_id,
+                                                 observation_method_id=observation_method_id)
+    records = _observation_records(observations_df)
+    chunk_counts = []
+
+    for chunk in tqdm(list(chunked(records, chunk_size)), desc="Inserting observations", unit="chunk"):
+        geom_rows, obs_rows = _observation_rows(chunk,
+                                                project_id=project_id,
+                                                pipeline_id=pipeline_id,
+                                                user_id=user_id,
+                                                observation_method_id=observation_method_id)
+        try:
+            with database.atomic():
+                if len(geom_rows) > 0:
+                    ObservationGeom.insert_many(geom_rows).as_rowcount().execute()
+                count = Observations.insert_many(obs_rows).as_rowcount().execute()
+        except IntegrityError as e:
+            if 'duplicate' in str(e):
+                raise IntegrityError(f"Uniqueness Violation Detected: {e}") from e
+            else:
+                raise IntegrityError(f"Another type of integrity error:{e}") from e
+        chunk_counts.append(count)
+
+    if sum(chunk_counts) > 0:
+        invalidate_processed_data_cache(project_id=project_id, pipeline_id=pipeline_id)
+    return chunk_counts
+
+
+OBSERVATION_GEOM_COPY_FIELDS = [ObservationGeom.id,
+                                ObservationGeom.created_at,
+                                ObservationGeom.updated_at,
+                                ObservationGeom.bbox,
+                                ObservationGeom.video_frame_num]
+
+OBSERVATIONS_COPY_FIELDS = [Observations.id,
+                            Observations.created_at,
+                            Observations.updated_at,
+                            Observations.file,
+                            Observations.observation_type,
+                            Observations.observation_tag,
+                            Observations.project,
+                            Observations.pipeline,
+                            Observations.geom,
+                            Observations.user,
+                            Observations.score,
+                            Observations.confidence,
+                            Observations.observation_method,
+                            Observations.taxon_id]
+
+
+def insert_observations_batch_commit(observations_df: pd.DataFrame,
+                                     project_id: str,
+                                     pipeline_id: str,
+                                     user_id: str,
+                                     observation_method_id: str,
+                                     chunk_size: int = OBSERVATIONS_CHUNK_SIZE,
+                                     validate: bool = True) -> List[int]:
+    """Insert observations row by row, committing `chunk_size` rows at a time.
+
+    Each chunk is a single transaction and each observation is written
+    inside its own savepoint, so a failing row is rolled back together
+    with its geometry and logged, while the rest of the chunk is kept.
+
+    Parameters
+    ----------
+    observations_df : pd.DataFrame
+        Observations to insert, with the same columns expected by
+        `insert_observations_bulk`.
+    project_id : str
+        ID related to the project in the Project table.
+    pipeline_id : str
+        ID related to the pipeline in the PipelineInfo table.
+    user_id : str
+        ID related to the user who inserts the observations in the Users table.
+    observation_method_id : str
+        ID related to the observation method in the ObservationMethod table.
+    chunk_size : int, optional
+        Number of observations committed per transaction (default is 1000).
+    validate : bool, optional
+        Whether to check the foreign keys of the batch before writing it
+        (default is True). Observations of missing files are skipped.
+
+    Returns
+    -------
+    List[int]
+        Number of observations inserted by each chunk.
+    """
+    if validate:
+        observations_df = _validate_observations(observations_df,
+                                                 project_id=project_id,
+                                                 pipeline_id=pipeline_id,
+                                                 user_id=user_id,
+                                                 observation_method_id=observation_method_id)
+    records = _observation_records(observations_df)
+    chunk_counts = []
+
+    for chunk in tqdm(list(chunked(records, chunk_size)), desc="Inserting observations", unit="chunk"):
+        geom_rows, obs_rows = _observation_rows(chunk,
+                                                project_id=project_id,
+                                                pipeline_id=pipeline_id,
+                                                user_id=user_id,
+                                                observation_method_id=observation_method_id)
+        geom_rows = {row[ObservationGeom.id]: row for row in geom_rows}
+        count = 0
+        with database.atomic():
+            for obs_row in obs_rows:
+                try:
+                    with database.atomic():
+                        geom_row = geom_rows.get(obs_row[Observations.geom])
+                        if geom_row is not None:
+                            ObservationGeom.insert(geom_row).execute()
+                        Observations.insert(obs_row).execute()
+                    count += 1
+                except IntegrityError as e:
+                    logger.error(f"Failed to insert observation {obs_row[Observations.id]}: {e}")
+        chunk_counts.append(count)
+
+    if sum(chunk_counts) > 0:
+        invalidate_processed_data_cache(project_id=project_id, pipeline_id=pipeline_id)
+    return chunk_counts
+
+
+OBSERVATION_GEOM_UPSERT_FIELDS = [ObservationGeom.bbox,
+                                  ObservationGeom.video_frame_num]
+
+OBSERVATIONS_UPSERT_FIELDS = [Observations.file,
+                              Observations.observation_type,
+                              Observations.observation_tag,
+                              Observations.project,
+                              Observations.pipeline,
+                              Observations.geom,
+                              Observations.user,
+                              Observations.score,
+                              Observations.confidence,
+                              Observations.observation_method,
+                              Observations.taxon_id]
+
+
+def _upsert_rows(model, rows: List[dict], fields: list) -> int:
+    """Insert rows or update the existing ones whose `fields` changed.
+
+    Rows are matched on the primary key. Existing rows whose values are
+    unchanged are left untouched, so they produce no new row versions.
+    """
+    excluded_fields = [getattr(EXCLUDED, field.column_name) for field in fields]
+    update = {field: excluded for field, excluded in zip(fields, excluded_fields)}
+    update[model.updated_at] = EXCLUDED.updated_at
+    changed = Expression(RowTuple(*fields), 'IS DISTINCT FROM', RowTuple(*excluded_fields))
+    return (model
+            .insert_many(rows)
+            .on_conflict(conflict_target=[model.id], update=update, where=changed)
+            .as_rowcount()
+            .execute())
+
+
+def observation_ids(observations_df: pd.DataFrame, pipeline_id: Optional[str]) -> pd.Series:
+    """Compute deterministic ids for the observations of a pipeline.
+
+    The id is a `uuid5` of the file, pipeline, video frame, bbox and
+    label of the observation, like the ids of `insert_processed_files`,
+    so rerunning a pipeline produces the same ids for the same
+    detections whatever ids its results file carries.
+
+    Parameters
+    ----------
+    observations_df : pd.DataFrame
+        Observations with the columns expected by
+        `insert_observations_bulk`.
+    pipeline_id : str, optional
+        ID related to the pipeline in the PipelineInfo table.
+
+    Returns
+    -------
+    pd.Series
+        The observation ids, aligned with `observations_df`.
+    """
+    ids = []
+    for record in _observation_records(observations_df):
+        observation_tag = record.get('observation_tag')
+        label = observation_tag.get('predicted_label') if isinstance(observation_tag, dict) else None
+        # Frames read back as floats (1.0) from a CSV with missing values
+        video_frame_num = record.get('video_frame_num')
+        if video_frame_num is not None:
+            video_frame_num = int(video_frame_num)
+        key = json.dumps([str(record['file_id']), pipeline_id, video_frame_num,
+                          record.get('bbox'), record.get('observation_type'), label,
+                          record.get('taxon_id')], default=str)
+        ids.append(str(uuid.uuid5(uuid.NAMESPACE_DNS, key)))
+    return pd.Series(ids, index=observations_df.index, dtype=object)
+
+
+def upsert_observations(observations_df: pd.DataFrame,
+                        project_id: str,
+                        pipeline_id: str,
+                        user_id: str,
+                        observation_method_id: str,
+                        chunk_size: int = OBSERVATIONS_CHUNK_SIZE,
+                        validate: bool = True) -> List[int]:
+    """Insert new observations, rewrite the changed ones and delete the stale ones.
+
+    The ids of the observations are replaced by the deterministic ids of
+    `observation_ids`, so rerunning a pipeline updates the stored rows in
+    place with `INSERT ... ON CONFLICT (id) DO UPDATE` instead of deleting
+    and reinserting them. Existing observations keep their geometry id.
+
+    The batch is taken as the complete results of the pipeline for its
+    files: in the transaction of each chunk, the observations of the
+    pipeline for the files of the chunk whose ids are not in the batch
+    are deleted together with their geometries. The observations of a
+    file must therefore not be split across calls.
+
+    Parameters
+    ----------
+    observations_df : pd.DataFrame
+        Observations to write, with the same columns expected by
+        `insert_observations_bulk`. The 'id' column is ignored.
+    project_id : str
+        ID related to the project in the Project table.
+    pipeline_id : str
+        ID related to the pipeline in the PipelineInfo table.
+    user_id : str
+        ID related to the user who inserts the observations in the Users table.
+    observation_method_id : str
+        ID related to the observation method in the ObservationMethod table.
+    chunk_size : int, optional
+        Number of observations written per transaction (default is 1000).
+    validate : bool, optional
+        Whether to check the foreign keys of the batch before writing it
+        (default is True). Observations of missing files are skipped.
+
+    Returns
+    -------
+    List[int]
+        Number of observations inserted or updated by each chunk.
+    """
+    if validate:
+        observations_df = _validate_observations(observations_df,
+                                                 project_id=project_id,
+                                                 pipeline_id=pipeline_id,
+                                                 user_id=user_id,
+                                                 observation_method_id=observation_method_id)
+    observations_df = observations_df.assign(id=observation_ids(observations_df, pipeline_id))
+    duplicated = observations_df['id'].duplicated(keep='last')
+    if duplicated.any():
+        logger.warning(f"{int(duplicated.sum())} observations repeat the file, frame, bbox and label "
+                       f"of another one, only the last one is kept.")
+        observations_df = observations_df[~duplicated]
+    records = _observation_records(observations_df)
+    batch_ids = {}
+    for record in records:
+        batch_ids.setdefault(str(record['file_id']), []).append(record['id'])
+    if pipeline_id is None:
+        pipeline_condition = Observations.pipeline.is_null()
+    else:
+        pipeline_condition = Observations.pipeline == pipeline_id
+    chunk_counts = []
+    deleted = 0
+
+    for chunk in tqdm(list(chunked(records, chunk_size)), desc="Upserting observations", unit="chunk"):
+        chunk_ids = [record['id'] for record in chunk]
+        chunk_file_ids = list({str(record['file_id']) for record in chunk})
+        kept_ids = [observation_id for file_id in chunk_file_ids for observation_id in batch_ids[file_id]]
+        try:
+            with database.atomic():
+                stale_rows = list(Observations
+                                  .delete()
+                                  .where(pipeline_condition &
+                                         Observations.file.in_(chunk_file_ids) &
+                                         Observations.id.not_in(kept_ids))
+                                  .returning(Observations.id, Observations.geom)
+                                  .tuples())
+                stale_geom_ids = [str(geom_id) for _, geom_id in stale_rows if geom_id is not None]
+                if len(stale_geom_ids) > 0:
+                    ObservationGeom.delete().where(ObservationGeom.id.in_(stale_geom_ids)).execute()
+
+                geom_ids = {str(observation_id): str(geom_id) for observation_id, geom_id in
+                            Observations
+                            .select(Observations.id, Observations.geom)
+                            .where(Observations.id.in_(chunk_ids) & Observations.geom.is_null(False))
+                            .tuples()}
+                geom_rows, obs_rows = _observation_rows(chunk,
+                                                        project_id=project_id,
+                                                        pipeline_id=pipeline_id,
+                                                        user_id=user_id,
+                                                        observation_method_id=observation_method_id,
+                                                        geom_ids=geom_ids)
+                if len(geom_rows) > 0:
+                    _upsert_rows(ObservationGeom, geom_rows, OBSERVATION_GEOM_UPSERT_FIELDS)
+                count = _upsert_rows(Observations, obs_rows, OBSERVATIONS_UPSERT_FIELDS)
+        except IntegrityError as e:
+            raise IntegrityError(f"Another type of integrity error:{e}") from e
+        deleted += len(stale_rows)
+        chunk_counts.append(count)
+
+    if deleted > 0:
+        logger.info(f"{deleted} stale observations of the rerun files were deleted.")
+    if sum(chunk_counts) > 0 or deleted > 0:
+        invalidate_processed_data_cache(project_id=project_id, pipeline_id=pipeline_id)
+    return chunk_counts
+
+
+def _copy_value(field, value):
+    """Adapt a Python value to its CSV representation for COPY."""
+    if value is None:
+        return None
+    if isinstance(field, BinaryJSONField):
+        return json.dumps(value)
+    return field.db_value(value)
+
+
+def _copy_field(value) -> str:
+    """Quote a value for COPY, leaving the NULL marker for None."""
+    if value is None:
+        return COPY_NULL
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_rows(model, fields: list, rows: List[dict]) -> int:
+    """Stream rows into a table with COPY FROM STDIN using a CSV buffer.
+
+    Every value is quoted and missing values are written as the unquoted
+    `COPY_NULL` marker, so COPY reads empty strings as '' and only None
+    as NULL. Database errors are raised as the peewee exceptions.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_copy_field(_copy_value(field, row.get(field))) for field in fields))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    columns = ', '.join(f'"{field.column_name}"' for field in fields)
+    sql = (f'COPY "{model._meta.table_name}" ({columns}) FROM STDIN '
+           f"WITH (FORMAT csv, NULL '{COPY_NULL}')")
+    with database.__exception_wrapper__:
+        cursor = database.connection().cursor()
+        cursor.copy_expert(sql, buffer)
+    return cursor.rowcount
+
+
+def copy_observations(observations_df: pd.DataFrame,
+                      project_id: str,
+                      pipeline_id: str,
+                      user_id: str,
+                      observation_method_id: str,
+                      chunk_size: int = COPY_CHUNK_SIZE,
+                      validate: bool = True) -> List[int]:
+    """Insert observations and geometries using PostgreSQL COPY.
+
+    Rows are serialized chunk by chunk into an in-memory CSV buffer and
+    streamed with `copy_expert`. Geometry ids are generated client-side,
+    so each chunk copies ObservationGeom first and then Observations
+    inside a single transaction.
+
+    Parameters
+    ----------
+    observations_df : pd.DataFrame
+        Observations to insert, with the same columns expected by
+        `insert_observations_bulk`.
+    project_id : str
+        ID related to the project in the Project table.
+    pipeline_id : str
+        ID related to the pipeline in the PipelineInfo table.
+    user_id : str
+        ID related to the user who inserts the observations in the Users table.
+    observation_method_id : str
+        ID related to the observation method in the ObservationMethod table.
+    chunk_size : int, optional
+        Number of observations copied per transaction (default is 50000).
+    validate : bool, optional
+        Whether to check the foreign keys of the batch before copying it
+        (default is True). Observations of missing files are skipped.
+
+    Returns
+    -------
+    List[int]
+        Number of observations copied by each chunk.
+    """
+    if validate:
+        observations_df = _validate_observations(observations_df,
+                                                 project_id=project_id,
+                                                 pipeline_id=pipeline_id,
+                                                 user_id=user_id,
+                                                 observation_method_id=observation_method_id)
+    records = _observation_records(observations_df)
+    chunk_counts = []
+
+    for chunk in tqdm(list(chunked(records, chunk_size)), desc="Copying observations", unit="chunk"):
+        geom_rows, obs_rows = _observation_rows(chunk,
+                                                project_id=project_id,
+                                                pipeline_id=pipeline_id,
+                                                user_id=user_id,
+                                                observation_method_id=observation_method_id)
+        try:
+            with database.atomic():
+                if len(geom_rows) > 0:
+                    _copy_rows(ObservationGeom, OBSERVATION_GEOM_COPY_FIELDS, geom_rows)
+                count = _copy_rows(Observations, OBSERVATIONS_COPY_FIELDS, obs_rows)
+        except IntegrityError as e:
+            if 'duplicate' in str(e):
+                raise IntegrityError(f"Uniqueness Violation Detected: {e}") from e
+            else:
+                raise IntegrityError(f"Another type of integrity error:{e}") from e
+        chunk_counts.append(count)
+
+    if sum(chunk_counts) > 0:
+        invalidate_processed_data_cache(project_id=project_id, pipeline_id=pipeline_id)
+    return chunk_counts
+
+
 def insert_events(event_id: str, event_type: str) -> str:
     """_summary_
 
@@ -313,15 +1026,87 @@ def insert_events_files(event_id: str, file_id: str) -> str:
         EventsFiles.file: file_id
     }
     try:
-        primary_key = EventsFiles.insert(data).execute()
+        with database.atomic():
+            primary_key = EventsFiles.insert(data).execute()
+            Events.update({Events.updated_at: datetime.datetime.now()}).where(Events.id == event_id).execute()
 
     except IntegrityError as e:
         if 'duplicate' in str(e):
             raise IntegrityError(f"Uniqueness Violation Detected: {e}") from e
 
         raise IntegrityError(f"Another type of integrity error:{e}") from e
+    # The sequence of the file changes in the cached processed data
+    invalidate_processed_data_cache()
     return primary_key
 
+
+def insert_events_bulk(events_files: Iterable[Tuple[str, str]],
+                       event_type: str,
+                       chunk_size: int = EVENTS_CHUNK_SIZE) -> Dict[str, int]:
+    """Insert events and their files into the Events and Events_files tables.
+
+    All rows are written with multi-row `INSERT ... ON CONFLICT DO NOTHING`
+    statements inside one transaction. Events that already exist and
+    `(event, file)` pairs already present in the unique index are skipped.
+    Events that get new files are marked as updated, so the processed
+    data of the files is seen as modified, and the cached processed data,
+    which carries the sequence of each file, is invalidated.
+
+    Parameters
+    ----------
+    events_files : Iterable[Tuple[str, str]]
+        Pairs of (event_id, file_id) linking each file to its event.
+    event_type : str
+        Type of the inserted events (e.g., 'photo_sequence').
+    chunk_size : int, optional
+        Maximum number of rows per INSERT statement (default is 10000).
+
+    Returns
+    -------
+    Dict[str, int]
+        Counts with keys 'events_inserted', 'events_skipped',
+        'events_files_inserted' and 'events_files_skipped'.
+    """
+    pairs = list(dict.fromkeys((str(event_id), str(file_id)) for event_id, file_id in events_files))
+    event_ids = list(dict.fromkeys(event_id for event_id, _ in pairs))
+
+    now = datetime.datetime.now()
+    events_rows = [{Events.id: event_id,
+                    Events.created_at: now,
+                    Events.updated_at: now,
+                    Events.identifier: str(uuid.uuid4()),
+                    Events.event_type: event_type}
+                   for event_id in event_ids]
+    events_files_rows = [{EventsFiles.event: event_id,
+                          EventsFiles.file: file_id}
+                         for event_id, file_id in pairs]
+
+    events_inserted = 0
+    linked_event_ids = []
+    try:
+        with database.atomic():
+            for chunk in chunked(events_rows, chunk_size):
+                events_inserted += Events.insert_many(chunk).on_conflict_ignore().as_rowcount().execute()
+            for chunk in chunked(events_files_rows, chunk_size):
+                linked_event_ids.extend(event_id for event_id, in (EventsFiles
+                                                                   .insert_many(chunk)
+                                                                   .on_conflict_ignore()
+                                                                   .returning(EventsFiles.event)
+                                                                   .tuples()
+                                                                   .execute()))
+            for chunk in chunked(list(dict.fromkeys(linked_event_ids)), chunk_size):
+                Events.update({Events.updated_at: now}).where(Events.id.in_(chunk)).execute()
+    except IntegrityError as e:
+        raise IntegrityError(f"Another type of integrity error:{e}") from e
+    events_files_inserted = len(linked_event_ids)
+    if events_files_inserted > 0:
+        invalidate_processed_data_cache()
+
+    return {'events_inserted': events_inserted,
+            'events_skipped': len(events_rows) - events_inserted,
+            'events_files_inserted': events_files_inserted,
+            'events_files_skipped': len(events_files_rows) - events_files_inserted}
+
 # endregion
 
 
@@ -344,18 +1129,323 @@ def get_obs_method_id(observation_method: str):
     ValueError
         _description_
     """
+    cache_key = ('ObservationMethod', observation_method)
+    obs_method_id = _lookup_cache.get(cache_key)
+    if obs_method_id is not None:
+        return obs_method_id
     try:
         obs_method = ObservationMethod.get(ObservationMethod.name == observation_method)
         obs_method_id = obs_method.id
     except DoesNotExist as e:
         logger.error(f"Failed to obtain observation_method_id: {e}")
         raise ValueError("Failed to obtain observation_method_id.") from e
+    _lookup_cache.set(cache_key, str(obs_method_id))
     return str(obs_method_id)
 
 
+def _as_list(values: Union[str, Iterable[str]]) -> List[str]:
+    """Return a single identifier as a one element list."""
+    if isinstance(values, str):
+        return [values]
+    return list(values)
+
+
+def _datetime_expression(project_titles: List[str]):
+    """Build the capture timestamp of a file, parsed by the server.
+
+    The metadata key holding the datetime and its format depend on the
+    project (see `DATETIME` and `DATETIME_FORMAT`). Projects sharing the
+    same key and format are grouped, so a single project, or several
+    projects with the same key, need no CASE. Empty values give NULL.
+    """
+    titles_by_key = {}
+    for title in project_titles:
+        titles_by_key.setdefault((DATETIME[title], DATETIME_FORMAT[title]), []).append(title)
+
+    expressions = {(key, datetime_format): fn.TO_TIMESTAMP(fn.NULLIF(SQL(f"file_metadata->>'{key}'"), ''),
+                                                           datetime_format).cast('timestamp')
+                   for key, datetime_format in titles_by_key}
+    if len(expressions) == 1:
+        return next(iter(expressions.values()))
+    return Case(None, [(Projects.title.in_(titles), expressions[key])
+                       for key, titles in titles_by_key.items()])
+
+
+def _seq_id_subquery(file_id):
+    """Scalar subquery of the sequence (event identifier) of a file.
+
+    A file linked to several events gets the first identifier, so
+    selecting the sequence never multiplies the rows of the file.
+    """
+    return (Events
+            .select(Events.identifier)
+            .join(EventsFiles, on=(EventsFiles.event_id == Events.id))
+            .where(EventsFiles.file_id == file_id)
+            .order_by(Events.identifier)
+            .limit(1)
+            .alias('seq_id'))
+
+
+def _files_data_to_process_query(mime_type: str, pipeline_name: str,
+                                 pipeline_version: str, site: Union[str, List[str]],
+                                 project_title: Union[str, List[str]],
+                                 use_file_context: bool = False):
+    """Build the query of the files of some sites not processed by a pipeline."""
+    project_titles = _as_list(project_title)
+    if use_file_context:
+        return (
+            FileContext
+            .select(
+                FileContext.file_id,
+                FileContext.url,
+                FileContext.site_identifier,
+                FileContext.datetime,
+                FileContext.longitude,
+                FileContext.latitude,
+                FileContext.site_identifier.alias('site'),
+                FileContext.sampling_area,
+                FileContext.device,
+                FileContext.ecosystem,
+                _seq_id_subquery(FileContext.file_id),
+                FileContext.project_title
+            )
+            .where(
+                (~fn.EXISTS(
+                    ProcessedFiles
+                    .select(SQL('1'))
+                    .join(PipelineInfo, on=(PipelineInfo.id == ProcessedFiles.pipeline))
+                    .where(
+                        (ProcessedFiles.file == FileContext.file_id) &
+                        (PipelineInfo.name == pipeline_name) &
+                        (PipelineInfo.version == pipeline_version))
+                )) &
+                (FileContext.project_title.in_(project_titles)) &
+                (FileContext.mime_type % mime_type) &
+                (FileContext.site_identifier.in_(_as_list(site)))
+            )
+        )
+    datetime_expression = _datetime_expression(project_titles)
+    return (
+        Files
+        .select(
+            Files.id.alias('file_id'),
+            Files.url,
+            Sites.identifier.alias('site_identifier'),
+            datetime_expression.alias('datetime'),
+            Files.file_metadata['Longitude'].alias('longitude'),
+            Files.file_metadata['Latitude'].alias('latitude'),
+            Sites.identifier.alias('site'),
+            SamplingAreas.identifier.alias('sampling_area'),
+            ProjectDevices.project_serial_number.alias('device'),
+            Ecosystems.name.alias('ecosystem'),
+            _seq_id_subquery(Files.id),
+            Projects.title.alias('project_title')
+        )
+        .join(Projects, on=(Projects.id == Files.project))
+        .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point))
+        .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area))
+        .join(Sites, on=(Sites.id == SamplingPoints.site))
+        .join(ProjectDevices, on=(SamplingPoints.device == ProjectDevices.id))
+        .left_outer_join(Ecosystems, on=(Ecosystems.id == Sites.ecosystem))
+        .where(
+            (~fn.EXISTS(
+                ProcessedFiles
+                .select(SQL('1'))
+                .join(PipelineInfo, on=(PipelineInfo.id == ProcessedFiles.pipeline))
+                .where(
+                    (ProcessedFiles.file == Files.id) &
+                    (PipelineInfo.name == pipeline_name) &
+                    (PipelineInfo.version == pipeline_version))
+            )) &
+            (Projects.title.in_(project_titles)) &
+            (Files.mime_type % mime_type) &
+            (Sites.identifier.in_(_as_list(site)))
+        )
+    )
+
+
+def _processed_data_query(mime_type: str,
+                          project_title: Union[str, List[str]],
+                          site: Union[str, List[str]],
+                          pipeline_name: str,
+                          pipeline_version: str,
+                          use_file_context: bool = False,
+                          columns: Optional[Iterable[str]] = None):
+    """Build the query of the observations of some sites made by a pipeline.
+
+    `columns` restricts the select list to these query columns (see
+    `_processed_data_query_columns`); the outer joins that only provide
+    unselected columns (Ecosystems and ObservationGeom) are left out.
+    The sequence is read with a scalar subquery, so every projection
+    returns one row per observation.
+    """
+    project_titles = _as_list(project_title)
+    if use_file_context:
+        file_id = FileContext.file_id
+        file_columns = {
+            'file_id': FileContext.file_id,
+            'url': FileContext.url,
+            'datetime': FileContext.datetime,
+            'longitude': FileContext.longitude,
+            'latitude': FileContext.latitude,
+            'site_identifier': FileContext.site_identifier,
+            'sampling_area': FileContext.sampling_area,
+            'device': FileContext.device,
+            'ecosystem': FileContext.ecosystem,
+        }
+        project_title_column = FileContext.project_title
+    else:
+        file_id = Files.id
+        datetime_expression = _datetime_expression(project_titles)
+        file_columns = {
+            'file_id': Files.id.alias('file_id'),
+            'url': Files.url.alias('url'),
+            'datetime': datetime_expression.alias('datetime'),
+            'longitude': Files.file_metadata['Longitude'].alias('longitude'),
+            'latitude': Files.file_metadata['Latitude'].alias('latitude'),
+            'site_identifier': Sites.identifier.alias('site_identifier'),
+            'sampling_area': SamplingAreas.identifier.alias('sampling_area'),
+            'device': ProjectDevices.project_serial_number.alias('device'),
+            'ecosystem': Ecosystems.name.alias('ecosystem'),
+        }
+        project_title_column = Projects.title.alias('project_title')
+    select_columns = {
+        **file_columns,
+        'obs_id': Observations.id.alias('obs_id'),
+        'confidence': Observations.confidence,
+        'score': Observations.score,
+        'observation_tag': Observations.observation_tag,
+        'observation_type': Observations.observation_type,
+        'bbox': ObservationGeom.bbox,
+        'video_frame_num': ObservationGeom.video_frame_num,
+        'seq_id': _seq_id_subquery(file_id),
+        'project_title': project_title_column,
+    }
+    if columns is not None:
+        columns = set(columns)
+        select_columns = {name: column for name, column in select_columns.items() if name in columns}
+
+    def needs(*names):
+        return any(name in select_columns for name in names)
+
+    if use_file_context:
+        query = FileContext.select(*select_columns.values())
+    else:
+        query = (Files
+                 .select(*select_columns.values())
+                 .join(Projects, on=(Projects.id == Files.project_id))
+                 .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
+                 .join(Sites, on=(Sites.id == SamplingPoints.site_id))
+                 .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area_id))
+                 .join(ProjectDevices, on=(SamplingPoints.device_id == ProjectDevices.id)))
+        if needs('ecosystem'):
+            query = query.left_outer_join(Ecosystems, on=(Ecosystems.id == Sites.ecosystem_id))
+    query = (query
+             .join(Observations, on=(Observations.file_id == file_id))
+             .join(PipelineInfo,  on=(PipelineInfo.id == Observations.pipeline_id)))
+    if needs('bbox', 'video_frame_num'):
+        query = query.left_outer_join(ObservationGeom,  on=(ObservationGeom.id == Observations.geom_id))
+    if use_file_context:
+        return query.where(
+            PipelineInfo.name == pipeline_name,
+            PipelineInfo.version == pipeline_version,
+            FileContext.project_title.in_(project_titles),
+            FileContext.mime_type % mime_type,
+            FileContext.site_identifier.in_(_as_list(site))
+        )
+    return query.where(
+        PipelineInfo.name == pipeline_name,
+        PipelineInfo.version == pipeline_version,
+        Projects.title.in_(project_titles),
+        Files.mime_type % mime_type,
+        Sites.identifier.in_(_as_list(site))
+    )
+
+
+def _processed_data_query_columns(columns: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """Translate the output columns of `get_processed_data` into query columns.
+
+    Raises ValueError for unknown column names.
+    """
+    if columns is None:
+        return None
+    columns = _as_list(columns)
+    unknown = set(columns) - set(PROCESSED_DATA_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown processed data columns: {sorted(unknown)}")
+    query_names = {output_name: query_name for query_name, output_name in PROCESSED_DATA_RENAMES.items()}
+    query_columns = [query_names.get(column, column) for column in columns]
+    if 'classificationProbability' in query_columns:
+        query_columns.remove('classificationProbability')
+        query_columns.append('confidence')
+    return query_columns
+
+
+def _frame_from_rows(rows: List[tuple], columns: List[str],
+                     dtypes: Optional[Dict] = None) -> pd.DataFrame:
+    """Build a DataFrame from cursor rows one column at a time.
+
+    The rows are transposed into column lists, so no per-row model
+    instance or dictionary is allocated. `dtypes` maps column names to a
+    pandas dtype, or to `str` to stringify uuid values.
+    """
+    if len(rows) == 0:
+        data = pd.DataFrame(columns=columns)
+    else:
+        data = pd.DataFrame(dict(zip(columns, map(list, zip(*rows)))), columns=columns)
+    for column, dtype in (dtypes or {}).items():
+        if column not in data.columns:
+            continue
+        if dtype is str:
+            data[column] = pd.Series([None if value is None else str(value)
+                                      for value in data[column]],
+                                     index=data.index, dtype=object)
+        else:
+            data[column] = data[column].astype(dtype)
+    return data
+
+
+def _fetch_query_frame(query, dtypes: Optional[Dict] = None,
+                       renames: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Execute a query and build a DataFrame straight from the cursor rows."""
+    cursor = database.execute(query)
+    rows = cursor.fetchall()
+    columns = [(renames or {}).get(column[0], column[0]) for column in cursor.description]
+    return _frame_from_rows(rows, columns, dtypes)
+
+
+def _iter_query_frames(query, chunk_size: int, dtypes: Optional[Dict] = None,
+                       renames: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+    """Execute a query with a server-side cursor and yield DataFrame chunks.
+
+    The rows are fetched `chunk_size` at a time from a named cursor, so
+    only one chunk is held in memory at once. The cursor is declared
+    WITH HOLD and no transaction is kept open between chunks, so the
+    writes made while iterating (e.g. `insert_observations` for each
+    chunk) commit as usual and several generators can be interleaved.
+    """
+    sql, params = query.sql()
+    query_explain.explain_statement(sql, params)
+    cursor = database.connection().cursor(name=f"balam_{uuid.uuid4().hex}", withhold=True)
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+            columns = [(renames or {}).get(column[0], column[0])
+                       for column in cursor.description]
+            yield _frame_from_rows(rows, columns, dtypes)
+    finally:
+        cursor.close()
+
+
 def get_files_data_to_process(mime_type: str, pipeline_name: str,
-                              pipeline_version: str, site: str,
-                              project_title: str):
+                              pipeline_version: str, site: Union[str, List[str]],
+                              project_title: Union[str, List[str]],
+                              as_dataframe: bool = False,
+                              use_file_context: bool = False):
     """Retrieve data to process based on MIME type, pipeline, site,
     and project.
 
@@ -369,74 +1459,52 @@ def get_files_data_to_process(mime_type: str, pipeline_name: str,
     pipeline_version : str
         Version of the pipeline (from the PipelineInfo table)
         (e.g., 'balanced').
-    site : str
-        The site identifier.
-    project_title : str
-        The title of the project.
+    site : Union[str, List[str]]
+        The site identifier, or a list of site identifiers queried at
+        once (see the 'site_identifier' column).
+    project_title : Union[str, List[str]]
+        The title of the project, or a list of project titles (see the
+        'project_title' column).
+    as_dataframe : bool, optional
+        If True, build a DataFrame directly from the cursor rows instead
+        of a list of dictionaries (default is False).
+    use_file_context : bool, optional
+        If True, read the file context from the `FileContext` materialized
+        view instead of joining the file tables (default is False). The
+        view must exist and only sees the files present at its last
+        refresh (see `refresh_file_context_view`).
 
     Returns
     -------
-    List[Dict[str, any]]
-        A list of dictionaries containing query results.
+    Union[List[Dict[str, any]], pd.DataFrame]
+        The query results.
     """
     try:
-        files_query = (
-            Files
-            .select(
-                Files.id.alias('file_id'),
-                Files.url,
-                Sites.identifier.alias('site_identifier'),
-                fn.DATE(
-                    SQL(f"CAST(file_metadata->>'{DATETIME[project_title]}' AS text)")).alias('date'),
-                fn.SUBSTRING(
-                    SQL(f"CAST(file_metadata->>'{DATETIME[project_title]}' AS text)"), 12, 8).alias('time'),
-                Files.file_metadata['Longitude'].alias('longitude'),
-                Files.file_metadata['Latitude'].alias('latitude'),
-                Sites.identifier.alias('site'),
-                SamplingAreas.identifier.alias('sampling_area'),
-                ProjectDevices.project_serial_number.alias('device'),
-                Ecosystems.name.alias('ecosystem'),
-                Events.identifier.alias('seq_id')
-            )
-            .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point))
-            .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area))
-            .join(Sites, on=(Sites.id == SamplingPoints.site))
-            .join(ProjectDevices, on=(SamplingPoints.device == ProjectDevices.id))
-            .left_outer_join(EventsFiles, on=(EventsFiles.file == Files.id))
-            .left_outer_join(Events, on=(Events.id == EventsFiles.event))
-            .left_outer_join(Ecosystems, on=(Ecosystems.id == Sites.ecosystem))
-            .where(
-                (Files.id.not_in(
-                    ProcessedFiles
-                    .select(ProcessedFiles.file)
-                    .where(
-                        ProcessedFiles.pipeline <<
-                        PipelineInfo.select(PipelineInfo.id).where(
-                            PipelineInfo.name == pipeline_name,
-                            PipelineInfo.version == pipeline_version))
-                )) &
-                (Files.project << Projects.select(Projects.id).where(Projects.title == project_title)) &
-                (Files.mime_type ** mime_type) &
-                (Sites.identifier == site)
-            ).objects()
-        )
+        files_query = _files_data_to_process_query(mime_type=mime_type,
+                                                   pipeline_name=pipeline_name,
+                                                   pipeline_version=pipeline_version,
+                                                   site=site,
+                                                   project_title=project_title,
+                                                   use_file_context=use_file_context)
+        if as_dataframe:
+            return _fetch_query_frame(files_query, dtypes=FILES_DATA_DTYPES).drop(columns=['site'])
 
         # Create a list of dictionaries containing query results.
         results_data = [
             {
                 'file_id': str(files.file_id),
                 'url': files.url,
-                'date': files.date,
-                'time': files.time,
+                'datetime': files.datetime,
                 'longitude': files.longitude,
                 'latitude': files.latitude,
                 'site_identifier': files.site_identifier,
                 'sampling_area': files.sampling_area,
                 'device': files.device,
                 'ecosystem': files.ecosystem,
-                'seq_id': files.seq_id
+                'seq_id': files.seq_id,
+                'project_title': files.project_title
             }
-            for files in files_query
+            for files in files_query.objects()
         ]
     except DoesNotExist as exc:
         logger.error(
@@ -445,11 +1513,153 @@ def get_files_data_to_process(mime_type: str, pipeline_name: str,
     return results_data
 
 
+def iter_files_data_to_process(mime_type: str, pipeline_name: str,
+                               pipeline_version: str, site: Union[str, List[str]],
+                               project_title: Union[str, List[str]],
+                               chunk_size: int = READ_CHUNK_SIZE,
+                               use_file_context: bool = False) -> Iterator[pd.DataFrame]:
+    """Stream the data to process in DataFrame chunks.
+
+    Same rows as `get_files_data_to_process`, read through a server-side
+    cursor so arbitrarily large sites are processed in constant memory.
+
+    Parameters
+    ----------
+    mime_type : str
+        The MIME type (type and format of data) of the data (options:
+        'video/%', 'image/%').
+    pipeline_name : str
+        Name of the pipeline (from the PipelineInfo table).
+    pipeline_version : str
+        Version of the pipeline (from the PipelineInfo table).
+    site : Union[str, List[str]]
+        The site identifier, or a list of site identifiers queried at
+        once (see the 'site_identifier' column).
+    project_title : Union[str, List[str]]
+        The title of the project, or a list of project titles (see the
+        'project_title' column).
+    chunk_size : int, optional
+        Number of rows per DataFrame (default is 50000).
+    use_file_context : bool, optional
+        If True, read the file context from the `FileContext` materialized
+        view instead of joining the file tables (default is False). The
+        view must exist and only sees the files present at its last
+        refresh (see `refresh_file_context_view`).
+
+    Yields
+    ------
+    pd.DataFrame
+        Chunks with the columns returned by `get_files_data_to_process`.
+    """
+    query = _files_data_to_process_query(mime_type=mime_type,
+                                         pipeline_name=pipeline_name,
+                                         pipeline_version=pipeline_version,
+                                         site=site,
+                                         project_title=project_title,
+                                         use_file_context=use_file_context)
+    for data in _iter_query_frames(query, chunk_size, dtypes=FILES_DATA_DTYPES):
+        yield data.drop(columns=['site'])
+
+
+def _encode_files_cursor(created_at: datetime.datetime, file_id: Optional[str]) -> str:
+    """Encode a position in the (Files.created_at, Files.id) order."""
+    position = {'created_at': created_at.isoformat(), 'id': file_id}
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def _decode_files_cursor(cursor: str) -> Tuple[datetime.datetime, Optional[str]]:
+    """Decode a cursor made by `_encode_files_cursor`."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.datetime.fromisoformat(position['created_at']), position['id']
+    except (ValueError, KeyError, TypeError) as exc:
+        raise ValueError(f"Invalid files cursor: {cursor}") from exc
+
+
+def get_files_data_to_process_since(mime_type: str, pipeline_name: str,
+                                    pipeline_version: str, site: Union[str, List[str]],
+                                    project_title: Union[str, List[str]],
+                                    since: Optional[datetime.datetime] = None,
+                                    cursor: Optional[str] = None,
+                                    safety_lag: datetime.timedelta = FILES_CURSOR_SAFETY_LAG
+                                    ) -> Tuple[pd.DataFrame, Optional[str]]:
+    """Retrieve the files to process created after a time or a cursor.
+
+    Same rows as `get_files_data_to_process`, restricted to the files
+    created after `since`, or after the position encoded in `cursor`,
+    in (Files.created_at, Files.id) order. The returned cursor points
+    after the last file, so polling with it only reads new uploads.
+
+    `created_at` is set when a row is written, not when its transaction
+    commits, so a slow upload can commit files older than a cursor
+    already handed out. To leave those files time to become visible,
+    only the files created up to `safety_lag` before the database
+    `now()` are returned, and the cursor never moves past that horizon.
+    A file committed more than `safety_lag` after its `created_at` is
+    still skipped by the cursor; `get_files_data_to_process` finds it.
+
+    Parameters
+    ----------
+    mime_type : str
+        The MIME type (type and format of data) of the data (options:
+        'video/%', 'image/%').
+    pipeline_name : str
+        Name of the pipeline (from the PipelineInfo table).
+    pipeline_version : str
+        Version of the pipeline (from the PipelineInfo table).
+    site : Union[str, List[str]]
+        The site identifier, or a list of site identifiers.
+    project_title : Union[str, List[str]]
+        The title of the project, or a list of project titles.
+    since : datetime.datetime, optional
+        Only files created strictly after this time are returned. Ignored
+        if `cursor` is given (default is None, every file).
+    cursor : str, optional
+        Opaque cursor returned by a previous call (default is None).
+    safety_lag : datetime.timedelta, optional
+        Files created less than this long ago are left for a later call
+        (default is 10 minutes).
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, Optional[str]]
+        The new files to process, with a 'created_at' column, and the
+        cursor to pass to the next call.
+    """
+    query = (_files_data_to_process_query(mime_type=mime_type,
+                                          pipeline_name=pipeline_name,
+                                          pipeline_version=pipeline_version,
+                                          site=site,
+                                          project_title=project_title)
+             .select_extend(Files.created_at.alias('created_at'))
+             .where(Files.created_at <= fn.NOW() - safety_lag)
+             .order_by(Files.created_at, Files.id))
+    if cursor is not None:
+        created_at, file_id = _decode_files_cursor(cursor)
+        if file_id is None:
+            query = query.where(Files.created_at > created_at)
+        else:
+            query = query.where(RowTuple(Files.created_at, Files.id) > RowTuple(created_at, file_id))
+    elif since is not None:
+        query = query.where(Files.created_at > since)
+        cursor = _encode_files_cursor(since, None)
+
+    data = _fetch_query_frame(query, dtypes=FILES_DATA_DTYPES).drop(columns=['site'])
+    if data.shape[0] > 0:
+        last_row = data.iloc[-1]
+        cursor = _encode_files_cursor(pd.Timestamp(last_row['created_at']).to_pydatetime(),
+                                      last_row['file_id'])
+    return data, cursor
+
+
 def get_processed_data(mime_type: str,
-                       project_title: str,
-                       site: str,
+                       project_title: Union[str, List[str]],
+                       site: Union[str, List[str]],
                        pipeline_name: str,
-                       pipeline_version: str):
+                       pipeline_version: str,
+                       as_dataframe: bool = False,
+                       use_file_context: bool = False,
+                       columns: Optional[Iterable[str]] = None):
     """Retrieve data processed by a specific pipeline for a project
     and site.
 
@@ -458,72 +1668,58 @@ def get_processed_data(mime_type: str,
     mime_type : str
         The MIME type (type and format of data) of data (e.g.,
         'image/%', 'video/%').
-    project_title : str
+    project_title : Union[str, List[str]]
         Title of the project (from the Projects table) (e.g.,
-        'Indonesia').
-    site : str
-        Site identifier (from the Sites table) (e.g., '13').
+        'Indonesia'), or a list of titles (see the 'project_title'
+        column).
+    site : Union[str, List[str]]
+        Site identifier (from the Sites table) (e.g., '13'), or a list
+        of site identifiers queried at once (see the 'site_identifier'
+        column).
     pipeline_name : str
         Name of the pipeline (from the PipelineInfo table) (e.g., 'filtering_videos_without_wildlife').
     pipeline_version : str
         Version of the pipeline (from the PipelineInfo table) (e.g.,
         'balanced').
+    as_dataframe : bool, optional
+        If True, build a DataFrame directly from the cursor rows instead
+        of a list of dictionaries (default is False).
+    use_file_context : bool, optional
+        If True, read the file context from the `FileContext` materialized
+        view instead of joining the file tables (default is False). The
+        view must exist and only sees the files present at its last
+        refresh (see `refresh_file_context_view`).
+    columns : Iterable[str], optional
+        Names of the columns to return (default is None, every column).
+        Only the joins providing these columns are made, so lightweight
+        reads such as ['file_id', 'observation_tag', 'score'] transfer
+        and join far less. Raises ValueError for unknown names.
 
     Returns
     -------
-    List[Dict[str, any]]
-        A list of dictionaries containing query results.
+    Union[List[Dict[str, any]], pd.DataFrame]
+        The query results.
     """
     try:
-        query = (Files
-                 .select(
-                     Files.id.alias('file_id'),
-                     Files.url.alias('url'),
-                     fn.DATE(
-                         SQL(f"CAST(file_metadata->>'{DATETIME[project_title]}' AS text)")).alias('date'),
-                     fn.SUBSTRING(
-                         SQL(f"CAST(file_metadata->>'{DATETIME[project_title]}' AS text)"), 12, 8).alias('time'),
-                     Files.file_metadata['Longitude'].alias('longitude'),
-                     Files.file_metadata['Latitude'].alias('latitude'),
-                     Sites.identifier.alias('site_identifier'),
-                     SamplingAreas.identifier.alias('sampling_area'),
-                     ProjectDevices.project_serial_number.alias('device'),
-                     Ecosystems.name.alias('ecosystem'),
-                     Observations.id.alias('obs_id'),
-                     Observations.confidence,
-                     Observations.score,
-                     Observations.observation_tag,
-                     Observations.observation_type,
-                     ObservationGeom.bbox,
-                     ObservationGeom.video_frame_num,
-                     Events.identifier.alias('seq_id')
-                 )
-                 .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
-                 .join(Sites, on=(Sites.id == SamplingPoints.site_id))
-                 .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area_id))
-
-                 .join(ProjectDevices, on=(SamplingPoints.device_id == ProjectDevices.id))
-                 .left_outer_join(Ecosystems, on=(Ecosystems.id == Sites.ecosystem_id))
-                 .join(Observations, on=(Observations.file_id == Files.id))
-                 .join(PipelineInfo,  on=(PipelineInfo.id == Observations.pipeline_id))
-
-                 .left_outer_join(ObservationGeom,  on=(ObservationGeom.id == Observations.geom_id))
-                 .left_outer_join(EventsFiles, on=(EventsFiles.file_id == Files.id))
-                 .left_outer_join(Events, on=(Events.id == EventsFiles.event_id))
-                 .where(
-                     PipelineInfo.name == pipeline_name,
-                     PipelineInfo.version == pipeline_version,
-                     Files.project_id << Projects.select(Projects.id).where(
-                         Projects.title == project_title),
-                     Files.mime_type ** mime_type,
-                     Sites.identifier == site
-                 )).objects()
+        query = _processed_data_query(mime_type=mime_type,
+                                      project_title=project_title,
+                                      site=site,
+                                      pipeline_name=pipeline_name,
+                                      pipeline_version=pipeline_version,
+                                      use_file_context=use_file_context,
+                                      columns=_processed_data_query_columns(columns))
+        if as_dataframe:
+            data = _fetch_query_frame(query, dtypes=PROCESSED_DATA_DTYPES,
+                                      renames=PROCESSED_DATA_RENAMES)
+            return _project_processed_frame(data, columns)
+        if columns is not None:
+            columns = _as_list(columns)
+            return [_processed_data_record(row, columns) for row in query.dicts()]
 
         results_data = [
             {'file_id': str(files.file_id),
              'url': files.url,
-             'date': files.date,
-             'time': files.time,
+             'datetime': files.datetime,
              'longitude': files.longitude,
              'latitude': files.latitude,
              'site_identifier': files.site_identifier,
@@ -538,8 +1734,9 @@ def get_processed_data(mime_type: str,
              'classificationProbability': files.confidence,
              'score': files.score,
              'observation_id': files.obs_id,
-             'seq_id': files.seq_id
-             } for files in query]
+             'seq_id': files.seq_id,
+             'project_title': files.project_title
+             } for files in query.objects()]
     except DoesNotExist:
         logger.error(
             f"DoesNotExist")
@@ -548,6 +1745,200 @@ def get_processed_data(mime_type: str,
     return results_data
 
 
+def iter_processed_data(mime_type: str,
+                        project_title: Union[str, List[str]],
+                        site: Union[str, List[str]],
+                        pipeline_name: str,
+                        pipeline_version: str,
+                        chunk_size: int = READ_CHUNK_SIZE,
+                        use_file_context: bool = False,
+                        columns: Optional[Iterable[str]] = None) -> Iterator[pd.DataFrame]:
+    """Stream the data processed by a pipeline in DataFrame chunks.
+
+    Same rows as `get_processed_data`, read through a server-side cursor
+    so arbitrarily large sites are processed in constant memory.
+
+    Parameters
+    ----------
+    mime_type : str
+        The MIME type (type and format of data) of data (e.g.,
+        'image/%', 'video/%').
+    project_title : Union[str, List[str]]
+        Title of the project (from the Projects table), or a list of
+        titles.
+    site : Union[str, List[str]]
+        Site identifier (from the Sites table), or a list of site
+        identifiers.
+    pipeline_name : str
+        Name of the pipeline (from the PipelineInfo table).
+    pipeline_version : str
+        Version of the pipeline (from the PipelineInfo table).
+    chunk_size : int, optional
+        Number of rows per DataFrame (default is 50000).
+    use_file_context : bool, optional
+        If True, read the file context from the `FileContext` materialized
+        view instead of joining the file tables (default is False). The
+        view must exist and only sees the files present at its last
+        refresh (see `refresh_file_context_view`).
+    columns : Iterable[str], optional
+        Names of the columns to return (default is None, every column).
+
+    Yields
+    ------
+    pd.DataFrame
+        Chunks with the columns returned by `get_processed_data`.
+    """
+    query = _processed_data_query(mime_type=mime_type,
+                                  project_title=project_title,
+                                  site=site,
+                                  pipeline_name=pipeline_name,
+                                  pipeline_version=pipeline_version,
+                                  use_file_context=use_file_context,
+                                  columns=_processed_data_query_columns(columns))
+    for data in _iter_query_frames(query, chunk_size, dtypes=PROCESSED_DATA_DTYPES,
+                                   renames=PROCESSED_DATA_RENAMES):
+        yield _project_processed_frame(data, columns)
+
+
+def _project_processed_frame(data: pd.DataFrame,
+                             columns: Optional[Iterable[str]]) -> pd.DataFrame:
+    """Add 'classificationProbability' and keep the requested columns."""
+    if columns is None:
+        data['classificationProbability'] = data['confidence']
+        return data
+    columns = _as_list(columns)
+    if 'classificationProbability' in columns:
+        data['classificationProbability'] = data['confidence']
+    return data[columns]
+
+
+def _processed_data_record(row: dict, columns: List[str]) -> dict:
+    """Build a `get_processed_data` record with the requested columns."""
+    record = {PROCESSED_DATA_RENAMES.get(name, name): value for name, value in row.items()}
+    if 'file_id' in record:
+        record['file_id'] = str(record['file_id'])
+    record['classificationProbability'] = record.get('confidence')
+    return {column: record[column] for column in columns}
+
+
+def _events_updated_at_subquery(file_id):
+    """Scalar subquery of the last update of the events of a file.
+
+    Linking a file to an event updates the event, so this time moves
+    when the sequence of the file changes.
+    """
+    return (Events
+            .select(fn.MAX(Events.updated_at))
+            .join(EventsFiles, on=(EventsFiles.event_id == Events.id))
+            .where(EventsFiles.file_id == file_id))
+
+
+def _observation_modified_at():
+    """Last modification of an observation row, including its geometry and the events of its file."""
+    return fn.GREATEST(Observations.created_at, Observations.updated_at, ObservationGeom.updated_at,
+                       _events_updated_at_subquery(Observations.file))
+
+
+def get_processed_data_changes(mime_type: str,
+                               project_title: Union[str, List[str]],
+                               site: Union[str, List[str]],
+                               pipeline_name: str,
+                               pipeline_version: str,
+                               since: Optional[datetime.datetime] = None) -> pd.DataFrame:
+    """Retrieve the processed data rows created or updated since a time.
+
+    Same projection as `get_processed_data` plus a 'modified_at' column,
+    the latest of the creation and update times of the observation and
+    its geometry and of the update times of the events of its file,
+    restricted to rows with `modified_at >= since`.
+
+    Parameters
+    ----------
+    mime_type : str
+        The MIME type (type and format of data) of data (e.g.,
+        'image/%', 'video/%').
+    project_title : Union[str, List[str]]
+        Title of the project (from the Projects table), or a list of
+        titles.
+    site : Union[str, List[str]]
+        Site identifier (from the Sites table), or a list of site
+        identifiers.
+    pipeline_name : str
+        Name of the pipeline (from the PipelineInfo table).
+    pipeline_version : str
+        Version of the pipeline (from the PipelineInfo table).
+    since : datetime.datetime, optional
+        Watermark of the previous read; None returns every row
+        (default is None).
+
+    Returns
+    -------
+    pd.DataFrame
+        The changed rows.
+    """
+    query = (_processed_data_query(mime_type=mime_type,
+                                   project_title=project_title,
+                                   site=site,
+                                   pipeline_name=pipeline_name,
+                                   pipeline_version=pipeline_version)
+             .select_extend(_observation_modified_at().alias('modified_at')))
+    if since is not None:
+        query = query.where(_observation_modified_at() >= since)
+    data = _fetch_query_frame(query, dtypes=PROCESSED_DATA_DTYPES, renames=PROCESSED_DATA_RENAMES)
+    data['classificationProbability'] = data['confidence']
+    return data
+
+
+def get_processed_observation_ids(mime_type: str,
+                                  project_title: Union[str, List[str]],
+                                  site: Union[str, List[str]],
+                                  pipeline_name: str,
+                                  pipeline_version: str) -> set:
+    """Retrieve the ids of the observations returned by `get_processed_data`.
+
+    Only the ids are transferred, so comparing them with a local copy of
+    the results finds the deleted observations cheaply.
+
+    Parameters
+    ----------
+    mime_type : str
+        The MIME type (type and format of data) of data (e.g.,
+        'image/%', 'video/%').
+    project_title : Union[str, List[str]]
+        Title of the project (from the Projects table), or a list of
+        titles.
+    site : Union[str, List[str]]
+        Site identifier (from the Sites table), or a list of site
+        identifiers.
+    pipeline_name : str
+        Name of the pipeline (from the PipelineInfo table).
+    pipeline_version : str
+        Version of the pipeline (from the PipelineInfo table).
+
+    Returns
+    -------
+    set
+        The observation ids as strings.
+    """
+    query = (Observations
+             .select(Observations.id)
+             .join(Files, on=(Files.id == Observations.file_id))
+             .join(Projects, on=(Projects.id == Files.project_id))
+             .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
+             .join(Sites, on=(Sites.id == SamplingPoints.site_id))
+             .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area_id))
+             .join(ProjectDevices, on=(SamplingPoints.device_id == ProjectDevices.id))
+             .join(PipelineInfo, on=(PipelineInfo.id == Observations.pipeline_id))
+             .where(
+                 PipelineInfo.name == pipeline_name,
+                 PipelineInfo.version == pipeline_version,
+                 Projects.title.in_(_as_list(project_title)),
+                 Files.mime_type % mime_type,
+                 Sites.identifier.in_(_as_list(site))
+             ))
+    return {str(row[0]) for row in database.execute(query)}
+
+
 def get_file_id_by_url(url: str) -> Optional[str]:
     """Retrieve the file ID using the file URL.
 
@@ -572,6 +1963,46 @@ def get_file_id_by_url(url: str) -> Optional[str]:
     return str(files_id)
 
 
+def resolve_file_ids(urls: Iterable[str],
+                     chunk_size: int = URLS_CHUNK_SIZE) -> Tuple[Dict[str, str], List[str]]:
+    """Retrieve the file IDs of many file URLs at once.
+
+    URLs are deduplicated and looked up in chunked `Files.url IN (...)`
+    queries. Resolved ids are kept in a bounded LRU cache shared by every
+    call in the process, so repeated URLs do not hit the database again.
+
+    Parameters
+    ----------
+    urls : Iterable[str]
+        The URLs of the files (from the Files table).
+    chunk_size : int, optional
+        Maximum number of URLs per query (default is 1000).
+
+    Returns
+    -------
+    Tuple[Dict[str, str], List[str]]
+        A mapping from URL to file ID, and the list of URLs that don't
+        exist in the Files table.
+    """
+    resolved = {}
+    pending = []
+    for url in dict.fromkeys(urls):
+        file_id = _file_id_cache.get(url)
+        if file_id is None:
+            pending.append(url)
+        else:
+            resolved[url] = file_id
+
+    for chunk in chunked(pending, chunk_size):
+        query = Files.select(Files.url, Files.id).where(Files.url.in_(chunk)).tuples()
+        for url, file_id in query:
+            resolved[url] = str(file_id)
+            _file_id_cache.set(url, str(file_id))
+
+    unresolved = [url for url in pending if url not in resolved]
+    return resolved, unresolved
+
+
 def get_project_id_by_title(title: str) -> str:
     """Retrieve the project ID using the project title.
 
@@ -586,13 +2017,17 @@ def get_project_id_by_title(title: str) -> str:
         The project ID if found, or None if the title doesn't exist
         in the Project table.
     """
-
+    cache_key = ('Projects', title)
+    project_id = _lookup_cache.get(cache_key)
+    if project_id is not None:
+        return project_id
     try:
         project = Projects.get(Projects.title == title)
         project_id = project.id
     except Projects.DoesNotExist as e:
         logger.error(f"Failed to obtain project_id: {e}")
         raise ValueError("Failed to obtain project_id.")
+    _lookup_cache.set(cache_key, str(project_id))
     return str(project_id)
 
 
@@ -612,6 +2047,10 @@ def get_pipeline_id_by_name_version(pipeline_name: str, pipeline_version: str) -
         The pipeline ID if found, or None if the pipeline with the
         given name and version doesn't exist.
     """
+    cache_key = ('PipelineInfo', pipeline_name, pipeline_version)
+    pipeline_id = _lookup_cache.get(cache_key)
+    if pipeline_id is not None:
+        return pipeline_id
     try:
         pipeline = PipelineInfo.get(
             (PipelineInfo.name == pipeline_name) &
@@ -621,6 +2060,7 @@ def get_pipeline_id_by_name_version(pipeline_name: str, pipeline_version: str) -
     except PipelineInfo.DoesNotExist as e:
         logger.error(f"Failed to obtain pipeline_id: {e}")
         raise ValueError("Failed to obtain pipeline_id.")
+    _lookup_cache.set(cache_key, str(pipeline_id))
     return str(pipeline_id)
 
 
@@ -638,16 +2078,23 @@ def get_pipeline_execution_params(pipeline_name: str, pipeline_version: str):
         A list of dictionaries containing the execution parameters for
         the specified pipeline.
     """
-    try:
-        pipeline_info = PipelineInfo.get(
-            (PipelineInfo.name == pipeline_name) &
-            (PipelineInfo.version == pipeline_version))
-    except DoesNotExist:
-        logger.error(
-            f"DoesNotExist")
-        raise ValueError("Failed to obtain execuation_params")
-
-    return [pipeline_info.execution_params]
+    cache_key = ('PipelineInfo.execution_params', pipeline_name, pipeline_version)
+    # A single read, so the entry cannot expire between a check and the get.
+    execution_params = _lookup_cache.get(cache_key, _MISSING)
+    if execution_params is _MISSING:
+        try:
+            pipeline_info = PipelineInfo.get(
+                (PipelineInfo.name == pipeline_name) &
+                (PipelineInfo.version == pipeline_version))
+        except DoesNotExist:
+            logger.error(
+                f"DoesNotExist")
+            raise ValueError("Failed to obtain execuation_params")
+        execution_params = pipeline_info.execution_params
+        _lookup_cache.set(cache_key, execution_params)
+
+    # The parameters are a mutable dict, callers get their own copy.
+    return [copy.deepcopy(execution_params)]
 
 
 def get_user_id(username: str) -> Optional[str]:
@@ -664,6 +2111,10 @@ def get_user_id(username: str) -> Optional[str]:
         The user ID if found, or None if the username doesn't exist
         in the Users table.
     """
+    cache_key = ('Users', username)
+    user_id = _lookup_cache.get(cache_key)
+    if user_id is not None:
+        return user_id
     try:
         users = Users.get(
             Users.username == username
@@ -672,87 +2123,298 @@ def get_user_id(username: str) -> Optional[str]:
     except Users.DoesNotExist as e:
         logger.error(f"Failed to obtain user_id: {e}")
         raise ValueError("Failed to obtain user_id.")
+    _lookup_cache.set(cache_key, str(user_id))
     return str(user_id)
 
 # TODO: cambiar nombre
 
 
-def get_files_id_not_in_events(project_title: str, mime_type: str, site_identifier: str):
-    """_summary_
-
-    Parameters
-    ----------
-    project_title : str
-        _description_
-    mime_type : str
-        _description_
-    site_identifier : str
-        _description_
-
-    Returns
-    -------
-    _type_
-        _description_
-    """
-    query = (
+def _files_id_not_in_events_query(project_title: Union[str, List[str]], mime_type: str,
+                                  site_identifier: Union[str, List[str]],
+                                  use_file_context: bool = False):
+    """Build the query of the files of some sites that belong to no event."""
+    project_titles = _as_list(project_title)
+    site_identifiers = _as_list(site_identifier)
+    if use_file_context:
+        return (
+            FileContext
+            .select(
+                FileContext.file_id,
+                FileContext.url,
+                FileContext.datetime,
+                FileContext.longitude,
+                FileContext.latitude,
+                FileContext.site_identifier,
+                FileContext.sampling_area,
+                FileContext.device,
+                FileContext.project_title,
+            )
+            .where(
+                (~fn.EXISTS(
+                    EventsFiles
+                    .select(SQL('1'))
+                    .where(EventsFiles.file_id == FileContext.file_id)
+                ))
+                & (FileContext.project_title.in_(project_titles))
+                & (FileContext.mime_type % mime_type)
+                & (FileContext.site_identifier.in_(site_identifiers))
+            )
+        )
+    datetime_expression = _datetime_expression(project_titles)
+    return (
         Files
         .select(
             Files.id.alias('file_id'),
             Files.url.alias('url'),
-            fn.DATE(
-                SQL(f"CAST(file_metadata->>'{DATETIME[project_title]}' AS text)")).alias('date'),
-            fn.SUBSTRING(
-                SQL(f"CAST(file_metadata->>'{DATETIME[project_title]}'  AS text)"), 12, 8).alias('time'),
+            datetime_expression.alias('datetime'),
             Files.file_metadata['Longitude'].alias('longitude'),
             Files.file_metadata['Latitude'].alias('latitude'),
             Sites.identifier.alias('site_identifier'),
             SamplingAreas.identifier.alias('sampling_area'),
             ProjectDevices.project_serial_number.alias('device'),
+            Projects.title.alias('project_title'),
         )
+        .join(Projects, on=(Projects.id == Files.project_id))
         .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
         .join(Sites, on=(Sites.id == SamplingPoints.site_id))
         .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area_id))
         .join(ProjectDevices, on=(SamplingPoints.device_id == ProjectDevices.id))
         .where(
-            (Files.id.not_in(
+            (~fn.EXISTS(
                 EventsFiles
-                .select(EventsFiles.file_id)
-                .join(Files, on=(Files.id == EventsFiles.file_id))
-                .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
-                .join(Sites, on=(Sites.id == SamplingPoints.site_id))
-                .where(
-                    (Files.project_id.in_(
-                        Projects
-                        .select(Projects.id)
-                        .where(Projects.title == project_title)
-                    ))
-                    & (Files.mime_type ** mime_type)
-                    & (Sites.identifier == site_identifier)
-                )
-            ))
-            & (Files.project_id.in_(
-                Projects
-                .select(Projects.id)
-                .where(Projects.title == project_title)
+                .select(SQL('1'))
+                .where(EventsFiles.file_id == Files.id)
             ))
-            & (Files.mime_type ** mime_type)
-            & (Sites.identifier == site_identifier)
+            & (Projects.title.in_(project_titles))
+            & (Files.mime_type % mime_type)
+            & (Sites.identifier.in_(site_identifiers))
         )
-    ).objects()
+    )
+
+
+def get_files_id_not_in_events(project_title: Union[str, List[str]], mime_type: str,
+                               site_identifier: Union[str, List[str]],
+                               as_dataframe: bool = False,
+                               use_file_context: bool = False):
+    """Retrieve the files of some sites that do not belong to any event.
+
+    Parameters
+    ----------
+    project_title : Union[str, List[str]]
+        Title of the project (from the Projects table), or a list of
+        titles.
+    mime_type : str
+        The MIME type (type and format of data) of the data (e.g.,
+        'image/%', 'video/%').
+    site_identifier : Union[str, List[str]]
+        Site identifier (from the Sites table), or a list of site
+        identifiers.
+    as_dataframe : bool, optional
+        If True, build a DataFrame directly from the cursor rows instead
+        of a list of dictionaries (default is False).
+    use_file_context : bool, optional
+        If True, read the file context from the `FileContext` materialized
+        view instead of joining the file tables (default is False). The
+        view must exist and only sees the files present at its last
+        refresh (see `refresh_file_context_view`).
+
+    Returns
+    -------
+    Union[List[Dict[str, any]], pd.DataFrame]
+        The query results.
+    """
+    query = _files_id_not_in_events_query(project_title=project_title,
+                                          mime_type=mime_type,
+                                          site_identifier=site_identifier,
+                                          use_file_context=use_file_context)
+    if as_dataframe:
+        return _fetch_query_frame(query, dtypes=FILES_DATA_DTYPES)
+
     results_data = [
         {'file_id': str(files.file_id),
          'url': str(files.url),
-         'date': files.date,
-         'time': files.time,
+         'datetime': files.datetime,
          'longitude': files.longitude,
          'latitude': files.latitude,
          'site_identifier': files.site_identifier,
          'sampling_area': files.sampling_area,
          'device': files.device,
-         } for files in query]
+         'project_title': files.project_title,
+         } for files in query.objects()]
     return results_data
 # endregion
 
+# region CACHE
+
+
+def invalidate_processed_data_cache(project_id: Optional[str] = None,
+                                    pipeline_id: Optional[str] = None,
+                                    site_identifier: Optional[str] = None) -> int:
+    """Drop the cached processed data affected by a write.
+
+    The cache is keyed by names (project title, pipeline name and
+    version), so the ids of the write are resolved first. Every cached
+    result matching all the given arguments is removed, whatever its
+    file type, and every result is removed when no argument is given;
+    no query is made while the cache is empty.
+
+    Parameters
+    ----------
+    project_id : str, optional
+        The ID of the project that was written.
+    pipeline_id : str, optional
+        The ID of the pipeline whose results were written.
+    site_identifier : str, optional
+        The identifier of the site that was written.
+
+    Returns
+    -------
+    int
+        The number of cached results removed.
+    """
+    if processed_data_cache.is_empty():
+        return 0
+
+    criteria = {}
+    if project_id is not None:
+        project = Projects.get_or_none(Projects.id == project_id)
+        if project is not None:
+            criteria['project_title'] = project.title
+    if pipeline_id is not None:
+        pipeline = PipelineInfo.get_or_none(PipelineInfo.id == pipeline_id)
+        if pipeline is not None:
+            criteria['pipeline_name'] = pipeline.name
+            criteria['pipeline_version'] = pipeline.version
+    if site_identifier is not None:
+        criteria['site'] = site_identifier
+    return processed_data_cache.invalidate(**criteria)
+
+
+def warm_lookup_cache() -> Dict[str, int]:
+    """Preload the id lookups of the small, nearly static tables.
+
+    Reads every row of Projects, Users, ObservationMethod and
+    PipelineInfo with one query per table, so the later calls to
+    `get_project_id_by_title`, `get_user_id`, `get_obs_method_id`,
+    `get_pipeline_id_by_name_version` and `get_pipeline_execution_params`
+    are served from memory until the entries expire.
+
+    Returns
+    -------
+    Dict[str, int]
+        Number of rows loaded per table.
+    """
+    counts = {'Projects': 0, 'Users': 0, 'ObservationMethod': 0, 'PipelineInfo': 0}
+    for title, project_id in Projects.select(Projects.title, Projects.id).tuples():
+        _lookup_cache.set(('Projects', title), str(project_id))
+        counts['Projects'] += 1
+    for username, user_id in Users.select(Users.username, Users.id).tuples():
+        _lookup_cache.set(('Users', username), str(user_id))
+        counts['Users'] += 1
+    for name, obs_method_id in ObservationMethod.select(ObservationMethod.name,
+                                                        ObservationMethod.id).tuples():
+        _lookup_cache.set(('ObservationMethod', name), str(obs_method_id))
+        counts['ObservationMethod'] += 1
+    for name, version, pipeline_id, execution_params in (PipelineInfo
+                                                         .select(PipelineInfo.name,
+                                                                 PipelineInfo.version,
+                                                                 PipelineInfo.id,
+                                                                 PipelineInfo.execution_params)
+                                                         .tuples()):
+        _lookup_cache.set(('PipelineInfo', name, version), str(pipeline_id))
+        _lookup_cache.set(('PipelineInfo.execution_params', name, version), execution_params)
+        counts['PipelineInfo'] += 1
+    return counts
+
+
+def invalidate_lookup_cache():
+    """Forget every cached project, user, pipeline and observation method id."""
+    _lookup_cache.clear()
+
+# endregion
+
+# region FILE CONTEXT VIEW
+
+
+def _file_context_query():
+    """Build the query materialized by the `FileContext` view.
+
+    One row per file with its project, site, sampling area, device and
+    ecosystem, and the capture timestamp and coordinates extracted from
+    `file_metadata`, i.e. the joins and JSONB parsing repeated by every
+    read query.
+    """
+    datetime_expression = _datetime_expression(list(DATETIME))
+    return (
+        Files
+        .select(
+            Files.id.alias('file_id'),
+            Files.url,
+            Files.project_id,
+            Projects.title.alias('project_title'),
+            Files.mime_type,
+            Files.created_at,
+            Sites.identifier.alias('site_identifier'),
+            SamplingAreas.identifier.alias('sampling_area'),
+            ProjectDevices.project_serial_number.alias('device'),
+            Ecosystems.name.alias('ecosystem'),
+            datetime_expression.alias('datetime'),
+            Files.file_metadata['Longitude'].alias('longitude'),
+            Files.file_metadata['Latitude'].alias('latitude')
+        )
+        .join(Projects, on=(Projects.id == Files.project_id))
+        .join(SamplingPoints, on=(SamplingPoints.id == Files.sampling_point_id))
+        .join(Sites, on=(Sites.id == SamplingPoints.site_id))
+        .join(SamplingAreas, on=(SamplingAreas.id == SamplingPoints.sampling_area_id))
+        .join(ProjectDevices, on=(SamplingPoints.device_id == ProjectDevices.id))
+        .left_outer_join(Ecosystems, on=(Ecosystems.id == Sites.ecosystem_id))
+    )
+
+
+def create_file_context_view():
+    """Create and populate the `FileContext` materialized view.
+
+    The view gets a unique index on 'file_id', required by concurrent
+    refreshes, and an index on (project_title, site_identifier,
+    mime_type) used by the read functions called with
+    `use_file_context=True`. Does nothing if the view already exists.
+    """
+    sql, params = _file_context_query().sql()
+    # Materialized views cannot have bind parameters, so the query is
+    # rendered with its values by psycopg2.
+    view_sql = database.connection().cursor().mogrify(sql, params).decode('utf-8')
+    table = FileContext._meta.table_name
+    with database.atomic():
+        database.execute_sql(f'CREATE MATERIALIZED VIEW IF NOT EXISTS "{table}" AS {view_sql}')
+        database.execute_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_file_id" '
+                             f'ON "{table}" (file_id)')
+        database.execute_sql(f'CREATE INDEX IF NOT EXISTS "{table}_project_site_mime_type" '
+                             f'ON "{table}" (project_title, site_identifier, mime_type)')
+
+
+def refresh_file_context_view(concurrently: bool = True):
+    """Refresh the `FileContext` materialized view.
+
+    Must be called after files are uploaded or their metadata, site or
+    device change; until then the read functions called with
+    `use_file_context=True` do not see those changes.
+
+    Parameters
+    ----------
+    concurrently : bool, optional
+        If True, refresh without locking out the readers of the view
+        (default is True). Must be called outside of a transaction.
+    """
+    concurrently_sql = 'CONCURRENTLY ' if concurrently else ''
+    database.execute_sql(f'REFRESH MATERIALIZED VIEW {concurrently_sql}"{FileContext._meta.table_name}"')
+
+
+def drop_file_context_view():
+    """Drop the `FileContext` materialized view if it exists."""
+    database.execute_sql(f'DROP MATERIALIZED VIEW IF EXISTS "{FileContext._meta.table_name}"')
+
+# endregion
+
 # region DELETE
 
 
@@ -788,7 +2450,7 @@ def delete_observations(project_id: str, site_identifier: str,
                 .join(Projects)
                 .where(
                     (Sites.identifier == site_identifier) &
-                    (Files.mime_type ** mime_type) &
+                    (Files.mime_type % mime_type) &
                     (Projects.id == project_id)
                 )
              ) &
@@ -883,7 +2545,7 @@ def delete_processed_files(project_id: str, pipeline_id: str, site_identifier: s
                 .join(Projects)
                 .where(
                     (Sites.identifier == site_identifier) &
-                    (Files.mime_type ** mime_type) &
+                    (Files.mime_type % mime_type) &
                     (Projects.id == project_id)
                 )
              ) &
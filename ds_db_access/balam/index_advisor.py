@@ -0,0 +1,302 @@
+"""Index advisor for the query workload of `database_queries`.
+
+The read and write functions filter and join on a handful of columns
+that the tables created outside of this package may not index. This
+module lists the indexes those query shapes need, compares them with
+the indexes found in `pg_indexes`, and reports the missing ones together
+with the size and scan counters of their table from
+`pg_stat_user_tables`, so the tables read with sequential scans come
+first.
+
+The missing indexes can be emitted as `CREATE INDEX CONCURRENTLY`
+statements, to be reviewed and applied by a migration, or applied
+directly:
+
+    python -m ds_db_access.balam.index_advisor            # report
+    python -m ds_db_access.balam.index_advisor --sql      # statements
+    python -m ds_db_access.balam.index_advisor --apply    # create them
+
+An existing btree index covers a recommendation when its leading key
+columns are the recommended ones. Invalid indexes, left behind by a
+failed concurrent build, cover nothing and are dropped before being
+built again.
+"""
+import argparse
+import re
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from ds_db_access.balam.balam_models import EventsFiles
+from ds_db_access.balam.balam_models import Files
+from ds_db_access.balam.balam_models import Observations
+from ds_db_access.balam.balam_models import ProcessedFiles
+from ds_db_access.balam.balam_models import Sites
+from ds_db_access.balam.balam_models import database
+
+
+@dataclass
+class IndexRecommendation:
+    """A btree index needed by the query workload."""
+    table: str
+    name: str
+    keys: Tuple[str, ...]
+    reason: str
+
+    def create_sql(self) -> str:
+        return (f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{self.name}" '
+                f'ON "{self.table}" ({", ".join(self.keys)})')
+
+    def drop_sql(self) -> str:
+        return f'DROP INDEX CONCURRENTLY IF EXISTS "{self.name}"'
+
+
+def _column(field) -> str:
+    return f'"{field.column_name}"'
+
+
+def recommended_indexes() -> List[IndexRecommendation]:
+    """Return the indexes needed by the queries of `database_queries`."""
+    files = Files._meta.table_name
+    recommendations = [
+        IndexRecommendation(
+            table=Observations._meta.table_name,
+            name='Observations_file_id',
+            keys=(_column(Observations.file),),
+            reason='join of the observations of a file and delete by file'),
+        IndexRecommendation(
+            table=Observations._meta.table_name,
+            name='Observations_pipeline_id',
+            keys=(_column(Observations.pipeline),),
+            reason='filter of the observations made by a pipeline'),
+        IndexRecommendation(
+            table=ProcessedFiles._meta.table_name,
+            name='ProcessedFiles_pipeline_id_file_id',
+            keys=(_column(ProcessedFiles.pipeline), _column(ProcessedFiles.file)),
+            reason='anti-join of the files already processed by a pipeline'),
+        IndexRecommendation(
+            table=files,
+            name='Files_mime_type_pattern',
+            keys=(f'{_column(Files.mime_type)} text_pattern_ops',),
+            reason="case-sensitive prefix LIKE filter on the MIME type ('image/%')"),
+        IndexRecommendation(
+            table=files,
+            name='Files_created_at_id',
+            keys=(_column(Files.created_at), _column(Files.id)),
+            reason='keyset pagination of the files created since a cursor'),
+        IndexRecommendation(
+            table=Sites._meta.table_name,
+            name='Sites_identifier',
+            keys=(_column(Sites.identifier),),
+            reason='filter of the files of some sites'),
+        IndexRecommendation(
+            table=EventsFiles._meta.table_name,
+            name='Events_files_file_id',
+            keys=(_column(EventsFiles.file),),
+            reason='anti-join of the files that belong to no event'),
+    ]
+    return recommendations
+
+
+def existing_indexes() -> Dict[str, List[dict]]:
+    """Return the indexes of the tables of the current schema.
+
+    Returns
+    -------
+    Dict[str, List[dict]]
+        For each table, its indexes with their 'name', 'definition',
+        normalized btree 'keys' (None for other methods and partial
+        indexes) and 'valid' flag.
+    """
+    cursor = database.execute_sql(
+        "SELECT i.tablename, i.indexname, i.indexdef, x.indisvalid "
+        "FROM pg_indexes i "
+        "JOIN pg_namespace n ON n.nspname = i.schemaname "
+        "JOIN pg_class c ON c.relname = i.indexname AND c.relnamespace = n.oid "
+        "JOIN pg_index x ON x.indexrelid = c.oid "
+        "WHERE i.schemaname = current_schema()")
+    indexes = {}
+    for table, name, definition, valid in cursor.fetchall():
+        indexes.setdefault(table, []).append({'name': name,
+                                              'definition': definition,
+                                              'keys': _index_keys(definition),
+                                              'valid': valid})
+    return indexes
+
+
+def table_statistics() -> Dict[str, dict]:
+    """Return the live rows and scan counters of the tables of the current schema."""
+    cursor = database.execute_sql(
+        "SELECT relname, n_live_tup, seq_scan, seq_tup_read, idx_scan "
+        "FROM pg_stat_user_tables WHERE schemaname = current_schema()")
+    return {table: {'rows': rows, 'seq_scan': seq_scan, 'seq_tup_read': seq_tup_read,
+                    'idx_scan': idx_scan}
+            for table, rows, seq_scan, seq_tup_read, idx_scan in cursor.fetchall()}
+
+
+def missing_indexes(indexes: Optional[Dict[str, List[dict]]] = None,
+                    statistics: Optional[Dict[str, dict]] = None) -> List[dict]:
+    """Report the recommended indexes not covered by an existing index.
+
+    Parameters
+    ----------
+    indexes : Dict[str, List[dict]], optional
+        Existing indexes, as returned by `existing_indexes` (default is
+        None, read from the database).
+    statistics : Dict[str, dict], optional
+        Table statistics, as returned by `table_statistics` (default is
+        None, read from the database).
+
+    Returns
+    -------
+    List[dict]
+        One entry per missing index with its 'recommendation', the
+        'statements' creating it, the 'invalid' flag of a failed build
+        with the same name, and the 'rows', 'seq_scan' and 'idx_scan'
+        of its table. Sorted by the rows read with sequential scans.
+    """
+    if indexes is None:
+        indexes = existing_indexes()
+    if statistics is None:
+        statistics = table_statistics()
+
+    report = []
+    for recommendation in recommended_indexes():
+        table_indexes = indexes.get(recommendation.table, [])
+        if _is_covered(recommendation, table_indexes):
+            continue
+        invalid = any(index['name'] == recommendation.name and not index['valid']
+                      for index in table_indexes)
+        statements = [recommendation.create_sql()]
+        if invalid:
+            statements.insert(0, recommendation.drop_sql())
+        table_stats = statistics.get(recommendation.table, {})
+        report.append({'recommendation': recommendation,
+                       'statements': statements,
+                       'invalid': invalid,
+                       'rows': table_stats.get('rows'),
+                       'seq_scan': table_stats.get('seq_scan'),
+                       'seq_tup_read': table_stats.get('seq_tup_read'),
+                       'idx_scan': table_stats.get('idx_scan')})
+    report.sort(key=lambda entry: entry['seq_tup_read'] or 0, reverse=True)
+    return report
+
+
+def create_index_statements(report: Optional[List[dict]] = None) -> List[str]:
+    """Return the statements building the missing indexes."""
+    if report is None:
+        report = missing_indexes()
+    return [statement for entry in report for statement in entry['statements']]
+
+
+def apply_indexes(report: Optional[List[dict]] = None) -> List[str]:
+    """Build the missing indexes and return the statements executed.
+
+    The indexes are built concurrently, so the tables stay writable, one
+    statement at a time outside of any transaction.
+    """
+    if database.in_transaction():
+        raise ValueError("Indexes are built concurrently and cannot be applied inside a transaction")
+    statements = create_index_statements(report)
+    for statement in statements:
+        database.execute_sql(statement)
+    return statements
+
+
+def _is_covered(recommendation: IndexRecommendation, table_indexes: List[dict]) -> bool:
+    keys = [_normalize_key(key) for key in recommendation.keys]
+    for index in table_indexes:
+        if index['valid'] and index['keys'] is not None and index['keys'][:len(keys)] == keys:
+            return True
+    return False
+
+
+def _index_keys(definition: str) -> Optional[List[str]]:
+    """Normalized key columns of a btree index definition from `pg_indexes`.
+
+    Returns None for other access methods and for partial indexes, which
+    do not serve every query.
+    """
+    match = re.search(r'\sUSING\s+(\w+)\s*\(', definition)
+    if match is None or match.group(1).lower() != 'btree':
+        return None
+    start = match.end()
+    depth, in_quotes = 1, False
+    keys, current = [], ''
+    position = start
+    while position < len(definition) and depth > 0:
+        char = definition[position]
+        if char == "'":
+            in_quotes = not in_quotes
+        elif not in_quotes and char == '(':
+            depth += 1
+        elif not in_quotes and char == ')':
+            depth -= 1
+            if depth == 0:
+                break
+        elif not in_quotes and char == ',' and depth == 1:
+            keys.append(current)
+            current = ''
+            position += 1
+            continue
+        current += char
+        position += 1
+    keys.append(current)
+    if re.search(r'\sWHERE\s', definition[position:]):
+        return None
+    return [_normalize_key(key) for key in keys]
+
+
+def _normalize_key(key: str) -> str:
+    """Normalize an index key so hand written and pg_indexes keys compare equal."""
+    key = key.replace('"', '').replace('::text', '')
+    key = re.sub(r'\s+', ' ', key).strip()
+    key = re.sub(r'\s*([()])\s*', r'\1', key)
+    while key.startswith('(') and key.endswith(')') and _is_wrapped(key):
+        key = key[1:-1].strip()
+    return key
+
+
+def _is_wrapped(key: str) -> bool:
+    """True if the first parenthesis of `key` closes at its last character."""
+    depth = 0
+    for position, char in enumerate(key):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return position == len(key) - 1
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sql', action='store_true',
+                        help='print the statements building the missing indexes')
+    parser.add_argument('--apply', action='store_true',
+                        help='build the missing indexes concurrently')
+    args = parser.parse_args()
+
+    report = missing_indexes()
+    if args.apply:
+        for statement in apply_indexes(report):
+            print(f"{statement};")
+    elif args.sql:
+        for statement in create_index_statements(report):
+            print(f"{statement};")
+    else:
+        if len(report) == 0:
+            print("No missing indexes.")
+        for entry in report:
+            recommendation = entry['recommendation']
+            invalid = ' (invalid index present)' if entry['invalid'] else ''
+            print(f"{recommendation.table}.{recommendation.name}{invalid}: {recommendation.reason}; "
+                  f"rows={entry['rows']} seq_scan={entry['seq_scan']} idx_scan={entry['idx_scan']}")
+
+
+if __name__ == '__main__':
+    main()
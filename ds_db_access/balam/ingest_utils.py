@@ -0,0 +1,193 @@
+"""Helpers of the observation ingest that do not depend on the dataset classes.
+
+`IngestJournal` records the chunks of a results file already stored, so
+an interrupted ingest can resume, `align_chunks_to_files` keeps the rows
+of a file in a single chunk, and the site worker functions run
+`store_observations` of a dataset class in the processes of the pool
+used by `aux_utils.store_observations_by_site`.
+"""
+import datetime
+import json
+import logging
+import os
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+import pandas as pd
+
+from ds_db_access.balam.balam_models import database
+from ds_db_access.balam.database_queries import warm_lookup_cache
+
+logger = logging.getLogger(__name__)
+
+
+class IngestJournal:
+    """Append-only journal of the chunks of a results file already stored.
+
+    Each committed chunk is recorded as a JSON line with its number, row
+    offset and size, so an interrupted ingest can resume from the first
+    chunk that was not committed. Entries are scoped to the results file,
+    project and pipeline version, so ingesting the same file for another
+    pipeline does not skip its chunks.
+
+    Parameters
+    ----------
+    path : str
+        Path of the journal file. It is created if it does not exist.
+    results_path : str
+        The results file being ingested.
+    chunk_size : int
+        Number of rows per chunk. It must not change between runs that
+        share a journal.
+    project_title : str
+        The title of the project the observations belong to.
+    pipeline_name : str
+        The name of the pipeline that produced the results.
+    pipeline_version : str
+        The version of the pipeline that produced the results.
+    """
+
+    def __init__(self, path: str, results_path: str, chunk_size: int,
+                 project_title: str, pipeline_name: str, pipeline_version: str):
+        self.path = path
+        self.results_path = os.path.abspath(results_path)
+        self.chunk_size = chunk_size
+        self.project_title = project_title
+        self.pipeline_name = pipeline_name
+        self.pipeline_version = pipeline_version
+
+    def _scope(self) -> dict:
+        return {'results_path': self.results_path,
+                'project_title': self.project_title,
+                'pipeline_name': self.pipeline_name,
+                'pipeline_version': self.pipeline_version}
+
+    def committed_chunks(self) -> set:
+        """Return the numbers of the chunks already stored."""
+        if not os.path.isfile(self.path):
+            return set()
+
+        committed = set()
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                if line.strip() == '':
+                    continue
+                entry = json.loads(line)
+                if any(entry.get(key) != value for key, value in self._scope().items()):
+                    continue
+                if entry['chunk_size'] != self.chunk_size:
+                    raise ValueError(
+                        f"Journal {self.path} was written with chunk_size={entry['chunk_size']}, "
+                        f"got chunk_size={self.chunk_size}.")
+                committed.add(entry['chunk'])
+        return committed
+
+    def commit(self, chunk: int, rows: int):
+        """Record a chunk as stored."""
+        entry = {**self._scope(),
+                 'chunk_size': self.chunk_size,
+                 'chunk': chunk,
+                 'offset': chunk * self.chunk_size,
+                 'rows': rows,
+                 'committed_at': datetime.datetime.now().isoformat()}
+        with open(self.path, 'a') as journal_file:
+            journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+
+def align_chunks_to_files(chunks: Iterable[pd.DataFrame], file_field: str) -> Iterator[pd.DataFrame]:
+    """Move the rows of the last file of each chunk to the next chunk.
+
+    `upsert_observations` takes the rows of each call as the complete
+    results of their files, so the observations of a file must not be
+    split across chunks. Rows of a file are kept together as long as
+    they are contiguous in the input.
+
+    Parameters
+    ----------
+    chunks : Iterable[pd.DataFrame]
+        Consecutive chunks of observations.
+    file_field : str
+        Column holding the file of each observation.
+
+    Yields
+    ------
+    pd.DataFrame
+        The chunks, each ending at a change of file.
+    """
+    pending = None
+    for chunk_df in chunks:
+        if pending is not None:
+            chunk_df = pd.concat([pending, chunk_df], ignore_index=True)
+        files = chunk_df[file_field]
+        tail_start = len(chunk_df)
+        while tail_start > 0 and files.iloc[tail_start - 1] == files.iloc[-1]:
+            tail_start -= 1
+        pending = chunk_df.iloc[tail_start:]
+        if tail_start > 0:
+            yield chunk_df.iloc[:tail_start]
+    if pending is not None and len(pending) > 0:
+        yield pending
+
+
+def close_for_workers():
+    """Close the connection of this process before starting the workers.
+
+    Connections cannot be shared with the workers, each one opens its
+    own. Closing would discard an open transaction of the caller, so it
+    is refused instead.
+    """
+    if database.in_transaction():
+        raise ValueError("The sites are stored by worker processes and cannot be stored "
+                         "inside a transaction of this connection")
+    database.close()
+
+
+def init_site_worker():
+    """Preload the id lookups once per worker process."""
+    try:
+        database.connect(reuse_if_open=True)
+        warm_lookup_cache()
+    except Exception as e:
+        logger.warning(f"Failed to warm the lookup cache: {e}")
+    finally:
+        database.close()
+
+
+def store_site_observations(dataset_class,
+                            site: str,
+                            project_title: str,
+                            pipeline_name: str,
+                            pipeline_version: str,
+                            observations_df: Optional[pd.DataFrame] = None,
+                            results_path: Optional[str] = None,
+                            store_kwargs: Optional[dict] = None) -> dict:
+    """Store the observations of one site in a worker process.
+
+    Each worker opens its own connection and reports errors in the
+    returned summary instead of raising, so one failing site does not
+    stop the others. A `store_observations` call that returns None is
+    reported as an error.
+    """
+    summary = {'site': site, 'rows': None, 'stored': None, 'error': None}
+    try:
+        database.connect(reuse_if_open=True)
+        if results_path is not None:
+            obs_ds = dataset_class.from_csv(results_path)
+        else:
+            obs_ds = dataset_class.from_dataframes([observations_df])
+        summary['rows'] = len(obs_ds.as_dataframe())
+        stored = obs_ds.store_observations(project_title=project_title,
+                                           pipeline_name=pipeline_name,
+                                           pipeline_version=pipeline_version,
+                                           **(store_kwargs or {}))
+        if stored is None:
+            raise RuntimeError(f"The observations of site {site} could not be stored.")
+        summary['stored'] = stored
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        database.close()
+    return summary
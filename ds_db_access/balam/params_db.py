@@ -16,3 +16,10 @@ DATETIME = {
     'SiPeCaM': 'DateTimeOriginal',
     'Northern Cluster Mexico': 'Datetime'
 }
+
+# PostgreSQL to_timestamp format of the datetime metadata of each project
+DATETIME_FORMAT = {
+    'Indonesia': 'YYYY-MM-DD HH24:MI:SS',
+    'SiPeCaM': 'YYYY-MM-DD HH24:MI:SS',
+    'Northern Cluster Mexico': 'YYYY-MM-DD HH24:MI:SS'
+}
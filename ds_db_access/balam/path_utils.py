@@ -0,0 +1,113 @@
+"""Conversions between file urls and paths relative to their 'data' directory."""
+import os
+
+import pandas as pd
+
+from ds_db_access.balam.params_db import S3_PATH
+
+
+def find_file_url(file_path: str, s3_path: str) -> str:
+    """
+    Generate a URL for a file located in a specific directory.
+
+    This function constructs a URL for a file based on its relative path
+    within a designated directory.
+
+    Parameters
+    ----------
+    file_path : str
+        The relative path to the file within the specified directory.
+
+    Returns
+    -------
+    str
+        The URL representing the file's location.
+    """
+    url = os.path.join(s3_path, file_path)
+
+    return url
+
+
+def lambda_handler(s):
+    parts = s.split('/')
+    data_index = parts.index('data')
+    result = '/'.join(parts[data_index + 1:])
+    return result
+
+
+# Path relative to the first 'data' directory of a url, for the urls
+# that do not start with a prefix of S3_PATH.
+DATA_DIR_PATTERN = r'^(?:.*?/)?data(?:/|$)(.*)$'
+# Arrow backed strings, whose str methods run in native code.
+ARROW_STRING_DTYPE = 'string[pyarrow]'
+
+
+def urls_to_file_paths(urls: pd.Series) -> pd.Series:
+    """
+    Convert file urls into paths relative to their 'data' directory.
+
+    Vectorized equivalent of `urls.apply(lambda_handler)`: urls starting
+    with a known prefix of `S3_PATH` are sliced, the others are matched
+    against `DATA_DIR_PATTERN`.
+
+    Parameters
+    ----------
+    urls : pd.Series
+        The urls of the files (e.g.,
+        's3://sipecam-open-data/data/13/1/image.jpg').
+
+    Returns
+    -------
+    pd.Series
+        The relative paths (e.g., '13/1/image.jpg'), with the index and
+        dtype of `urls`. Missing urls stay missing.
+
+    Raises
+    ------
+    ValueError
+        If a url has no 'data' directory.
+    """
+    strings = urls.astype(ARROW_STRING_DTYPE)
+    paths = pd.Series(pd.NA, index=urls.index, dtype=ARROW_STRING_DTYPE)
+    pending = strings.notna().to_numpy(dtype=bool, copy=True)
+    for prefix in sorted(set(S3_PATH.values()), key=len, reverse=True):
+        # Slicing only matches lambda_handler if the prefix ends with its
+        # first 'data' directory.
+        parts = prefix.split('/')
+        if parts[-1] != '' or 'data' not in parts or parts.index('data') != len(parts) - 2:
+            continue
+        matches = pending & strings.str.startswith(prefix).fillna(False).to_numpy(dtype=bool)
+        if matches.any():
+            paths = strings.str.slice(len(prefix)).where(matches, paths)
+            pending &= ~matches
+    if pending.any():
+        extracted = strings[pending].str.extract(DATA_DIR_PATTERN, expand=False)
+        if extracted.isna().any():
+            raise ValueError(f"Url without a 'data' directory: {strings[pending][extracted.isna()].iloc[0]}")
+        paths[pending] = extracted
+    return paths.astype(urls.dtype)
+
+
+def file_paths_to_urls(file_paths: pd.Series, s3_path: str) -> pd.Series:
+    """
+    Build the urls of files from their relative paths.
+
+    Vectorized equivalent of applying `find_file_url` to every path.
+
+    Parameters
+    ----------
+    file_paths : pd.Series
+        The paths of the files relative to `s3_path`.
+    s3_path : str
+        The url of the directory of the files (see `S3_PATH`).
+
+    Returns
+    -------
+    pd.Series
+        The urls, with the index of `file_paths`.
+    """
+    strings = file_paths.astype(ARROW_STRING_DTYPE)
+    prefix = s3_path if s3_path == '' or s3_path.endswith('/') else f"{s3_path}/"
+    # os.path.join drops the directory of absolute paths
+    urls = (prefix + strings).where(~strings.str.startswith('/').fillna(False), strings)
+    return urls.astype(object)
@@ -0,0 +1,184 @@
+"""Opt-in EXPLAIN instrumentation of the Balam queries.
+
+While enabled, every SELECT/INSERT/UPDATE/DELETE issued by a function of
+`database_queries` is explained on the same connection right before it runs, and
+a JSON line with the SQL, parameters, planning time, execution time and
+plan is appended to a local file. Diffing these files between releases
+or schema changes shows which query function regressed and why.
+
+Instrumentation is enabled either with the environment variables
+
+    BALAM_EXPLAIN_LOG=/tmp/balam_plans.jsonl
+    BALAM_EXPLAIN_ANALYZE=1   # optional, use EXPLAIN ANALYZE
+
+or for a block of code with the `explain_queries` context manager:
+
+    with explain_queries('/tmp/balam_plans.jsonl', analyze=True):
+        get_data_processed(...)
+
+With ANALYZE, data-modifying statements are explained inside a savepoint
+that is rolled back, so they are not applied twice.
+"""
+import datetime
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from ds_db_access.balam.balam_models import database
+
+EXPLAIN_LOG_ENV = 'BALAM_EXPLAIN_LOG'
+EXPLAIN_ANALYZE_ENV = 'BALAM_EXPLAIN_ANALYZE'
+
+QUERIES_MODULE = 'ds_db_access.balam.database_queries'
+EXPLAINED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+DATA_MODIFYING_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+_state = threading.local()
+_config = {'path': None, 'analyze': False}
+_write_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """Return True if query plans are being recorded."""
+    return _config['path'] is not None
+
+
+def enable(path: str, analyze: bool = False):
+    """Start recording the plans of the queries into the JSONL file `path`."""
+    _config['path'] = path
+    _config['analyze'] = analyze
+    if 'execute_sql' not in vars(database):
+        database.execute_sql = _instrumented_execute_sql
+
+
+def disable():
+    """Stop recording query plans."""
+    _config['path'] = None
+    _config['analyze'] = False
+    vars(database).pop('execute_sql', None)
+
+
+def enable_from_environment():
+    """Enable the instrumentation if `BALAM_EXPLAIN_LOG` is set."""
+    path = os.environ.get(EXPLAIN_LOG_ENV)
+    if path:
+        analyze = os.environ.get(EXPLAIN_ANALYZE_ENV, '').lower() in ('1', 'true', 'yes')
+        enable(path, analyze=analyze)
+
+
+@contextmanager
+def explain_queries(path: str, analyze: bool = False):
+    """Record the plans of the queries run inside the block.
+
+    Parameters
+    ----------
+    path : str
+        JSONL file the records are appended to.
+    analyze : bool, optional
+        If True, use EXPLAIN ANALYZE to get actual execution times
+        (default is False).
+    """
+    previous = dict(_config)
+    enable(path, analyze=analyze)
+    try:
+        yield
+    finally:
+        if previous['path'] is None:
+            disable()
+        else:
+            enable(previous['path'], analyze=previous['analyze'])
+
+
+def explain_statement(sql: str, params=None):
+    """Explain a statement and append its record to the JSONL file.
+
+    Used for statements that do not go through `database.execute_sql`,
+    such as the ones run on named cursors.
+    """
+    record = _explain(sql, params)
+    if record is not None:
+        _write_record(record)
+
+
+def _explain(sql: str, params=None) -> Optional[dict]:
+    """Explain a statement and return its record.
+
+    Failures are recorded instead of raised, so instrumentation never
+    breaks the query it observes.
+    """
+    if not is_enabled() or getattr(_state, 'active', False):
+        return None
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    if statement not in EXPLAINED_STATEMENTS:
+        return None
+    function = _calling_query_function()
+    if function is None:
+        return None
+
+    analyze = _config['analyze']
+    record = {'timestamp': datetime.datetime.now().isoformat(),
+              'function': function,
+              'sql': sql,
+              'params': list(params or []),
+              'analyze': analyze}
+    _state.active = True
+    try:
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON, SUMMARY'
+        with database.atomic() as transaction:
+            cursor = database.execute_sql(f"EXPLAIN ({options}) {sql}", params)
+            explain = cursor.fetchone()[0]
+            if analyze and statement in DATA_MODIFYING_STATEMENTS:
+                transaction.rollback()
+        if isinstance(explain, str):
+            explain = json.loads(explain)
+        explain = explain[0]
+        record['planning_ms'] = explain.get('Planning Time')
+        record['execution_ms'] = explain.get('Execution Time')
+        record['plan'] = explain['Plan']
+    except Exception as exc:
+        record['error'] = str(exc)
+    finally:
+        _state.active = False
+    return record
+
+
+def _instrumented_execute_sql(sql, params=None, *args, **kwargs):
+    """`database.execute_sql` replacement that records the plan first.
+
+    The statement is explained before it runs, so EXPLAIN ANALYZE of a
+    data-modifying statement sees the same rows as the real execution.
+    """
+    execute_sql = type(database).execute_sql
+    record = _explain(sql, params)
+    if record is None:
+        return execute_sql(database, sql, params, *args, **kwargs)
+
+    start = time.perf_counter()
+    try:
+        return execute_sql(database, sql, params, *args, **kwargs)
+    finally:
+        record['duration_ms'] = (time.perf_counter() - start) * 1000
+        if record.get('execution_ms') is None:
+            record['execution_ms'] = record['duration_ms']
+        _write_record(record)
+
+
+def _calling_query_function() -> Optional[str]:
+    """Name of the outermost `database_queries` function in the stack."""
+    name = None
+    frame = inspect.currentframe()
+    while frame is not None:
+        if frame.f_globals.get('__name__') == QUERIES_MODULE:
+            name = frame.f_code.co_name
+        frame = frame.f_back
+    return name
+
+
+def _write_record(record: dict):
+    with _write_lock:
+        with open(_config['path'], 'a') as log_file:
+            log_file.write(json.dumps(record, default=str) + '\n')
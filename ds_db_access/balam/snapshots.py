@@ -0,0 +1,190 @@
+"""Incremental local Parquet snapshots of pipeline results.
+
+A snapshot materialises the `get_processed_data` projection of one
+project, site, pipeline version and file type under
+
+    <root>/project=<title>/site=<site>/pipeline=<name>/version=<version>/filetype=<filetype>/
+
+as a `data.parquet` file next to a `_snapshot.json` file holding the
+watermark: the latest creation or update time of the observations (and
+their geometries and the events of their files) already stored. A refresh only downloads the rows
+modified since the watermark, and removes the observations that no
+longer exist in the database by comparing the stored ids with an
+id-only tombstone query, so daily syncs move a small fraction of the
+data.
+
+The modification times are set when a row is written, not when its
+transaction commits, so a write committed late can carry a time older
+than a watermark already stored. The watermark therefore never moves
+past `WATERMARK_SAFETY_LAG` before the start of the refresh, and the
+rows modified in that window are downloaded again by the next refresh.
+Writes committed more than the lag after their modification time are
+only picked up by a rebuild.
+
+Linking files to events updates the events, so the observations of
+those files are downloaded again with their new 'seq_id'. Changes to
+the file metadata (date, coordinates, site information) do not move the
+watermark; rebuild the snapshot with `full=True` after editing them. Snapshots written with another `SNAPSHOT_VERSION` are
+rebuilt automatically.
+"""
+import datetime
+import json
+import os
+from typing import Dict
+
+import pandas as pd
+
+from ds_db_access.balam.database_queries import get_processed_data_changes
+from ds_db_access.balam.database_queries import get_processed_observation_ids
+
+DATA_FILE = 'data.parquet'
+META_FILE = '_snapshot.json'
+# Version of the stored columns, bumped when `get_processed_data` changes them.
+SNAPSHOT_VERSION = 2
+# Columns holding JSON values, stored as JSON text in Parquet.
+JSON_COLUMNS = ('observation_tag', 'longitude', 'latitude')
+# How far behind the refresh time the watermark is kept.
+WATERMARK_SAFETY_LAG = datetime.timedelta(minutes=10)
+
+
+def snapshot_dir(root: str, project_title: str, site: str, pipeline_name: str,
+                 pipeline_version: str, filetype: str) -> str:
+    """Return the directory of the snapshot partition."""
+    return os.path.join(root,
+                        f"project={project_title}",
+                        f"site={site}",
+                        f"pipeline={pipeline_name}",
+                        f"version={pipeline_version}",
+                        f"filetype={filetype}")
+
+
+def refresh_snapshot(root: str,
+                     project_title: str,
+                     site: str,
+                     pipeline_name: str,
+                     pipeline_version: str,
+                     filetype: str,
+                     full: bool = False,
+                     safety_lag: datetime.timedelta = WATERMARK_SAFETY_LAG) -> Dict[str, int]:
+    """Create or incrementally refresh a snapshot partition.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the snapshots.
+    project_title : str
+        The title of the project.
+    site : str
+        The identifier of the site.
+    pipeline_name : str
+        The name of the pipeline.
+    pipeline_version : str
+        The version of the pipeline.
+    filetype : str
+        The type of data files ('image' or 'video').
+    full : bool, optional
+        If True, ignore the stored snapshot and download every row
+        (default is False).
+    safety_lag : datetime.timedelta, optional
+        The watermark is kept at least this far behind the start of the
+        refresh (default is 10 minutes).
+
+    Returns
+    -------
+    Dict[str, int]
+        'fetched' rows downloaded, 'deleted' rows removed by the
+        tombstone query and total 'rows' stored.
+    """
+    partition_dir = snapshot_dir(root, project_title, site, pipeline_name, pipeline_version, filetype)
+    data_path = os.path.join(partition_dir, DATA_FILE)
+    meta_path = os.path.join(partition_dir, META_FILE)
+    query_args = {'mime_type': 'image/%' if filetype == 'image' else 'video/%',
+                  'project_title': project_title,
+                  'site': site,
+                  'pipeline_name': pipeline_name,
+                  'pipeline_version': pipeline_version}
+
+    horizon = datetime.datetime.now() - safety_lag
+    watermark = None
+    stored = None
+    if not full and os.path.exists(meta_path) and os.path.exists(data_path):
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('version') == SNAPSHOT_VERSION:
+            if meta.get('watermark') is not None:
+                watermark = datetime.datetime.fromisoformat(meta['watermark'])
+            stored = pd.read_parquet(data_path)
+
+    changes = get_processed_data_changes(**query_args, since=watermark)
+    deleted = 0
+    if stored is None:
+        data = _encode_json_columns(changes)
+    else:
+        # Rows at the watermark are fetched again, so drop the stored
+        # version of every changed observation before appending it.
+        data = stored[~stored['observation_id'].isin(changes['observation_id'])]
+        observation_ids = get_processed_observation_ids(**query_args)
+        alive = data['observation_id'].isin(observation_ids)
+        deleted = int((~alive).sum())
+        data = pd.concat([data[alive], _encode_json_columns(changes)], ignore_index=True)
+
+    if changes.shape[0] > 0:
+        new_watermark = min(pd.Timestamp(changes['modified_at'].max()).to_pydatetime(), horizon)
+        watermark = new_watermark if watermark is None else max(watermark, new_watermark)
+
+    os.makedirs(partition_dir, exist_ok=True)
+    data.to_parquet(f"{data_path}.tmp", index=False)
+    os.replace(f"{data_path}.tmp", data_path)
+    with open(f"{meta_path}.tmp", 'w') as meta_file:
+        json.dump({'version': SNAPSHOT_VERSION,
+                   'watermark': None if watermark is None else watermark.isoformat(),
+                   'rows': int(data.shape[0]),
+                   'refreshed_at': datetime.datetime.now().isoformat()}, meta_file)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+    return {'fetched': int(changes.shape[0]), 'deleted': deleted, 'rows': int(data.shape[0])}
+
+
+def load_snapshot(root: str,
+                  project_title: str,
+                  site: str,
+                  pipeline_name: str,
+                  pipeline_version: str,
+                  filetype: str) -> pd.DataFrame:
+    """Read a snapshot partition with the columns of `get_processed_data`.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the snapshots.
+    project_title : str
+        The title of the project.
+    site : str
+        The identifier of the site.
+    pipeline_name : str
+        The name of the pipeline.
+    pipeline_version : str
+        The version of the pipeline.
+    filetype : str
+        The type of data files ('image' or 'video').
+
+    Returns
+    -------
+    pd.DataFrame
+        The stored rows.
+    """
+    partition_dir = snapshot_dir(root, project_title, site, pipeline_name, pipeline_version, filetype)
+    data = pd.read_parquet(os.path.join(partition_dir, DATA_FILE))
+    for column in JSON_COLUMNS:
+        if column in data.columns:
+            data[column] = [None if value is None else json.loads(value) for value in data[column]]
+    return data.drop(columns=['modified_at'])
+
+
+def _encode_json_columns(data: pd.DataFrame) -> pd.DataFrame:
+    """Encode the JSON columns of rows read from the database as text."""
+    data = data.copy()
+    for column in JSON_COLUMNS:
+        if column in data.columns:
+            data[column] = [None if value is None else json.dumps(value) for value in data[column]]
+    return data
@@ -1,64 +1,56 @@
 
+import datetime
 import pandas as pd
 from tqdm import tqdm
 import os
 from uuid import UUID
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
 
-from ds_db_access.balam.database_queries import get_file_id_by_url
+from ds_db_access.balam.database_queries import resolve_file_ids
 from ds_db_access.balam.database_queries import get_pipeline_id_by_name_version
 from ds_db_access.balam.database_queries import get_processed_data
+from ds_db_access.balam.database_queries import iter_processed_data
+from ds_db_access.balam.database_queries import iter_files_data_to_process
+from ds_db_access.balam.database_queries import READ_CHUNK_SIZE
 from ds_db_access.balam.database_queries import get_user_id
 from ds_db_access.balam.database_queries import get_project_id_by_title
-from ds_db_access.balam.database_queries import insert_processed_files
+from ds_db_access.balam.database_queries import insert_processed_files_many
 from ds_db_access.balam.database_queries import get_files_data_to_process
+from ds_db_access.balam.database_queries import get_files_data_to_process_since
 from ds_db_access.balam.database_queries import insert_pipeline_info
 from ds_db_access.balam.database_queries import delete_obs_geom
 from ds_db_access.balam.database_queries import get_pipeline_execution_params
-from ds_db_access.balam.database_queries import insert_observations_and_observations_geom
+from ds_db_access.balam.database_queries import insert_observations_bulk
+from ds_db_access.balam.database_queries import copy_observations
+from ds_db_access.balam.database_queries import upsert_observations
+from ds_db_access.balam.database_queries import insert_observations_batch_commit
+from ds_db_access.balam.database_queries import OBSERVATIONS_CHUNK_SIZE
+from ds_db_access.balam.database_queries import COPY_CHUNK_SIZE
 from ds_db_access.balam.database_queries import delete_observations
 from ds_db_access.balam.database_queries import delete_processed_files
 from ds_db_access.balam.database_queries import insert_observations_method
 from ds_db_access.balam.database_queries import get_obs_method_id
-from ds_db_access.balam.database_queries import insert_events
-from ds_db_access.balam.database_queries import insert_events_files
+from ds_db_access.balam.database_queries import insert_events_bulk
 from ds_db_access.balam.database_queries import get_files_id_not_in_events
+from ds_db_access.balam.database_queries import invalidate_processed_data_cache
+from ds_db_access.balam.cache_utils import processed_data_cache
 from conabio_ml.utils.logger import get_logger
 from ds_db_access.balam.params_db import S3_PATH
+from ds_db_access.balam.path_utils import file_paths_to_urls
+from ds_db_access.balam.path_utils import find_file_url  # noqa: F401
+from ds_db_access.balam.path_utils import lambda_handler  # noqa: F401
+from ds_db_access.balam.path_utils import urls_to_file_paths
 
 
 logger = get_logger(__name__)
 
 
-def find_file_url(file_path: str, s3_path: str) -> str:
-    """
-    Generate a URL for a file located in a specific directory.
-
-    This function constructs a URL for a file based on its relative path
-    within a designated directory.
-
-    Parameters
-    ----------
-    file_path : str
-        The relative path to the file within the specified directory.
-
-    Returns
-    -------
-    str
-        The URL representing the file's location.
-    """
-    url = os.path.join(s3_path, file_path)
-
-    return url
-
-
-def lambda_handler(s):
-    parts = s.split('/')
-    data_index = parts.index('data')
-    result = '/'.join(parts[data_index + 1:])
-    return result
-
 # region GET FUNCTIONS
 
 
@@ -164,11 +156,12 @@ def get_pipeline_exec_params(pipeline_name: str, pipeline_version: str):
     return data
 
 
-def get_data_to_process(project_title: str,
-                        site: str,
+def get_data_to_process(project_title: Union[str, List[str]],
+                        site: Union[str, List[str]],
                         filetype: str,
                         pipeline_name: str,
-                        pipeline_version: str) -> pd.DataFrame:
+                        pipeline_version: str,
+                        use_file_context: bool = False) -> pd.DataFrame:
     """
     Retrieve data to process based on project, site, and file type.
 
@@ -178,16 +171,21 @@ def get_data_to_process(project_title: str,
 
     Parameters
     ----------
-    project_title : str
-        The title of the project for which data should be retrieved.
-    site : str
-        The identifier of the site where the data was collected.
+    project_title : Union[str, List[str]]
+        The title of the project for which data should be retrieved,
+        or a list of titles.
+    site : Union[str, List[str]]
+        The identifier of the site where the data was collected, or a
+        list of identifiers fetched with a single query.
     filetype : str
         The type of data files to retrieve ('image' or 'video').
     pipeline_name : str
         The name of the pipeline.
     pipeline_version : str
         The version of the pipeline.
+    use_file_context : bool, optional
+        If True, read the file context from the FileContext materialized
+        view, which must be refreshed after uploads (default is False).
 
     Returns
     -------
@@ -198,8 +196,8 @@ def get_data_to_process(project_title: str,
     Notes
     -----
     The returned DataFrame contains columns: 'file_path', 'file_id',
-    'timestamp', 'longitude', 'latitude', 'site_identifier',
-    'sampling_area', 'device', 'ecosystem'.
+    'datetime', 'longitude', 'latitude', 'site_identifier',
+    'sampling_area', 'device', 'ecosystem', 'project_title'.
     """
     if filetype == 'image':
         mime_type = 'image/%'
@@ -207,23 +205,70 @@ def get_data_to_process(project_title: str,
         mime_type = 'video/%'
 
     try:
-        results = get_files_data_to_process(mime_type=mime_type, pipeline_name=pipeline_name,
-                                            pipeline_version=pipeline_version, site=site, project_title=project_title)
+        data = get_files_data_to_process(mime_type=mime_type, pipeline_name=pipeline_name,
+                                         pipeline_version=pipeline_version, site=site,
+                                         project_title=project_title, as_dataframe=True,
+                                         use_file_context=use_file_context)
     except ValueError as e:
         print(f"Error: {e}")
         return
 
-    data = pd.DataFrame(results)
+    return _format_files_data(data)
 
-    if data.shape[0] > 0:
-        data = data.rename(columns={'url': 'file_path'})
-        data['file_path'] = data['file_path'].apply(lambda_handler)
-        data['datetime'] = pd.to_datetime(
-            data['date'].astype(str) + ' ' + data['time'])
-    return data
 
+def get_data_to_process_since(project_title: Union[str, List[str]],
+                              site: Union[str, List[str]],
+                              filetype: str,
+                              pipeline_name: str,
+                              pipeline_version: str,
+                              since: Optional[datetime.datetime] = None,
+                              cursor: Optional[str] = None) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Retrieve the data to process uploaded since the previous poll.
+
+    Delta counterpart of `get_data_to_process` for schedulers: only the
+    files created after `since`, or after the position of `cursor`, that
+    are still unprocessed by the pipeline are returned, so the cost of a
+    poll grows with the new uploads instead of with the archive.
+
+    Parameters
+    ----------
+    project_title : Union[str, List[str]]
+        The title of the project for which data should be retrieved,
+        or a list of titles.
+    site : Union[str, List[str]]
+        The identifier of the site where the data was collected, or a
+        list of identifiers.
+    filetype : str
+        The type of data files to retrieve ('image' or 'video').
+    pipeline_name : str
+        The name of the pipeline.
+    pipeline_version : str
+        The version of the pipeline.
+    since : datetime.datetime, optional
+        Creation time after which files are returned, used when no
+        cursor is given (default is None).
+    cursor : str, optional
+        Opaque cursor returned by the previous call (default is None).
 
-def get_data_processed(filetype: str, project_title: str, site: str, pipeline_name: str, pipeline_version: str) -> pd.DataFrame:
+    Returns
+    -------
+    Tuple[pd.DataFrame, Optional[str]]
+        The data to process, with the columns of `get_data_to_process`
+        plus 'created_at', and the cursor for the next poll.
+    """
+    mime_type = 'image/%' if filetype == 'image' else 'video/%'
+    data, cursor = get_files_data_to_process_since(mime_type=mime_type, pipeline_name=pipeline_name,
+                                                   pipeline_version=pipeline_version, site=site,
+                                                   project_title=project_title, since=since,
+                                                   cursor=cursor)
+    return _format_files_data(data), cursor
+
+
+def get_data_processed(filetype: str, project_title: Union[str, List[str]], site: Union[str, List[str]],
+                       pipeline_name: str, pipeline_version: str, use_cache: bool = False,
+                       use_file_context: bool = False,
+                       columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
     """
     Retrieve processed data based on file type, project, site, and
     pipeline.
@@ -237,14 +282,28 @@ def get_data_processed(filetype: str, project_title: str, site: str, pipeline_na
     ----------
     filetype : str
         The type of data files to retrieve ('image' or 'video').
-    project_title : str
-        The title of the project for which data should be retrieved.
-    site : str
-        The identifier of the site where the data was collected.
+    project_title : Union[str, List[str]]
+        The title of the project for which data should be retrieved,
+        or a list of titles.
+    site : Union[str, List[str]]
+        The identifier of the site where the data was collected, or a
+        list of identifiers fetched with a single query.
     pipeline_name : str
         The name of the pipeline used for processing.
     pipeline_version : str
         The version of the pipeline used for processing.
+    use_cache : bool, optional
+        If True, serve repeated calls from the processed data cache
+        (memory, plus disk if BALAM_RESULT_CACHE_DIR is set). The write
+        functions of this package invalidate the affected results
+        (default is False).
+    use_file_context : bool, optional
+        If True, read the file context from the FileContext materialized
+        view, which must be refreshed after uploads (default is False).
+    columns : Iterable[str], optional
+        Columns of `get_processed_data` to read, e.g. ['file_id',
+        'observation_tag', 'score'] (default is None, every column).
+        'url' is returned as 'file_path'.
 
     Returns
     -------
@@ -255,10 +314,22 @@ def get_data_processed(filetype: str, project_title: str, site: str, pipeline_na
     Notes
     -----
     - The returned DataFrame contains columns: 'file_path', 'file_id',
-    'timestamp', 'longitude', 'latitude', 'site_identifier',
-    'sampling_area', 'device', 'ecosystem'.
+    'datetime', 'longitude', 'latitude', 'site_identifier',
+    'sampling_area', 'device', 'ecosystem', 'project_title'.
     """
 
+    cache_key = {'filetype': filetype,
+                 'project_title': project_title,
+                 'site': site,
+                 'pipeline_name': pipeline_name,
+                 'pipeline_version': pipeline_version,
+                 'use_file_context': use_file_context,
+                 'columns': columns}
+    if use_cache:
+        data = processed_data_cache.get(**cache_key)
+        if data is not None:
+            return data
+
     if filetype == 'image':
         mime_type = 'image/%'
     else:
@@ -266,23 +337,132 @@ def get_data_processed(filetype: str, project_title: str, site: str, pipeline_na
 
     try:
         data = get_processed_data(mime_type=mime_type, project_title=project_title,
-                                  site=site, pipeline_name=pipeline_name, pipeline_version=pipeline_version)
+                                  site=site, pipeline_name=pipeline_name, pipeline_version=pipeline_version,
+                                  as_dataframe=True, use_file_context=use_file_context,
+                                  columns=columns)
     except ValueError as e:
         print(f"Error: {e}")
         return
 
-    data = pd.DataFrame(data)
+    data = _format_files_data(data)
+    if use_cache:
+        processed_data_cache.set(data, **cache_key)
+    return data
 
-    if data.shape[0] > 0:
-        data = data.rename(columns={'url': 'file_path'})
-        data['file_path'] = data['file_path'].apply(lambda_handler)
-        data['datetime'] = pd.to_datetime(
-            data['date'].astype(str) + ' ' + data['time'])
 
+def iter_data_to_process(project_title: Union[str, List[str]],
+                         site: Union[str, List[str]],
+                         filetype: str,
+                         pipeline_name: str,
+                         pipeline_version: str,
+                         chunk_size: int = READ_CHUNK_SIZE,
+                         use_file_context: bool = False) -> Iterator[pd.DataFrame]:
+    """
+    Stream the data to process in DataFrame chunks.
+
+    Chunked counterpart of `get_data_to_process`: the rows are read with
+    a server-side cursor, so only `chunk_size` rows are held in memory at
+    a time.
+
+    Parameters
+    ----------
+    project_title : Union[str, List[str]]
+        The title of the project for which data should be retrieved,
+        or a list of titles.
+    site : Union[str, List[str]]
+        The identifier of the site where the data was collected, or a
+        list of identifiers fetched with a single query.
+    filetype : str
+        The type of data files to retrieve ('image' or 'video').
+    pipeline_name : str
+        The name of the pipeline.
+    pipeline_version : str
+        The version of the pipeline.
+    chunk_size : int, optional
+        Number of rows per chunk (default is 50000).
+    use_file_context : bool, optional
+        If True, read the file context from the FileContext materialized
+        view, which must be refreshed after uploads (default is False).
+
+    Yields
+    ------
+    pd.DataFrame
+        Chunks with the same columns as `get_data_to_process`.
+    """
+    mime_type = 'image/%' if filetype == 'image' else 'video/%'
+    for data in iter_files_data_to_process(mime_type=mime_type, pipeline_name=pipeline_name,
+                                           pipeline_version=pipeline_version, site=site,
+                                           project_title=project_title, chunk_size=chunk_size,
+                                           use_file_context=use_file_context):
+        yield _format_files_data(data)
+
+
+def iter_data_processed(filetype: str,
+                        project_title: Union[str, List[str]],
+                        site: Union[str, List[str]],
+                        pipeline_name: str,
+                        pipeline_version: str,
+                        chunk_size: int = READ_CHUNK_SIZE,
+                        use_file_context: bool = False,
+                        columns: Optional[Iterable[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream the processed data of a site in DataFrame chunks.
+
+    Chunked counterpart of `get_data_processed`: the rows are read with
+    a server-side cursor, so sites with millions of observations can be
+    processed in constant memory.
+
+    Parameters
+    ----------
+    filetype : str
+        The type of data files to retrieve ('image' or 'video').
+    project_title : Union[str, List[str]]
+        The title of the project for which data should be retrieved,
+        or a list of titles.
+    site : Union[str, List[str]]
+        The identifier of the site where the data was collected, or a
+        list of identifiers fetched with a single query.
+    pipeline_name : str
+        The name of the pipeline used for processing.
+    pipeline_version : str
+        The version of the pipeline used for processing.
+    chunk_size : int, optional
+        Number of rows per chunk (default is 50000).
+    use_file_context : bool, optional
+        If True, read the file context from the FileContext materialized
+        view, which must be refreshed after uploads (default is False).
+    columns : Iterable[str], optional
+        Columns of `get_processed_data` to read (default is None, every
+        column).
+
+    Yields
+    ------
+    pd.DataFrame
+        Chunks with the same columns as `get_data_processed`.
+    """
+    mime_type = 'image/%' if filetype == 'image' else 'video/%'
+    for data in iter_processed_data(mime_type=mime_type, project_title=project_title,
+                                    site=site, pipeline_name=pipeline_name,
+                                    pipeline_version=pipeline_version, chunk_size=chunk_size,
+                                    use_file_context=use_file_context, columns=columns):
+        yield _format_files_data(data)
+
+
+def _format_files_data(data: pd.DataFrame) -> pd.DataFrame:
+    """Convert the urls, if they were read, to file paths.
+
+    The 'datetime' column is parsed by the database and arrives as
+    datetime64[ns].
+    """
+    if data.shape[0] > 0 and 'url' in data.columns:
+        data = data.rename(columns={'url': 'file_path'})
+        data['file_path'] = urls_to_file_paths(data['file_path'])
     return data
 
 
-def get_files_with_no_events(project_title: str, filetype: str, site_identifier: str):
+def get_files_with_no_events(project_title: Union[str, List[str]], filetype: str,
+                             site_identifier: Union[str, List[str]],
+                             use_file_context: bool = False):
 
     if filetype == 'image':
         mime_type = 'image/%'
@@ -291,18 +471,15 @@ def get_files_with_no_events(project_title: str, filetype: str, site_identifier:
     try:
         data = get_files_id_not_in_events(project_title=project_title,
                                           mime_type=mime_type,
-                                          site_identifier=site_identifier)
+                                          site_identifier=site_identifier,
+                                          as_dataframe=True,
+                                          use_file_context=use_file_context)
     except ValueError as e:
         print(f"Error: {e}")
         return
-    data = pd.DataFrame(data)
 
-    if data.shape[0] > 0:
-        data = data.rename(columns={'url': 'file_path'})
-        data['file_path'] = data['file_path'].apply(lambda_handler)
-        data['date_captured'] = pd.to_datetime(
-            data['date'].astype(str) + ' ' + data['time'])
-    return data
+    data = _format_files_data(data)
+    return data.rename(columns={'datetime': 'date_captured'})
 
 
 # endregion
@@ -311,31 +488,35 @@ def get_files_with_no_events(project_title: str, filetype: str, site_identifier:
 
 
 def insert_events_table(filetype: str, data_df: pd.DataFrame):
+    """
+    Insert the events of a dataset and the files belonging to them.
 
-    events_ids = []
-    total_iterations = len(data_df)
+    Each unique 'seq_id' becomes an event of type 'photo_sequence' and
+    each 'image_id' is linked to its event. Everything is written in bulk
+    inside one transaction; rows that already exist are skipped.
 
-    if filetype == 'image':
-        for event_id in tqdm(data_df['seq_id'].unique(), desc='Inserting Events'):
-            try:
-                primary_key = insert_events(event_id=event_id,
-                                            event_type='photo_sequence')
-                events_ids.append(primary_key)
-            except ValueError as e:
-                print(f"Error: {e}")
-
-        for row in tqdm(data_df.to_dict('records'),
-                        total=total_iterations, desc="Inserting Events Files"):
-            try:
-                primary_key = insert_events_files(event_id=row['seq_id'],
-                                                  file_id=row['image_id'])
-
-            except ValueError as e:
-                print(f"Error: {e}")
-    else:
+    Parameters
+    ----------
+    filetype : str
+        The type of files in the dataset. Only 'image' is supported.
+    data_df : pd.DataFrame
+        A Pandas DataFrame with 'seq_id' and 'image_id' columns.
+
+    Returns
+    -------
+    Dict[str, int]
+        Inserted and skipped counts of events and events files.
+    """
+    if filetype != 'image':
         return
 
-    return len(events_ids)
+    counts = insert_events_bulk(events_files=zip(data_df['seq_id'], data_df['image_id']),
+                                event_type='photo_sequence')
+    logger.info(f"{counts['events_inserted']} events inserted, "
+                f"{counts['events_skipped']} already existed.")
+    logger.info(f"{counts['events_files_inserted']} events files inserted, "
+                f"{counts['events_files_skipped']} already existed.")
+    return counts
 
 
 def insert_observations(observations_df: pd.DataFrame,
@@ -343,15 +524,17 @@ def insert_observations(observations_df: pd.DataFrame,
                         pipeline_id: str,
                         username: str,
                         observation_method: str,
-                        s3_path: str):
+                        s3_path: str,
+                        chunk_size: Optional[int] = None,
+                        mode: str = 'insert'):
     """
     Insert observations and associated geometries into the database.
 
     This function inserts observation data, including observations and
     associated geometries, into the database based on the provided
-    DataFrame and other parameters. It iterates through the DataFrame,
-    associates observations with files, and adds relevant information
-    to the database.
+    DataFrame and other parameters. It associates observations with
+    files and writes them in chunks, one transaction per chunk, either
+    with multi-row inserts or with PostgreSQL COPY.
 
     Parameters
     ----------
@@ -365,12 +548,40 @@ def insert_observations(observations_df: pd.DataFrame,
         The username of the user inserting the observations.
     observation_method_id : str
         The ID of the observation method used for these observations.
+    chunk_size : int, optional
+        Number of observations written per transaction (default depends
+        on `mode`).
+    mode : str, optional
+        Ingest engine (options: 'insert', 'copy', 'upsert'). 'copy'
+        streams the rows through COPY FROM STDIN and is meant for large
+        pipeline results. 'upsert' derives deterministic observation
+        ids, rewrites only the stored observations that changed and
+        deletes the ones of the same files missing from the results,
+        which makes pipeline reruns incremental. 'batch_commit'
+        inserts row by row inside savepoints, committing `chunk_size`
+        rows per transaction, so failing rows are logged and skipped
+        without aborting their chunk.
 
     Returns
     -------
     int
         The total number of observations inserted into the database.
     """
+    if mode == 'copy':
+        ingest_function = copy_observations
+        default_chunk_size = COPY_CHUNK_SIZE
+    elif mode == 'upsert':
+        ingest_function = upsert_observations
+        default_chunk_size = OBSERVATIONS_CHUNK_SIZE
+    elif mode == 'batch_commit':
+        ingest_function = insert_observations_batch_commit
+        default_chunk_size = OBSERVATIONS_CHUNK_SIZE
+    elif mode == 'insert':
+        ingest_function = insert_observations_bulk
+        default_chunk_size = OBSERVATIONS_CHUNK_SIZE
+    else:
+        raise ValueError(f"Unknown ingest mode: {mode}")
+    chunk_size = chunk_size or default_chunk_size
 
     try:
         user_id = get_user_id_by_username(username)
@@ -384,41 +595,31 @@ def insert_observations(observations_df: pd.DataFrame,
         print(f"Error: {e}")
         return
 
-    total_iterations = len(observations_df)
-
-    observations_df['url'] = observations_df.apply(
-        lambda row: find_file_url(row['file_path'], s3_path=s3_path), axis=1)
-
-    processed_files = []
-    for row in tqdm(observations_df.to_dict('records'), total=total_iterations, desc="Inserting observations"):
-        try:
-            file_id = get_file_id_by_url(row["url"])
-            processed_files.append(file_id)
-            observation_tag = {"predicted_label": row['observation_tag']}
-            if 'scientific_name' in observations_df.columns:
-                observation_tag['scientific_name'] = row['scientific_name']
-
-            insert_observations_and_observations_geom(file_id=file_id,
-                                                      observation_id=row['id'],
-                                                      observation_type=row['observation_type'],
-                                                      observation_tag=observation_tag,
-                                                      bbox=row['bbox'],
-                                                      score=row['score'],
-                                                      confidence=row['confidence'],
-                                                      project_id=project_id,
-                                                      pipeline_id=pipeline_id,
-                                                      user_id=user_id,
-                                                      observation_method_id=observation_method_id,
-                                                      video_frame_num=row['video_frame_num'],
-                                                      taxon_id=row['taxon_id']
-                                                      )
-        except:
-            print("no se pudo")  # agregar un logging
+    observations_df['url'] = file_paths_to_urls(observations_df['file_path'], s3_path=s3_path)
+
+    file_ids, unresolved_urls = resolve_file_ids(observations_df['url'])
+    for url in unresolved_urls:
+        logger.warning(f"File with url {url} does not exist in the Files table.")
+    observations_df['file_id'] = observations_df['url'].map(file_ids)
+    observations_df = observations_df[observations_df['file_id'].notna()].copy()
+
+    observation_tags = [{"predicted_label": label} for label in observations_df['observation_tag']]
+    if 'scientific_name' in observations_df.columns:
+        for observation_tag, scientific_name in zip(observation_tags, observations_df['scientific_name']):
+            observation_tag['scientific_name'] = scientific_name
+    observations_df['observation_tag'] = observation_tags
+
+    chunk_counts = ingest_function(observations_df,
+                                   project_id=project_id,
+                                   pipeline_id=pipeline_id,
+                                   user_id=user_id,
+                                   observation_method_id=observation_method_id,
+                                   chunk_size=chunk_size)
+
     if pipeline_id is not None:
-        for _file_id in tqdm(set(processed_files), desc="Inserting processed files", unit="file"):
-            insert_processed_files(file_id=_file_id, pipeline_id=pipeline_id)
+        insert_processed_files_many(file_ids=observations_df['file_id'], pipeline_id=pipeline_id)
 
-    return total_iterations
+    return sum(chunk_counts)
 
 
 def insert_pipeline(pipeline_id: Union[UUID, str],
@@ -520,6 +721,8 @@ def delete_observations_and_geoms(project_id: str, site_identifier: str, filetyp
     delete_count_processed_files = delete_processed_files(
         project_id=project_id, pipeline_id=pipeline_id, site_identifier=site_identifier, mime_type=mime_type)
     logger.info(f"{delete_count_processed_files} processed files deleted.")
+    invalidate_processed_data_cache(project_id=project_id, pipeline_id=pipeline_id,
+                                    site_identifier=site_identifier)
 
 
 # endregion
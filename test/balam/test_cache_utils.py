@@ -0,0 +1,96 @@
+import time
+
+import pandas as pd
+
+from ds_db_access.balam.cache_utils import LRUCache
+from ds_db_access.balam.cache_utils import ResultCache
+
+
+# region LRUCache
+
+
+def test_lru_cache_ttl(monkeypatch):
+    """Entries expire after the TTL and the oldest entries are evicted
+    """
+    clock = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    cache = LRUCache(maxsize=2, ttl=5)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+
+    clock[0] += 4.9
+    assert cache.get('a') == 1
+    clock[0] += 0.1
+    assert 'a' not in cache
+    assert cache.get('c', 'expired') == 'expired'
+
+# endregion
+
+
+# region ResultCache
+
+
+def test_result_cache_memory_and_disk_tiers(tmp_path):
+    """Results are served from memory and, across instances, from Parquet files on disk
+    """
+    data = pd.DataFrame({'file_id': ['a', 'b'], 'score': [0.5, 0.7],
+                         'datetime': pd.to_datetime(['2024-01-01', None]),
+                         'observation_tag': [{'predicted_label': 'bird', 'bbox': [0, 0, 1, 1]}, None]})
+    key = {'project_title': 'SiPeCaM', 'site': ['13', '7'], 'pipeline_name': 'megadetector',
+           'pipeline_version': 'v5', 'filetype': 'image'}
+
+    cache = ResultCache(cache_dir=str(tmp_path))
+    assert cache.get(**key) is None
+    cache.set(data, **key)
+
+    cached = cache.get(**{**key, 'site': ['7', '13']})
+    pd.testing.assert_frame_equal(cached, data)
+    cached['score'] = 0
+    pd.testing.assert_frame_equal(cache.get(**key), data)
+
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == ['.json', '.parquet']
+    other_process_cache = ResultCache(cache_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(other_process_cache.get(**key), data)
+
+
+def test_result_cache_invalidate(tmp_path):
+    """Invalidation removes the matching keys from both tiers
+    """
+    data = pd.DataFrame({'file_id': ['a']})
+    cache = ResultCache(cache_dir=str(tmp_path))
+    cache.set(data, project_title='SiPeCaM', site=['13', '7'], pipeline_name='megadetector',
+              pipeline_version='v5', filetype='image')
+    cache.set(data, project_title='SiPeCaM', site='13', pipeline_name='other',
+              pipeline_version='v1', filetype='image')
+
+    assert cache.invalidate(pipeline_name='megadetector', pipeline_version='v5', site='7') == 1
+    assert cache.get(project_title='SiPeCaM', site=['13', '7'], pipeline_name='megadetector',
+                     pipeline_version='v5', filetype='image') is None
+    assert ResultCache(cache_dir=str(tmp_path)).get(project_title='SiPeCaM', site='13',
+                                                    pipeline_name='other', pipeline_version='v1',
+                                                    filetype='image') is not None
+    cache.clear()
+    assert cache.is_empty()
+
+
+def test_result_cache_invalidate_from_other_process(tmp_path):
+    """A memory hit is dropped once another instance invalidates or rewrites its entry
+    """
+    key = {'project_title': 'SiPeCaM', 'pipeline_name': 'megadetector', 'pipeline_version': 'v5'}
+    cache = ResultCache(cache_dir=str(tmp_path))
+    other_process_cache = ResultCache(cache_dir=str(tmp_path))
+    cache.set(pd.DataFrame({'file_id': ['a']}), **key)
+    assert cache.get(**key) is not None
+
+    other_process_cache.invalidate(pipeline_name='megadetector')
+    assert cache.get(**key) is None
+
+    cache.set(pd.DataFrame({'file_id': ['a']}), **key)
+    other_process_cache.set(pd.DataFrame({'file_id': ['b']}), **key)
+    assert cache.get(**key)['file_id'].tolist() == ['b']
+
+# endregion
@@ -1,22 +1,73 @@
+import datetime
+import json
+
+import pandas as pd
 import pytest
 
 from ds_db_access.balam.database_queries import insert_events
 from ds_db_access.balam.database_queries import insert_events_files
+from ds_db_access.balam.database_queries import insert_events_bulk
 from ds_db_access.balam.database_queries import insert_observations_and_observations_geom
+from ds_db_access.balam.database_queries import insert_observations_bulk
+from ds_db_access.balam.database_queries import insert_observations_batch_commit
+from ds_db_access.balam.database_queries import copy_observations
+from ds_db_access.balam.database_queries import upsert_observations
+from ds_db_access.balam.database_queries import observation_ids
+from ds_db_access.balam.database_queries import validate_observation_batch
+from ds_db_access.balam.database_queries import resolve_file_ids
+from ds_db_access.balam.database_queries import get_processed_data
+from ds_db_access.balam.database_queries import iter_processed_data
+from ds_db_access.balam.database_queries import get_processed_data_changes
+from ds_db_access.balam.database_queries import get_processed_observation_ids
+from ds_db_access.balam.database_queries import get_files_data_to_process
+from ds_db_access.balam.database_queries import get_files_data_to_process_since
+from ds_db_access.balam.database_queries import get_pipeline_id_by_name_version
+from ds_db_access.balam.database_queries import get_project_id_by_title
+from ds_db_access.balam.database_queries import invalidate_lookup_cache
+from ds_db_access.balam.database_queries import warm_lookup_cache
 from ds_db_access.balam.database_queries import insert_processed_files
+from ds_db_access.balam.database_queries import insert_processed_files_many
 from ds_db_access.balam.database_queries import insert_pipeline_info
 from ds_db_access.balam.database_queries import insert_observations_method
+from ds_db_access.balam.database_queries import create_file_context_view
+from ds_db_access.balam.database_queries import refresh_file_context_view
+from ds_db_access.balam.database_queries import drop_file_context_view
+from ds_db_access.balam.database_queries import get_files_id_not_in_events
+from ds_db_access.balam.query_explain import explain_queries
 
 
 from ds_db_access.balam.balam_models import Events
+from ds_db_access.balam.balam_models import Files
 from ds_db_access.balam.balam_models import Observations
 from ds_db_access.balam.balam_models import ObservationMethod
 from ds_db_access.balam.balam_models import ObservationGeom
 from ds_db_access.balam.balam_models import PipelineInfo
+from ds_db_access.balam.balam_models import ProcessedFiles
+from ds_db_access.balam.balam_models import SamplingPoints
+from ds_db_access.balam.balam_models import Sites
+from ds_db_access.balam.balam_models import database
 
 from peewee import DoesNotExist, IntegrityError
 
 
+@pytest.fixture
+def processed_query_args():
+    """Processed data query arguments for the test pipeline and the site of a test file
+    """
+    pipeline = PipelineInfo.get(PipelineInfo.id == '9837d91b-9ae3-4cea-b4f4-50c6b239c2cd')
+    site = (Sites
+            .select(Sites.identifier)
+            .join(SamplingPoints, on=(SamplingPoints.site_id == Sites.id))
+            .join(Files, on=(Files.sampling_point_id == SamplingPoints.id))
+            .where(Files.id == '95c80f34-14c4-43c0-b1e4-a427742578a2')
+            .get()).identifier
+    return {'mime_type': '%',
+            'project_title': 'SiPeCaM',
+            'site': site,
+            'pipeline_name': pipeline.name,
+            'pipeline_version': pipeline.version}
+
+
 # region insert_observation_method
 
 
@@ -294,6 +345,36 @@ def test_insert_duplicate_processed_file():
         insert_processed_files(pipeline_id='ab382864-7052-4b1e-9ebb-d17618212932',
                                file_id='e53dc1ac-6f93-4929-91b4-8da103412b1c')
 
+
+def test_insert_processed_files_many_is_idempotent():
+    """Marking the same files twice only inserts them once
+    """
+    file_ids = ['95c80f34-14c4-43c0-b1e4-a427742578a2',
+                '95c80f34-14c4-43c0-b1e4-a427742578a2',
+                '7085a407-d9c5-455a-a4b1-365301363a8e']
+    pipeline_id = '9837d91b-9ae3-4cea-b4f4-50c6b239c2cd'
+    # Other tests may have marked these files already
+    (ProcessedFiles
+     .delete()
+     .where((ProcessedFiles.pipeline == pipeline_id) & (ProcessedFiles.file.in_(file_ids)))
+     .execute())
+
+    first_count = insert_processed_files_many(file_ids=file_ids, pipeline_id=pipeline_id)
+    second_count = insert_processed_files_many(file_ids=file_ids, pipeline_id=pipeline_id)
+
+    assert first_count == 2
+    assert second_count == 0
+
+
+def test_insert_processed_files_many_with_nonexistent_pipeline():
+    """Attempting to mark files with a non-existent pipeline ID
+    """
+    nonexistent_pipeline_id = '7085a407-d9c5-455a-a4b1-365301363a8e'
+
+    with pytest.raises(DoesNotExist, match=f"Pipeline with id {nonexistent_pipeline_id} does not exist in the PipelineInfo table."):
+        insert_processed_files_many(file_ids=['95c80f34-14c4-43c0-b1e4-a427742578a2'],
+                                    pipeline_id=nonexistent_pipeline_id)
+
 # endregion
 
 
@@ -555,6 +636,263 @@ def test_insert_duplicate_observation(file_id,  observation_id,
 
 # endregion
 
+# region insert_observations_bulk
+
+
+def test_insert_observations_bulk():
+    """Insert observations in several chunks and check per-chunk counts
+    """
+    observations_df = pd.DataFrame({
+        'id': ['0b3f5d1e-8a2c-4a53-9d0f-3c7f1e2a4b51',
+               '5c2a7e94-1d3b-4f6e-8a90-2b4c6d8e0f13',
+               'a7d9c1e3-5f2b-4d8a-9c6e-1f3a5b7d9e24'],
+        'file_id': ['95c80f34-14c4-43c0-b1e4-a427742578a2'] * 3,
+        'observation_type': ['animal', 'animal', 'empty'],
+        'observation_tag': [{"predicted_label": "small bird"},
+                            {"predicted_label": "small bird"},
+                            {"predicted_label": "empty"}],
+        'bbox': ['0,0,100,100', '10,10,50,50', None],
+        'score': [0.9, 0.8, None],
+        'confidence': [0.95, 0.85, None],
+        'video_frame_num': [1, 2, None],
+        'taxon_id': ['taxon_id_1', 'taxon_id_1', None]
+    })
+
+    chunk_counts = insert_observations_bulk(observations_df,
+                                            project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                                            pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+                                            user_id='699c9a06-8f1c-485f-9a57-3a28c905b9da',
+                                            observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811',
+                                            chunk_size=2)
+
+    assert chunk_counts == [2, 1]
+
+    observation = Observations.get(Observations.id == '5c2a7e94-1d3b-4f6e-8a90-2b4c6d8e0f13')
+    observation_geom = ObservationGeom.get(ObservationGeom.id == observation.geom_id)
+    assert observation_geom.bbox == '10,10,50,50'
+    assert observation_geom.video_frame_num == 2
+
+    empty_observation = Observations.get(Observations.id == 'a7d9c1e3-5f2b-4d8a-9c6e-1f3a5b7d9e24')
+    assert empty_observation.geom_id is None
+
+
+def test_insert_observations_bulk_duplicate_chunk():
+    """A chunk with an already stored observation is rolled back as a whole
+    """
+    observations_df = pd.DataFrame({
+        'id': ['c4e6a8b0-2d4f-4a6c-8e0a-2c4e6a8b0d1f',
+               '0b3f5d1e-8a2c-4a53-9d0f-3c7f1e2a4b51'],
+        'file_id': ['95c80f34-14c4-43c0-b1e4-a427742578a2'] * 2,
+        'observation_type': ['animal', 'animal'],
+        'observation_tag': [{"predicted_label": "small bird"}] * 2,
+        'bbox': ['0,0,100,100', '0,0,100,100'],
+        'score': [0.9, 0.9],
+        'confidence': [0.95, 0.95],
+        'video_frame_num': [1, 1],
+        'taxon_id': ['taxon_id_1', 'taxon_id_1']
+    })
+
+    with pytest.raises(IntegrityError):
+        insert_observations_bulk(observations_df,
+                                 project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                                 pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+                                 user_id='699c9a06-8f1c-485f-9a57-3a28c905b9da',
+                                 observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811')
+
+    with pytest.raises(DoesNotExist):
+        Observations.get(Observations.id == 'c4e6a8b0-2d4f-4a6c-8e0a-2c4e6a8b0d1f')
+
+# endregion
+
+# region upsert_observations
+
+
+def test_upsert_observations_rewrites_only_changed_rows():
+    """A rerun with new ids updates changed observations in place, skips unchanged ones
+    and deletes the ones it no longer produces
+    """
+    ids = {'project_id': 'a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+           'pipeline_id': '9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+           'user_id': '699c9a06-8f1c-485f-9a57-3a28c905b9da',
+           'observation_method_id': 'a92d1b4c-e226-47d8-8d12-f5aaac4cd811'}
+    file_id = 'e53dc1ac-6f93-4929-91b4-8da103412b1c'
+    observations_df = pd.DataFrame({
+        'id': ['6d8f0a2c-4e6a-4c8e-9a0c-2e4a6c8e0a13',
+               'b1d3f5a7-9c1e-4a3c-8e5a-7c9e1a3c5e24'],
+        'file_id': [file_id] * 2,
+        'observation_type': ['animal', 'animal'],
+        'observation_tag': [{"predicted_label": "small bird"}] * 2,
+        'bbox': ['0,0,100,100', '0,0,50,50'],
+        'score': [0.9, 0.8],
+        'confidence': [0.95, 0.85],
+        'video_frame_num': [1, 2],
+        'taxon_id': ['taxon_id_1', 'taxon_id_1']
+    })
+    first_id, second_id = observation_ids(observations_df, ids['pipeline_id'])
+
+    assert upsert_observations(observations_df, **ids) == [2]
+    assert not Observations.select().where(Observations.id == '6d8f0a2c-4e6a-4c8e-9a0c-2e4a6c8e0a13').exists()
+    first_geom_id = Observations.get(Observations.id == first_id).geom_id
+    second_geom_id = Observations.get(Observations.id == second_id).geom_id
+
+    # The rerun carries other ids, the deterministic ids match the stored rows
+    rerun_df = observations_df.copy()
+    rerun_df['id'] = ['0f1e2d3c-4b5a-4697-8877-665544332211', '1a2b3c4d-5e6f-4708-9192-a3b4c5d6e7f8']
+    rerun_df.loc[1, 'score'] = 0.7
+
+    assert upsert_observations(rerun_df, **ids) == [1]
+    observation = Observations.get(Observations.id == second_id)
+    assert observation.score == 0.7
+    assert observation.geom_id == second_geom_id
+
+    # A rerun that no longer detects the first observation removes it with its geometry
+    assert upsert_observations(rerun_df.iloc[1:], **ids) == [0]
+    assert not Observations.select().where(Observations.id == first_id).exists()
+    assert not ObservationGeom.select().where(ObservationGeom.id == first_geom_id).exists()
+    assert (Observations
+            .select()
+            .where((Observations.file == file_id) & (Observations.pipeline == ids['pipeline_id']))
+            .count()) == 1
+
+# endregion
+
+# region validate_observation_batch
+
+
+def test_validate_observation_batch():
+    """A batch with existing references has nothing missing
+    """
+    missing = validate_observation_batch(file_ids=['95c80f34-14c4-43c0-b1e4-a427742578a2',
+                                                   '95c80f34-14c4-43c0-b1e4-a427742578a2',
+                                                   'e53dc1ac-6f93-4929-91b4-8da103412b1c'],
+                                         project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                                         pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+                                         user_id='699c9a06-8f1c-485f-9a57-3a28c905b9da',
+                                         observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811')
+    assert missing == []
+
+
+def test_validate_observation_batch_missing_references():
+    """Every missing reference is reported instead of failing on the first one
+    """
+    nonexistent_id = '9754e2ad-f575-40e3-b568-3c4525ac7421'
+    missing = validate_observation_batch(file_ids=['95c80f34-14c4-43c0-b1e4-a427742578a2',
+                                                   nonexistent_id],
+                                         project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                                         pipeline_id=nonexistent_id,
+                                         user_id=nonexistent_id,
+                                         observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811')
+
+    assert sorted(missing, key=lambda item: item['table']) == [
+        {'table': 'Files', 'id': nonexistent_id},
+        {'table': 'PipelineInfo', 'id': nonexistent_id},
+        {'table': 'Users', 'id': nonexistent_id},
+    ]
+
+# endregion
+
+# region insert_observations_batch_commit
+
+
+def test_insert_observations_batch_commit_isolates_failing_rows():
+    """A duplicate observation is skipped without losing the rest of its chunk
+    """
+    observations_df = pd.DataFrame({
+        'id': ['d2f4a6c8-0e2a-4c4e-8a6c-8e0a2c4e6a35',
+               '0b3f5d1e-8a2c-4a53-9d0f-3c7f1e2a4b51',  # already stored
+               'e3a5c7e9-1b3d-4f5a-9b7d-9f1b3d5f7b46'],
+        'file_id': ['95c80f34-14c4-43c0-b1e4-a427742578a2'] * 3,
+        'observation_type': ['animal', 'animal', 'animal'],
+        'observation_tag': [{"predicted_label": "small bird"}] * 3,
+        'bbox': ['0,0,100,100', '1,1,2,2', '0,0,10,10'],
+        'score': [0.9, 0.9, 0.9],
+        'confidence': [0.95, 0.95, 0.95],
+        'video_frame_num': [1, 1, 1],
+        'taxon_id': ['taxon_id_1'] * 3
+    })
+    geom_count = ObservationGeom.select().count()
+
+    chunk_counts = insert_observations_batch_commit(observations_df,
+                                                    project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                                                    pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+                                                    user_id='699c9a06-8f1c-485f-9a57-3a28c905b9da',
+                                                    observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811')
+
+    assert chunk_counts == [2]
+    assert Observations.get(Observations.id == 'e3a5c7e9-1b3d-4f5a-9b7d-9f1b3d5f7b46') is not None
+    assert ObservationGeom.select().count() == geom_count + 2
+
+# endregion
+
+# region copy_observations
+
+
+def test_copy_observations():
+    """Copy observations with and without geometry
+    """
+    observations_df = pd.DataFrame({
+        'id': ['3e5a7c9b-1d2f-4b6a-8c0e-4f6a8c0e2b31',
+               '8b0d2f4a-6c8e-4a1b-9d3f-5b7d9f1a3c42'],
+        'file_id': ['95c80f34-14c4-43c0-b1e4-a427742578a2'] * 2,
+        'observation_type': ['animal', 'empty'],
+        'observation_tag': [{"predicted_label": "small bird"}, {"predicted_label": "empty"}],
+        'bbox': ['0,0,100,100', None],
+        'score': [0.9, None],
+        'confidence': [0.95, None],
+        'video_frame_num': [3, None],
+        'taxon_id': ['taxon_id_1', None]
+    })
+
+    chunk_counts = copy_observations(observations_df,
+                                     project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                                     pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+                                     user_id='699c9a06-8f1c-485f-9a57-3a28c905b9da',
+                                     observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811')
+
+    assert chunk_counts == [2]
+
+    observation = Observations.get(Observations.id == '3e5a7c9b-1d2f-4b6a-8c0e-4f6a8c0e2b31')
+    assert observation.observation_tag == {"predicted_label": "small bird"}
+    observation_geom = ObservationGeom.get(ObservationGeom.id == observation.geom_id)
+    assert observation_geom.bbox == '0,0,100,100'
+    assert observation_geom.video_frame_num == 3
+
+    empty_observation = Observations.get(Observations.id == '8b0d2f4a-6c8e-4a1b-9d3f-5b7d9f1a3c42')
+    assert empty_observation.geom_id is None
+    assert empty_observation.score is None
+
+
+def test_copy_observations_empty_strings_and_duplicates():
+    """Empty strings are not copied as NULL and duplicates raise the peewee IntegrityError
+    """
+    observations_df = pd.DataFrame({
+        'id': ['c1e3a5b7-9d0f-4e2a-8b4c-6d8e0f2a4b63', 'd2f4b6c8-0e1a-4f3b-9c5d-7e9f1a3b5c74'],
+        'file_id': ['95c80f34-14c4-43c0-b1e4-a427742578a2'] * 2,
+        'observation_type': ['animal', 'animal'],
+        'observation_tag': [{"predicted_label": 'say "hi"'}, {"predicted_label": "bird"}],
+        'bbox': [None, None],
+        'score': [None, None],
+        'confidence': [None, None],
+        'video_frame_num': [None, None],
+        'taxon_id': ['', None]
+    })
+    copy_params = dict(project_id='a500a996-35dd-4fce-a43f-424c41e398a9',  # sipecam
+                       pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd',
+                       user_id='699c9a06-8f1c-485f-9a57-3a28c905b9da',
+                       observation_method_id='a92d1b4c-e226-47d8-8d12-f5aaac4cd811')
+
+    assert copy_observations(observations_df, **copy_params) == [2]
+
+    observation = Observations.get(Observations.id == 'c1e3a5b7-9d0f-4e2a-8b4c-6d8e0f2a4b63')
+    assert observation.taxon_id == ''
+    assert observation.observation_tag == {"predicted_label": 'say "hi"'}
+    assert Observations.get(Observations.id == 'd2f4b6c8-0e1a-4f3b-9c5d-7e9f1a3b5c74').taxon_id is None
+
+    with pytest.raises(IntegrityError, match='Uniqueness Violation Detected'):
+        copy_observations(observations_df, **copy_params)
+
+# endregion
+
 # region events
 
 
@@ -656,6 +994,287 @@ def test_insert_non_existing_file_id_eventsfiles():
                             file_id='bb2d6dc1-ec29-4bc1-b277-af18a87821e7')
 # endregion
 
+# region resolve_file_ids
+
+
+def test_resolve_file_ids():
+    """Resolve repeated and unknown URLs in a single call
+    """
+    file = Files.get(Files.id == '95c80f34-14c4-43c0-b1e4-a427742578a2')
+    unknown_url = 's3://mordor/data/one_ring.jpg'
+
+    resolved, unresolved = resolve_file_ids([file.url, file.url, unknown_url])
+
+    assert resolved == {file.url: '95c80f34-14c4-43c0-b1e4-a427742578a2'}
+    assert unresolved == [unknown_url]
+
+    resolved, unresolved = resolve_file_ids([file.url])
+    assert resolved == {file.url: '95c80f34-14c4-43c0-b1e4-a427742578a2'}
+    assert unresolved == []
+
+# endregion
+
+# region insert_events_bulk
+
+
+def test_insert_events_bulk():
+    """Insert events with their files and skip existing rows on a rerun
+    """
+    events_files = [('4f1a3c5e-7b9d-4e2f-8a1c-3e5f7a9b1d20', '95c80f34-14c4-43c0-b1e4-a427742578a2'),
+                    ('4f1a3c5e-7b9d-4e2f-8a1c-3e5f7a9b1d20', 'e53dc1ac-6f93-4929-91b4-8da103412b1c'),
+                    ('4f1a3c5e-7b9d-4e2f-8a1c-3e5f7a9b1d20', 'e53dc1ac-6f93-4929-91b4-8da103412b1c')]
+
+    counts = insert_events_bulk(events_files=events_files, event_type='photo_sequence')
+    assert counts == {'events_inserted': 1,
+                      'events_skipped': 0,
+                      'events_files_inserted': 2,
+                      'events_files_skipped': 0}
+
+    counts = insert_events_bulk(events_files=events_files, event_type='photo_sequence')
+    assert counts == {'events_inserted': 0,
+                      'events_skipped': 1,
+                      'events_files_inserted': 0,
+                      'events_files_skipped': 2}
+
+    event = Events.get(Events.id == '4f1a3c5e-7b9d-4e2f-8a1c-3e5f7a9b1d20')
+    assert event.event_type == 'photo_sequence'
+
+# endregion
+
+# region iter_processed_data
+
+
+def test_iter_processed_data_matches_get_processed_data(processed_query_args):
+    """Streamed chunks contain the same rows as the list result
+    """
+    expected = get_processed_data(**processed_query_args)
+    chunks = list(iter_processed_data(**processed_query_args, chunk_size=1))
+
+    assert len(chunks) == len(expected)
+    assert all(chunk.shape[0] == 1 for chunk in chunks)
+    streamed = pd.concat(chunks, ignore_index=True)
+    assert set(streamed.columns) == set(expected[0].keys())
+    assert sorted(streamed['observation_id'].astype(str)) == \
+        sorted(str(row['observation_id']) for row in expected)
+
+
+def test_iter_processed_data_keeps_no_transaction_open(processed_query_args):
+    """Interleaved generators run outside of any transaction
+    """
+    first = iter_processed_data(**processed_query_args, chunk_size=1)
+    second = iter_processed_data(**processed_query_args, chunk_size=1)
+    first_ids, second_ids = [], []
+    for first_chunk, second_chunk in zip(first, second):
+        assert not database.in_transaction()
+        first_ids.extend(first_chunk['observation_id'])
+        second_ids.extend(second_chunk['observation_id'])
+    assert sorted(first_ids) == sorted(second_ids)
+    assert len(first_ids) == len(get_processed_data(**processed_query_args))
+    assert not database.in_transaction()
+
+
+def test_get_processed_data_as_dataframe(processed_query_args):
+    """The columnar fetch path returns the rows of the list path
+    """
+    expected = pd.DataFrame(get_processed_data(**processed_query_args))
+    data = get_processed_data(**processed_query_args, as_dataframe=True)
+
+    assert set(data.columns) == set(expected.columns)
+    assert data.shape[0] == expected.shape[0]
+    assert data['file_id'].map(type).eq(str).all()
+    assert str(data['video_frame_num'].dtype) == 'Int64'
+    assert str(data['datetime'].dtype) == 'datetime64[ns]'
+    assert sorted(data['observation_id']) == sorted(expected['observation_id'].astype(str))
+
+
+def test_get_processed_data_multiple_sites_and_projects(processed_query_args):
+    """A list of sites and projects returns the rows of every site
+    """
+    site = processed_query_args['site']
+
+    single_site = get_processed_data(**processed_query_args, as_dataframe=True)
+    multiple_sites = get_processed_data(**{**processed_query_args,
+                                           'project_title': ['SiPeCaM', 'Northern Cluster Mexico'],
+                                           'site': [site, 'nonexistent site']},
+                                        as_dataframe=True)
+
+    assert multiple_sites.shape[0] == single_site.shape[0]
+    assert set(multiple_sites['site_identifier']) == {site}
+    assert set(multiple_sites['project_title']) == {'SiPeCaM'}
+
+
+def test_get_processed_data_columns(processed_query_args):
+    """Only the requested columns are returned, with the same values
+    """
+    columns = ['observation_id', 'score', 'classificationProbability']
+
+    expected = get_processed_data(**processed_query_args, as_dataframe=True)
+    data = get_processed_data(**processed_query_args, as_dataframe=True, columns=columns)
+    assert list(data.columns) == columns
+    pd.testing.assert_frame_equal(
+        data.sort_values('observation_id').reset_index(drop=True),
+        expected[columns].sort_values('observation_id').reset_index(drop=True))
+
+    records = get_processed_data(**processed_query_args, columns=columns)
+    assert len(records) == data.shape[0]
+    assert all(list(record.keys()) == columns for record in records)
+
+    with pytest.raises(ValueError):
+        get_processed_data(**processed_query_args, columns=['label'])
+
+
+def test_get_processed_data_columns_file_in_several_events(processed_query_args):
+    """A file linked to several events keeps one row per observation in every projection
+    """
+    insert_events_bulk(events_files=[('6a1c3e5f-7b9d-4f1a-8c2e-4d6f8a0c2e41', '95c80f34-14c4-43c0-b1e4-a427742578a2'),
+                                     ('7b2d4f6a-8c0e-4a2b-9d3f-5e7a9b1d3f52', '95c80f34-14c4-43c0-b1e4-a427742578a2')],
+                       event_type='photo_sequence')
+
+    data = get_processed_data(**processed_query_args, as_dataframe=True)
+    projected = get_processed_data(**processed_query_args, as_dataframe=True, columns=['observation_id', 'score'])
+    assert data['observation_id'].is_unique
+    assert projected.shape[0] == data.shape[0]
+
+# endregion
+
+# region get_processed_data_changes
+
+
+def test_get_processed_data_changes_watermark(processed_query_args):
+    """Only rows modified since the watermark are returned
+    """
+    all_rows = get_processed_data_changes(**processed_query_args)
+    assert all_rows.shape[0] == len(get_processed_data(**processed_query_args))
+    assert set(all_rows['observation_id']) == get_processed_observation_ids(**processed_query_args)
+
+    watermark = all_rows['modified_at'].max()
+    latest_rows = get_processed_data_changes(**processed_query_args, since=watermark)
+    assert 0 < latest_rows.shape[0] <= all_rows.shape[0]
+    assert (latest_rows['modified_at'] >= watermark).all()
+
+
+def test_get_processed_data_changes_event_assignment(processed_query_args):
+    """Linking a file to an event moves its rows past the watermark
+    """
+    all_rows = get_processed_data_changes(**processed_query_args)
+    since = all_rows['modified_at'].max() + pd.Timedelta(microseconds=1)
+    assert get_processed_data_changes(**processed_query_args, since=since).shape[0] == 0
+
+    file_id = all_rows['file_id'].iloc[0]
+    insert_events_bulk(events_files=[('8c3e5f7a-9d1b-4c3e-8f5a-6b8d0f2a4c63', file_id)],
+                       event_type='photo_sequence')
+
+    latest_rows = get_processed_data_changes(**processed_query_args, since=since)
+    assert set(latest_rows['file_id']) == {file_id}
+    assert latest_rows.shape[0] == (all_rows['file_id'] == file_id).sum()
+
+# endregion
+
+# region get_files_data_to_process_since
+
+
+def test_get_files_data_to_process_since_cursor(processed_query_args):
+    """Polling with the returned cursor only returns newer files
+    """
+    query_args = {**processed_query_args,
+                  'pipeline_name': 'nonexistent',
+                  'pipeline_version': 'nonexistent'}
+
+    data, cursor = get_files_data_to_process_since(**query_args)
+    assert data.shape[0] == len(get_files_data_to_process(**query_args))
+    assert data['created_at'].is_monotonic_increasing
+    assert cursor is not None
+
+    new_data, new_cursor = get_files_data_to_process_since(**query_args, cursor=cursor)
+    assert new_data.shape[0] == 0
+    assert new_cursor == cursor
+
+    # Files newer than the safety lag are left for a later call
+    lagged_data, lagged_cursor = get_files_data_to_process_since(
+        **query_args, safety_lag=datetime.timedelta(days=365 * 100))
+    assert lagged_data.shape[0] == 0
+    assert lagged_cursor is None
+
+    with pytest.raises(ValueError):
+        get_files_data_to_process_since(**query_args, cursor='not a cursor')
+
+# endregion
+
+# region lookup cache
+
+
+def test_warm_lookup_cache(monkeypatch):
+    """After the warm-up the id lookups make no query
+    """
+    pipeline = PipelineInfo.get(PipelineInfo.id == '9837d91b-9ae3-4cea-b4f4-50c6b239c2cd')
+    invalidate_lookup_cache()
+    counts = warm_lookup_cache()
+    assert counts['PipelineInfo'] > 0 and counts['Projects'] > 0
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Unexpected query")
+    monkeypatch.setattr(PipelineInfo, 'get', fail)
+    assert get_pipeline_id_by_name_version(pipeline.name, pipeline.version) == str(pipeline.id)
+    assert get_project_id_by_title('SiPeCaM') == 'a500a996-35dd-4fce-a43f-424c41e398a9'
+    invalidate_lookup_cache()
+
+# endregion
+
+# region explain_queries
+
+
+def test_explain_queries_records_plans(tmp_path):
+    """Plans of the queries run inside the block are written as JSONL
+    """
+    log_path = tmp_path / 'plans.jsonl'
+    with explain_queries(str(log_path), analyze=True):
+        get_processed_data(mime_type='%', project_title='SiPeCaM', site='nonexistent site',
+                           pipeline_name='nonexistent', pipeline_version='nonexistent')
+        insert_processed_files_many(['95c80f34-14c4-43c0-b1e4-a427742578a2'],
+                                    pipeline_id='9837d91b-9ae3-4cea-b4f4-50c6b239c2cd')
+    # Queries outside the block are not recorded
+    get_processed_data(mime_type='%', project_title='SiPeCaM', site='nonexistent site',
+                       pipeline_name='nonexistent', pipeline_version='nonexistent')
+
+    records = [json.loads(line) for line in log_path.read_text().splitlines()]
+    functions = [record['function'] for record in records]
+    assert functions.count('get_processed_data') == 1
+    assert 'insert_processed_files_many' in functions
+    assert all('error' not in record for record in records)
+    processed_data_record = records[functions.index('get_processed_data')]
+    assert processed_data_record['plan']['Node Type']
+    assert processed_data_record['planning_ms'] is not None
+    assert processed_data_record['execution_ms'] is not None
+
+# endregion
+
+# region file context view
+
+
+def test_file_context_view_matches_joined_queries(processed_query_args):
+    """Reads through the FileContext view return the rows of the joined queries
+    """
+    no_events_args = {'project_title': 'SiPeCaM',
+                      'mime_type': '%',
+                      'site_identifier': processed_query_args['site']}
+
+    create_file_context_view()
+    try:
+        refresh_file_context_view()
+        for get_data, query_args, sort_column in (
+                (get_processed_data, processed_query_args, 'observation_id'),
+                (get_files_id_not_in_events, no_events_args, 'file_id')):
+            expected = get_data(**query_args, as_dataframe=True)
+            data = get_data(**query_args, as_dataframe=True, use_file_context=True)
+            assert list(data.columns) == list(expected.columns)
+            pd.testing.assert_frame_equal(
+                data.sort_values(sort_column).reset_index(drop=True),
+                expected.sort_values(sort_column).reset_index(drop=True))
+    finally:
+        drop_file_context_view()
+
+# endregion
+
 # region get function
 
 
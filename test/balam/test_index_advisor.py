@@ -0,0 +1,70 @@
+from ds_db_access.balam.index_advisor import create_index_statements
+from ds_db_access.balam.index_advisor import missing_indexes
+from ds_db_access.balam.index_advisor import recommended_indexes
+from ds_db_access.balam.index_advisor import _index_keys
+
+
+# region index definitions
+
+
+def test_index_keys():
+    """Keys of the pg_indexes definitions are normalized
+    """
+    assert _index_keys('CREATE INDEX "Observations_file_id" ON public."Observations" '
+                       'USING btree (file_id)') == ['file_id']
+    assert _index_keys('CREATE UNIQUE INDEX "Events_files_event_id_file_id" ON public."Events_files" '
+                       'USING btree (event_id, file_id)') == ['event_id', 'file_id']
+    assert _index_keys('CREATE INDEX "Files_file_metadata_DateTimeOriginal" ON public."Files" '
+                       "USING btree (((file_metadata ->> 'DateTimeOriginal'::text)))") == \
+        ["file_metadata ->> 'DateTimeOriginal'"]
+    assert _index_keys('CREATE INDEX "Files_mime_type_pattern" ON public."Files" '
+                       'USING btree (mime_type text_pattern_ops)') == ['mime_type text_pattern_ops']
+    assert _index_keys('CREATE INDEX "Files_file_metadata" ON public."Files" '
+                       'USING gin (file_metadata)') is None
+    assert _index_keys('CREATE INDEX "Files_recent" ON public."Files" '
+                       "USING btree (created_at) WHERE (mime_type = 'image/jpeg'::text)") is None
+
+# endregion
+
+
+# region missing indexes
+
+
+def test_missing_indexes():
+    """Only the recommendations without a valid covering index are reported
+    """
+    definitions = {
+        'Observations': ['CREATE INDEX "Observations_file_id_created_at" ON public."Observations" '
+                         'USING btree (file_id, created_at)'],
+        'ProcessedFiles': ['CREATE INDEX "ProcessedFiles_file_id_pipeline_id" ON public."ProcessedFiles" '
+                           'USING btree (file_id, pipeline_id)'],
+        'Files': ['CREATE INDEX "Files_file_metadata_DateTimeOriginal" ON public."Files" '
+                  "USING btree (((file_metadata ->> 'DateTimeOriginal'::text)))"],
+        'Events_files': ['CREATE INDEX "Events_files_file_id" ON public."Events_files" '
+                         'USING btree (file_id)'],
+    }
+    indexes = {table: [{'name': definition.split('"')[1], 'definition': definition,
+                        'keys': _index_keys(definition), 'valid': True}
+                       for definition in table_definitions]
+               for table, table_definitions in definitions.items()}
+    # A failed concurrent build
+    indexes['Events_files'][0]['valid'] = False
+    statistics = {'Files': {'rows': 1000, 'seq_scan': 10, 'seq_tup_read': 10000, 'idx_scan': 0},
+                  'Observations': {'rows': 10, 'seq_scan': 1, 'seq_tup_read': 10, 'idx_scan': 5}}
+
+    report = missing_indexes(indexes, statistics)
+    missing = {entry['recommendation'].name for entry in report}
+    expected = {recommendation.name for recommendation in recommended_indexes()} - \
+        {'Observations_file_id'}
+    assert missing == expected
+    assert report[0]['recommendation'].table == 'Files'
+
+    statements = create_index_statements(report)
+    assert 'DROP INDEX CONCURRENTLY IF EXISTS "Events_files_file_id"' in statements
+    assert statements.index('DROP INDEX CONCURRENTLY IF EXISTS "Events_files_file_id"') + 1 == \
+        statements.index('CREATE INDEX CONCURRENTLY IF NOT EXISTS "Events_files_file_id" '
+                         'ON "Events_files" ("file_id")')
+    assert 'CREATE INDEX CONCURRENTLY IF NOT EXISTS "Files_mime_type_pattern" '\
+        'ON "Files" ("mime_type" text_pattern_ops)' in statements
+
+# endregion
@@ -0,0 +1,115 @@
+import pandas as pd
+import pytest
+
+from ds_db_access.balam import ingest_utils
+from ds_db_access.balam.ingest_utils import IngestJournal
+from ds_db_access.balam.ingest_utils import align_chunks_to_files
+from ds_db_access.balam.ingest_utils import close_for_workers
+from ds_db_access.balam.ingest_utils import store_site_observations
+
+
+class FakeDataset:
+    """Dataset whose store_observations returns a fixed result"""
+
+    stored = None
+
+    def __init__(self, observations_df):
+        self.observations_df = observations_df
+
+    @classmethod
+    def from_dataframes(cls, dataframes):
+        return cls(dataframes[0])
+
+    def as_dataframe(self):
+        return self.observations_df
+
+    def store_observations(self, **kwargs):
+        return self.stored
+
+
+@pytest.fixture
+def offline_database(monkeypatch):
+    monkeypatch.setattr(ingest_utils.database, 'connect', lambda **kwargs: None)
+    monkeypatch.setattr(ingest_utils.database, 'close', lambda: None)
+
+
+# region IngestJournal
+
+
+def test_ingest_journal_scope(tmp_path):
+    """Committed chunks are only skipped for the same file, project and pipeline version
+    """
+    journal_path = str(tmp_path / 'ingest.jsonl')
+    results_path = str(tmp_path / 'results.csv')
+    scope = {'project_title': 'SiPeCaM', 'pipeline_name': 'megadetector', 'pipeline_version': '5.0'}
+
+    journal = IngestJournal(journal_path, results_path=results_path, chunk_size=10, **scope)
+    journal.commit(0, rows=10)
+    journal.commit(1, rows=10)
+    assert IngestJournal(journal_path, results_path=results_path, chunk_size=10,
+                         **scope).committed_chunks() == {0, 1}
+
+    for key, value in (('project_title', 'Other'), ('pipeline_name', 'other'), ('pipeline_version', '6.0')):
+        other_journal = IngestJournal(journal_path, results_path=results_path, chunk_size=10,
+                                      **{**scope, key: value})
+        assert other_journal.committed_chunks() == set()
+
+    with pytest.raises(ValueError):
+        IngestJournal(journal_path, results_path=results_path, chunk_size=20, **scope).committed_chunks()
+
+# endregion
+
+
+# region align_chunks_to_files
+
+
+def test_align_chunks_to_files():
+    """The rows of a file split between chunks end up in a single chunk
+    """
+    chunks = [pd.DataFrame({'item': ['a', 'a', 'b']}),
+              pd.DataFrame({'item': ['b', 'c']}),
+              pd.DataFrame({'item': ['c', 'c']})]
+
+    aligned = [chunk_df['item'].tolist() for chunk_df in align_chunks_to_files(chunks, file_field='item')]
+
+    assert aligned == [['a', 'a'], ['b', 'b'], ['c', 'c', 'c']]
+
+# endregion
+
+
+# region site workers
+
+
+@pytest.mark.parametrize(('stored', 'error'), [(2, None), (None, 'RuntimeError')])
+def test_store_site_observations_summary(monkeypatch, offline_database, stored, error):
+    """A store that returns nothing is reported as an error of the site
+    """
+    monkeypatch.setattr(FakeDataset, 'stored', stored)
+
+    summary = store_site_observations(FakeDataset,
+                                      site='1_1',
+                                      project_title='SiPeCaM',
+                                      pipeline_name='megadetector',
+                                      pipeline_version='5.0',
+                                      observations_df=pd.DataFrame({'item': ['a.jpg', 'b.jpg']}))
+
+    assert summary['rows'] == 2
+    assert summary['stored'] == stored
+    if error is None:
+        assert summary['error'] is None
+    else:
+        assert summary['error'].startswith(error)
+
+
+def test_close_for_workers_in_transaction(monkeypatch):
+    """The connection is not closed under an open transaction
+    """
+    closed = []
+    monkeypatch.setattr(ingest_utils.database, 'in_transaction', lambda: True)
+    monkeypatch.setattr(ingest_utils.database, 'close', lambda: closed.append(True))
+
+    with pytest.raises(ValueError):
+        close_for_workers()
+    assert closed == []
+
+# endregion
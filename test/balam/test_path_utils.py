@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from ds_db_access.balam.path_utils import file_paths_to_urls
+from ds_db_access.balam.path_utils import find_file_url
+from ds_db_access.balam.path_utils import lambda_handler
+from ds_db_access.balam.path_utils import urls_to_file_paths
+
+
+# region path normalisation
+
+
+def test_urls_to_file_paths_matches_lambda_handler():
+    """Known prefixes, the regex fallback and missing urls give the row-wise paths
+    """
+    urls = pd.Series(['s3://sipecam-open-data/data/13/1/image.jpg',
+                      's3://be-upload/ProcessedData/data/site/video.mp4',
+                      's3://other-bucket/uploads/data/13/image.jpg',
+                      's3://other-bucket/metadata/data/image.jpg',
+                      's3://other-bucket/data/data/image.jpg',
+                      'data/image.jpg'],
+                     index=[10, 11, 12, 13, 14, 15], dtype=object)
+
+    paths = urls_to_file_paths(urls)
+    expected = urls.apply(lambda_handler)
+    assert list(paths.index) == list(expected.index)
+    assert list(paths) == list(expected)
+
+    missing = urls_to_file_paths(pd.Series([urls[10], None], dtype=object))
+    assert missing[0] == '13/1/image.jpg'
+    assert pd.isna(missing[1])
+
+    with pytest.raises(ValueError):
+        urls_to_file_paths(pd.Series(['s3://other-bucket/image.jpg']))
+
+
+@pytest.mark.parametrize('s3_path', ['s3://sipecam-open-data/data/', 's3://sipecam-open-data/data'])
+def test_file_paths_to_urls_matches_find_file_url(s3_path):
+    """Relative and absolute paths give the row-wise urls
+    """
+    file_paths = pd.Series(['13/1/image.jpg', '/abs/image.jpg'])
+    urls = file_paths_to_urls(file_paths, s3_path=s3_path)
+    assert list(urls) == [find_file_url(file_path, s3_path=s3_path) for file_path in file_paths]
+
+# endregion
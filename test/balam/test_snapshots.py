@@ -0,0 +1,119 @@
+import datetime
+import json
+import os
+
+import pandas as pd
+
+from ds_db_access.balam import snapshots
+from ds_db_access.balam.snapshots import load_snapshot
+from ds_db_access.balam.snapshots import refresh_snapshot
+from ds_db_access.balam.snapshots import snapshot_dir
+
+PARTITION = ('SiPeCaM', '1_1', 'megadetector', '5.0', 'image')
+
+
+def _row(observation_id, label, modified_at):
+    return {'observation_id': observation_id,
+            'observation_tag': {'predicted_label': label},
+            'longitude': None,
+            'latitude': None,
+            'modified_at': modified_at}
+
+
+class FakeDatabase:
+    """Observations served to the snapshot queries"""
+
+    def __init__(self, monkeypatch, rows):
+        self.rows = {row['observation_id']: row for row in rows}
+        self.since_calls = []
+        monkeypatch.setattr(snapshots, 'get_processed_data_changes', self.get_processed_data_changes)
+        monkeypatch.setattr(snapshots, 'get_processed_observation_ids', self.get_processed_observation_ids)
+
+    def get_processed_data_changes(self, since=None, **query_args):
+        self.since_calls.append(since)
+        rows = [row for row in self.rows.values() if since is None or row['modified_at'] >= since]
+        return pd.DataFrame(rows, columns=['observation_id', 'observation_tag', 'longitude',
+                                           'latitude', 'modified_at'])
+
+    def get_processed_observation_ids(self, **query_args):
+        return set(self.rows)
+
+
+def _labels(root):
+    data = load_snapshot(root, *PARTITION)
+    return {row['observation_id']: row['observation_tag']['predicted_label'] for _, row in data.iterrows()}
+
+
+def _meta(root):
+    with open(os.path.join(snapshot_dir(root, *PARTITION), snapshots.META_FILE)) as meta_file:
+        return json.load(meta_file)
+
+
+# region refresh_snapshot
+
+
+def test_refresh_snapshot_first_build(monkeypatch, tmp_path):
+    """The first refresh downloads every row and stores the watermark
+    """
+    fake_database = FakeDatabase(monkeypatch, [_row('a', 'bird', datetime.datetime(2024, 1, 1)),
+                                               _row('b', 'empty', datetime.datetime(2024, 1, 2))])
+
+    counts = refresh_snapshot(str(tmp_path), *PARTITION)
+
+    assert counts == {'fetched': 2, 'deleted': 0, 'rows': 2}
+    assert fake_database.since_calls == [None]
+    assert _labels(str(tmp_path)) == {'a': 'bird', 'b': 'empty'}
+    assert _meta(str(tmp_path))['watermark'] == '2024-01-02T00:00:00'
+
+
+def test_refresh_snapshot_incremental(monkeypatch, tmp_path):
+    """Updated rows replace their stored version and deleted rows are removed
+    """
+    fake_database = FakeDatabase(monkeypatch, [_row('a', 'bird', datetime.datetime(2024, 1, 1)),
+                                               _row('b', 'empty', datetime.datetime(2024, 1, 2)),
+                                               _row('c', 'deer', datetime.datetime(2024, 1, 2))])
+    refresh_snapshot(str(tmp_path), *PARTITION)
+
+    fake_database.rows['b'] = _row('b', 'cat', datetime.datetime(2024, 1, 3))
+    del fake_database.rows['a']
+    counts = refresh_snapshot(str(tmp_path), *PARTITION)
+
+    assert fake_database.since_calls[-1] == datetime.datetime(2024, 1, 2)
+    assert counts == {'fetched': 2, 'deleted': 1, 'rows': 2}
+    assert _labels(str(tmp_path)) == {'b': 'cat', 'c': 'deer'}
+    assert _meta(str(tmp_path))['watermark'] == '2024-01-03T00:00:00'
+
+
+def test_refresh_snapshot_safety_lag(monkeypatch, tmp_path):
+    """The watermark stays behind the safety lag, so late commits are fetched again
+    """
+    recent = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    fake_database = FakeDatabase(monkeypatch, [_row('a', 'bird', datetime.datetime(2024, 1, 1)),
+                                               _row('b', 'empty', recent)])
+    refresh_snapshot(str(tmp_path), *PARTITION, safety_lag=datetime.timedelta(hours=1))
+
+    watermark = datetime.datetime.fromisoformat(_meta(str(tmp_path))['watermark'])
+    assert watermark < recent - datetime.timedelta(minutes=30)
+
+    # A row committed late, with a modification time older than the newest stored row
+    fake_database.rows['c'] = _row('c', 'deer', recent - datetime.timedelta(seconds=30))
+    counts = refresh_snapshot(str(tmp_path), *PARTITION, safety_lag=datetime.timedelta(hours=1))
+
+    assert counts == {'fetched': 2, 'deleted': 0, 'rows': 3}
+    assert _labels(str(tmp_path)) == {'a': 'bird', 'b': 'empty', 'c': 'deer'}
+
+
+def test_refresh_snapshot_version_bump(monkeypatch, tmp_path):
+    """Snapshots written with another version are rebuilt
+    """
+    fake_database = FakeDatabase(monkeypatch, [_row('a', 'bird', datetime.datetime(2024, 1, 1))])
+    refresh_snapshot(str(tmp_path), *PARTITION)
+
+    monkeypatch.setattr(snapshots, 'SNAPSHOT_VERSION', snapshots.SNAPSHOT_VERSION + 1)
+    counts = refresh_snapshot(str(tmp_path), *PARTITION)
+
+    assert fake_database.since_calls == [None, None]
+    assert counts == {'fetched': 1, 'deleted': 0, 'rows': 1}
+    assert _meta(str(tmp_path))['version'] == snapshots.SNAPSHOT_VERSION
+
+# endregion